@@ -0,0 +1,227 @@
+"""
+Checkpoint arena. Plays a new network against an old one across a process pool until a sequential probability ratio
+test (SPRT) decides whether new is stronger, and reports the Elo difference. Run from this directory:
+
+    python arena.py NEW OLD [--workers N] [--iterations N] [--max-games N] [--elo0 0] [--elo1 30]
+
+NEW and OLD are .keras models (eg. the model_it{i}.keras files rl_train saves) or export_weights .npz files, such as the
+checkpoints pipeline.py publishes. Games come in pairs from the same seed with colours swapped, since Tablut's sides are
+far from even. Each worker process loads both networks once and searches with leaf batching, so every network call
+evaluates batch_size positions.
+
+The test is the usual approximation over game scores: with n games scoring mean m and per game variance v, the log
+likelihood ratio of Elo elo1 against elo0 is n (s1 - s0) (2 m - s0 - s1) / (2 v), s0 and s1 being the expected scores at
+those Elo differences. It accepts new as stronger once the ratio reaches log((1 - beta) / alpha) and rejects it at
+log(beta / (1 - alpha)). While every game has had the same result the variance is 0, so one draw is added to the score
+for the ratio, or a win and a loss to a run of draws, which lets such a run still end the test.
+"""
+import argparse
+import math
+import multiprocessing as mp
+import os
+import time
+
+import numpy as np
+
+import mcts
+from game import Board
+from inference import NumpyNetwork, load_network
+
+def load_player(path, backend='numpy'):
+    """
+    Returns the network saved at path: an export_weights .npz for NumpyNetwork, otherwise a Keras model run by backend.
+    """
+    if path.endswith('.npz'):
+        return NumpyNetwork(path)
+    return load_network(backend, model_path=path)
+
+def expected_score(elo):
+    return 1 / (1 + 10 ** (-elo / 400))
+
+def score_stats(wins, draws, losses):
+    """
+    Returns (games, mean score, per game score variance).
+    """
+    games = wins + draws + losses
+    mean = (wins + 0.5 * draws) / games
+    variance = (wins * (1 - mean) ** 2 + draws * (0.5 - mean) ** 2 + losses * mean ** 2) / games
+    return games, mean, variance
+
+def elo_estimate(wins, draws, losses):
+    """
+    Returns (Elo difference, 95% margin) for a match score. Infinite when one side scored every point, and 0 with an
+    infinite margin before any game.
+    """
+    if not wins + draws + losses:
+        return 0., math.inf
+    games, mean, variance = score_stats(wins, draws, losses)
+    if mean <= 0 or mean >= 1:
+        return math.copysign(math.inf, mean - 0.5), math.inf
+
+    def to_elo(score):
+        score = min(max(score, 1e-6), 1 - 1e-6)
+        return -400 * math.log10(1 / score - 1)
+    margin = 1.96 * math.sqrt(variance / games)
+    return to_elo(mean), (to_elo(mean + margin) - to_elo(mean - margin)) / 2
+
+class SPRT():
+    """
+    Sequential probability ratio test of H1: new is elo1 stronger against H0: new is elo0 stronger, with false
+    acceptance rate alpha and false rejection rate beta.
+    """
+    def __init__(self, elo0=0., elo1=30., alpha=0.05, beta=0.05):
+        self.elo0 = elo0
+        self.elo1 = elo1
+        self.lower = math.log(beta / (1 - alpha))
+        self.upper = math.log((1 - beta) / alpha)
+
+    def llr(self, wins, draws, losses):
+        """
+        Returns the log likelihood ratio of H1 against H0 for a match score.
+        """
+        if not wins + draws + losses:
+            return 0.
+        games, mean, variance = score_stats(wins, draws, losses)
+        if variance == 0:
+            # every game the same result: pseudo games give the score a spread
+            if draws:
+                games, mean, variance = score_stats(wins + 1, draws, losses + 1)
+            else:
+                games, mean, variance = score_stats(wins, draws + 1, losses)
+        s0 = expected_score(self.elo0)
+        s1 = expected_score(self.elo1)
+        return games * (s1 - s0) * (2 * mean - s0 - s1) / (2 * variance)
+
+    def status(self, wins, draws, losses):
+        """
+        Returns 'accepted' (new is stronger), 'rejected' or None while undecided.
+        """
+        llr = self.llr(wins, draws, losses)
+        if llr >= self.upper:
+            return 'accepted'
+        if llr <= self.lower:
+            return 'rejected'
+        return None
+
+def play_game(white, black, iterations=200, batch_size=8, max_plies=200, opening_plies=4, rng=None):
+    """
+    Plays one game between two networks, each with its own MCTS keeping its tree between moves. The first opening_plies
+    moves are sampled from the visit distribution so games vary, the rest are the most visited move. Returns (winner, plies),
+    winner None for a game stopped at max_plies.
+    """
+    rng = rng or np.random.default_rng()
+    b = Board()
+    b.set_starting_position()
+    searchers = {Board.WHITE: mcts.MCTS(white, iterations=iterations, batch_size=batch_size),
+                 Board.BLACK: mcts.MCTS(black, iterations=iterations, batch_size=batch_size)}
+    roots = {turn: searcher.new_root(b) for turn, searcher in searchers.items()}
+    plies = 0
+    while not b.is_terminal()[0]:
+        if plies >= max_plies:
+            return None, plies
+        move_probs = searchers[b.turn].search(roots[b.turn], b)
+        probs = np.array([prob for _, prob, _, _ in move_probs])
+        if plies < opening_plies:
+            choice = rng.choice(len(move_probs), p=probs / probs.sum())
+        else:
+            choice = int(np.argmax(probs))
+        move = move_probs[choice][0]
+        b.apply_move(move)
+        for turn, searcher in searchers.items():
+            roots[turn] = searcher.advance(move, b)
+        plies += 1
+    return b.is_terminal()[1], plies
+
+# networks and settings of an arena worker process, set by init_worker
+worker_state = {}
+
+def init_worker(new_path, old_path, backend, game_kwargs, seed):
+    worker_state.update({'new': load_player(new_path, backend), 'old': load_player(old_path, backend),
+                         'game_kwargs': game_kwargs, 'seed': seed})
+
+def play_match_game(index):
+    """
+    Plays game index of the match in a worker process. Games 2k and 2k + 1 share a seed, new playing White in the first.
+    Returns (index, new plays White, winner, plies).
+    """
+    new_white = index % 2 == 0
+    new, old = worker_state['new'], worker_state['old']
+    rng = np.random.default_rng((worker_state['seed'], index // 2))
+    white, black = (new, old) if new_white else (old, new)
+    winner, plies = play_game(white, black, rng=rng, **worker_state['game_kwargs'])
+    return index, new_white, winner, plies
+
+class Arena():
+    """
+    Plays new_path against old_path on num_workers processes, up to max_games games, stopping as soon as sprt decides.
+    game_kwargs go to play_game.
+    """
+    def __init__(self, new_path, old_path, num_workers=None, backend='numpy', max_games=400, sprt=None,
+                 game_kwargs=None):
+        self.new_path = new_path
+        self.old_path = old_path
+        self.num_workers = num_workers or os.cpu_count() or 1
+        self.backend = backend
+        self.max_games = max_games
+        self.sprt = sprt or SPRT()
+        self.game_kwargs = game_kwargs or {}
+
+    def run(self, seed=0, verbose=False):
+        """
+        Plays the match. Returns a report with the score from new's side, the SPRT result ('accepted', 'rejected' or
+        'inconclusive' if max_games ran out) and the Elo estimate.
+        """
+        # results by colour new played: [wins, draws, losses]
+        results = {Board.WHITE: [0, 0, 0], Board.BLACK: [0, 0, 0]}
+        status = None
+        score = [0, 0, 0]
+        plies = 0
+        start = time.perf_counter()
+        # spawned workers don't inherit this process's TensorFlow state
+        ctx = mp.get_context('spawn')
+        with ctx.Pool(self.num_workers, initializer=init_worker,
+                      initargs=(self.new_path, self.old_path, self.backend, self.game_kwargs, seed)) as pool:
+            # completed games are counted as they finish, so the test can stop the match with games still running
+            for _, new_white, winner, game_plies in pool.imap_unordered(play_match_game, range(self.max_games)):
+                new_colour = Board.WHITE if new_white else Board.BLACK
+                outcome = 1 if winner is None else 0 if winner == new_colour else 2
+                results[new_colour][outcome] += 1
+                plies += game_plies
+                score = [white + black for white, black in zip(results[Board.WHITE], results[Board.BLACK])]
+                status = self.sprt.status(*score)
+                if verbose:
+                    print(f"{sum(score)} games +{score[0]} ={score[1]} -{score[2]}, "
+                          f"LLR {self.sprt.llr(*score):.2f} [{self.sprt.lower:.2f}, {self.sprt.upper:.2f}]")
+                if status is not None:
+                    # leaving the block terminates the games still being played
+                    break
+        wins, draws, losses = score
+        elo, margin = elo_estimate(wins, draws, losses)
+        games = wins + draws + losses
+        return {'games': games, 'wins': wins, 'draws': draws, 'losses': losses,
+                'new_as_white': results[Board.WHITE], 'new_as_black': results[Board.BLACK],
+                'result': status or 'inconclusive', 'llr': self.sprt.llr(wins, draws, losses),
+                'bounds': (self.sprt.lower, self.sprt.upper), 'elo': elo, 'elo_margin': margin,
+                'average_plies': plies / games if games else 0., 'seconds': time.perf_counter() - start}
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Play two networks against each other with SPRT early stopping')
+    parser.add_argument('new', help='candidate network, .keras or .npz')
+    parser.add_argument('old', help='reference network, .keras or .npz')
+    parser.add_argument('--workers', type=int, help='game processes (default: all cores)')
+    parser.add_argument('--backend', default='numpy', help='backend for .keras networks')
+    parser.add_argument('--iterations', type=int, default=200, help='MCTS simulations per move')
+    parser.add_argument('--batch-size', type=int, default=8, help='leaves evaluated per network call')
+    parser.add_argument('--max-games', type=int, default=400)
+    parser.add_argument('--elo0', type=float, default=0.)
+    parser.add_argument('--elo1', type=float, default=30.)
+    parser.add_argument('--alpha', type=float, default=0.05)
+    parser.add_argument('--beta', type=float, default=0.05)
+    args = parser.parse_args()
+
+    arena = Arena(args.new, args.old, args.workers, args.backend, args.max_games,
+                  SPRT(args.elo0, args.elo1, args.alpha, args.beta),
+                  {'iterations': args.iterations, 'batch_size': args.batch_size})
+    report = arena.run(verbose=True)
+    print(f"{report['result']} after {report['games']} games: +{report['wins']} ={report['draws']} -{report['losses']}, "
+          f"Elo {report['elo']:+.0f} +/- {report['elo_margin']:.0f} ({report['seconds']:.0f}s)")
@@ -0,0 +1,400 @@
+"""
+Vectorized engine playing many games at once. B games are held as a (B, 82) uint8 array of piece constants (the 81
+squares plus an always empty padding square that off-board lookups point at), and every rule is applied to all games
+with NumPy gathers over precomputed move, line and neighbour tables. Legal moves come out directly as masks over the
+1296 policy indexes. Rules, hashes and results match the scalar Board, which validate() checks by replaying games.
+
+Moves update hashes incrementally, XORing out and in only the squares a move changes, and repetitions are counted over
+the positions since the last capture, since no earlier position can come back once a piece is gone. play() keeps
+moving the games still running into a smaller batch as others finish, so long games don't drag the whole batch along.
+Each ply costs a fixed number of NumPy calls whatever the batch size, so a single game is several times slower than
+with Board, and BatchBoard pays off from a few dozen games up.
+"""
+import numpy as np
+
+from game import Board, ZobristHashing, LEN_ROW, NUM_SQUARES, DIRECTIONS, EDGE_MASK, bitboard_to_array, square
+
+PAD = NUM_SQUARES
+EMPTY = Board.EMPTY
+WHITE = Board.WHITE
+BLACK = Board.BLACK
+KING = Board.KING
+EMPTY_CASTLE = Board.EMPTY_CASTLE
+CASTLE = Board.CASTLE
+
+def generate_move_tables():
+    """
+    Returns (MOVE_FROM, MOVE_TO, MOVE_RAY, MOVE_DISTANCE) for every policy index: from and to squares, the ray of the
+    move as from square * 4 + direction, and the number of squares moved.
+    """
+    move_from = np.empty(Board.LEN_OUTPUT_INDEX, dtype=np.int64)
+    move_to = np.empty(Board.LEN_OUTPUT_INDEX, dtype=np.int64)
+    move_ray = np.empty(Board.LEN_OUTPUT_INDEX, dtype=np.int64)
+    move_distance = np.empty(Board.LEN_OUTPUT_INDEX, dtype=np.uint8)
+    for index, (from_sq, to_sq) in Board.INDEX_TO_MOVE.items():
+        move_from[index] = from_sq
+        move_to[index] = to_sq
+        from_row, from_col = divmod(from_sq, LEN_ROW)
+        to_row, to_col = divmod(to_sq, LEN_ROW)
+        distance = max(abs(to_row - from_row), abs(to_col - from_col))
+        d = DIRECTIONS.index(((to_row - from_row) // distance, (to_col - from_col) // distance))
+        move_ray[index] = from_sq * len(DIRECTIONS) + d
+        move_distance[index] = distance
+    return move_from, move_to, move_ray, move_distance
+
+def generate_line_table():
+    """
+    Returns (512, 9, 2) array of the free squares before the first occupied one, going down and up the line, from each
+    of the 9 squares of a line whose occupied squares are the bits of the first index.
+    """
+    lines = np.zeros((1 << LEN_ROW, LEN_ROW, 2), dtype=np.uint8)
+    for bits in range(1 << LEN_ROW):
+        for i in range(LEN_ROW):
+            for side, step in enumerate((-1, 1)):
+                j = i + step
+                while 0 <= j < LEN_ROW and not bits >> j & 1:
+                    j += step
+                lines[bits, i, side] = abs(j - i) - 1
+    return lines
+
+def generate_neighbour_tables():
+    """
+    Returns (NEIGHBOUR, ANVIL) (82, 4) arrays: the square next to each square and the square two over in every
+    direction, PAD where that runs off the board (and for PAD itself).
+    """
+    neighbour = np.full((NUM_SQUARES + 1, len(DIRECTIONS)), PAD, dtype=np.int64)
+    anvil = np.full((NUM_SQUARES + 1, len(DIRECTIONS)), PAD, dtype=np.int64)
+    for sq in range(NUM_SQUARES):
+        row, col = divmod(sq, LEN_ROW)
+        for d, (dr, dc) in enumerate(DIRECTIONS):
+            if 0 <= row + dr < LEN_ROW and 0 <= col + dc < LEN_ROW:
+                neighbour[sq, d] = square(row + dr, col + dc)
+            if 0 <= row + 2 * dr < LEN_ROW and 0 <= col + 2 * dc < LEN_ROW:
+                anvil[sq, d] = square(row + 2 * dr, col + 2 * dc)
+    return neighbour, anvil
+
+MOVE_FROM, MOVE_TO, MOVE_RAY, MOVE_DISTANCE = generate_move_tables()
+# moves onto the castle, which only the King may make
+TO_CASTLE = np.flatnonzero(MOVE_TO == CASTLE)
+LINE_FREE = generate_line_table()
+LINE_BITS = 1 << np.arange(LEN_ROW)
+NEIGHBOUR, ANVIL = generate_neighbour_tables()
+EDGE_SQUARES = bitboard_to_array(EDGE_MASK).astype(bool)
+# indexed by King square, PAD being the captured King
+KING_ESCAPED = np.append(EDGE_SQUARES, False)
+CASTLE_AREA = np.zeros(NUM_SQUARES + 1, dtype=bool)
+CASTLE_AREA[list(Board.CASTLE_SQUARES)] = True
+
+class BatchBoard():
+    """
+    B games played in lockstep. Finished games are left as they are while the others continue. A game reaching
+    max_plies is finished without a winner. Attributes:
+
+        board           (B, 82) uint8 piece constants, column 81 is padding
+        turn            (B,) side to move
+        hashes          (B,) uint64 Zobrist hash, equal to the scalar Board's
+        repetition      (B,) occurrences of the current position in its game
+        plies           (B,) moves played
+        king_square     (B,) King square, PAD once captured
+        last_capture    (B,) ply of the last capture, positions before it can't repeat
+    """
+    # per game arrays, first axis the game
+    GAME_ARRAYS = ('board', 'turn', 'hashes', 'repetition', 'plies', 'king_square', 'last_capture', 'history')
+
+    def __init__(self, batch_size, zobrist=None, max_plies=512):
+        self.batch_size = batch_size
+        self.zobrist = zobrist if zobrist is not None else ZobristHashing()
+        keys = np.zeros((EMPTY_CASTLE + 1, NUM_SQUARES + 1), dtype=np.uint64)
+        for piece in (WHITE, BLACK, KING, EMPTY_CASTLE):
+            keys[piece, :NUM_SQUARES] = self.zobrist.zobrist_table[piece]
+        self.keys = keys
+        self.black_to_move = np.uint64(self.zobrist.black_to_move)
+        self.max_plies = max_plies
+        self.board = np.zeros((batch_size, NUM_SQUARES + 1), dtype=np.uint8)
+        self.turn = np.full(batch_size, WHITE, dtype=np.uint8)
+        self.hashes = np.zeros(batch_size, dtype=np.uint64)
+        self.repetition = np.ones(batch_size, dtype=np.int32)
+        self.plies = np.zeros(batch_size, dtype=np.int32)
+        self.king_square = np.full(batch_size, PAD, dtype=np.int64)
+        self.last_capture = np.zeros(batch_size, dtype=np.int32)
+        # hash of every position reached, for counting repetitions
+        self.history = np.zeros((batch_size, max_plies + 1), dtype=np.uint64)
+        self.mask = None
+
+    def set_starting_position(self):
+        self.set_positions(np.broadcast_to(Board.STARTING_POSITION, (self.batch_size, LEN_ROW, LEN_ROW)),
+                           np.full(self.batch_size, WHITE))
+
+    def set_positions(self, boards, turns):
+        """
+        Sets every game from (B, 9, 9) arrays of piece constants and (B,) sides to move.
+        """
+        self.board[:, :NUM_SQUARES] = np.asarray(boards).reshape(self.batch_size, NUM_SQUARES)
+        self.board[:, PAD] = EMPTY
+        self.turn[:] = turns
+        self.plies[:] = 0
+        self.repetition[:] = 1
+        self.king_square[:] = self.king_squares()
+        self.last_capture[:] = 0
+        self.hashes = self.compute_hashes()
+        self.history[:, 0] = self.hashes
+        self.mask = None
+
+    def boards(self):
+        """
+        Returns (B, 9, 9) view of the boards.
+        """
+        return self.board[:, :NUM_SQUARES].reshape(self.batch_size, LEN_ROW, LEN_ROW)
+
+    def take(self, rows):
+        """
+        Returns a BatchBoard holding copies of games rows.
+        """
+        batch = BatchBoard.__new__(BatchBoard)
+        batch.__dict__.update(self.__dict__)
+        batch.batch_size = len(rows)
+        for name in self.GAME_ARRAYS:
+            setattr(batch, name, getattr(self, name)[rows])
+        batch.mask = None if self.mask is None else self.mask[rows]
+        return batch
+
+    def put(self, rows, batch):
+        """
+        Copies the games of batch, taken from rows, back into this batch.
+        """
+        for name in self.GAME_ARRAYS:
+            getattr(self, name)[rows] = getattr(batch, name)
+        self.mask = None
+
+    def compute_hashes(self):
+        hashes = np.bitwise_xor.reduce(self.keys[self.board, np.arange(NUM_SQUARES + 1)], axis=1)
+        return np.where(self.turn == BLACK, hashes ^ self.black_to_move, hashes)
+
+    def legal_mask(self):
+        """
+        Returns (B, 1296) boolean mask of legal moves for the side to move in every game.
+        """
+        if self.mask is None:
+            board = self.board[:, :NUM_SQUARES]
+            occupied = ((board != EMPTY) & (board != EMPTY_CASTLE)).reshape(-1, LEN_ROW, LEN_ROW)
+            own = np.where((self.turn == WHITE)[:, None], (board == WHITE) | (board == KING), board == BLACK)
+            # a slide is clear up to the first occupied square along its ray, read off each row and column as bits
+            vertical = LINE_FREE[LINE_BITS @ occupied].transpose(0, 2, 1, 3)
+            horizontal = LINE_FREE[occupied @ LINE_BITS]
+            free = np.concatenate([vertical, horizontal], axis=-1).reshape(self.batch_size, -1)
+            mask = own[:, MOVE_FROM] & (free[:, MOVE_RAY] >= MOVE_DISTANCE)
+            # only the King may stop on the castle, everyone else passes through it
+            mask[:, TO_CASTLE] &= MOVE_FROM[TO_CASTLE] == self.king_square[:, None]
+            self.mask = mask
+        return self.mask
+
+    def king_squares(self):
+        """
+        Returns (B,) King squares (PAD once captured).
+        """
+        is_king = self.board[:, :NUM_SQUARES] == KING
+        return np.where(is_king.any(axis=1), is_king.argmax(axis=1), PAD)
+
+    def apply_moves(self, moves, active=None):
+        """
+        Plays policy index moves[b] in every game b where active is set (all games by default), with captures, turn
+        switch, hash and repetition updates. Games that reached max_plies are left as they are.
+        """
+        playing = self.plies < self.max_plies
+        rows = np.flatnonzero(playing if active is None else playing & active)
+        if not len(rows):
+            return
+        moves = np.asarray(moves)[rows]
+        board = self.board
+        keys = self.keys
+        from_sq = MOVE_FROM[moves]
+        to_sq = MOVE_TO[moves]
+        piece = board[rows, from_sq]
+        # the King leaving the castle leaves it empty and hostile
+        vacated = np.where((from_sq == CASTLE) & (piece == KING), EMPTY_CASTLE, EMPTY).astype(np.uint8)
+        # the King returning to the castle replaces the empty castle
+        replaced = board[rows, to_sq]
+        board[rows, from_sq] = vacated
+        board[rows, to_sq] = piece
+        hashes = (self.hashes[rows] ^ keys[piece, from_sq] ^ keys[vacated, from_sq] ^ keys[replaced, to_sq] ^
+                  keys[piece, to_sq] ^ self.black_to_move)
+
+        neighbours = NEIGHBOUR[to_sq]
+        enemies = board[rows[:, None], neighbours]
+        anvils = board[rows[:, None], ANVIL[to_sq]]
+        white_moved = (self.turn[rows] == WHITE)[:, None]
+        king_sq = np.where(piece == KING, to_sq, self.king_square[rows])
+        king_around = CASTLE_AREA[king_sq]
+        white_captures = (enemies == BLACK) & ((anvils == WHITE) | (anvils == KING) | (anvils == EMPTY_CASTLE))
+        # away from the castle the King is sandwiched like any other piece
+        black_captures = (((enemies == WHITE) | ((enemies == KING) & ~king_around[:, None])) &
+                          ((anvils == BLACK) | (anvils == EMPTY_CASTLE)))
+        captured = np.where(white_moved, white_captures, black_captures)
+        capture_rows, capture_dirs = np.nonzero(captured)
+        # in or next to the castle the King must be surrounded on all four sides by attackers or the empty castle
+        king_neighbours = board[rows[:, None], NEIGHBOUR[king_sq]]
+        king_captured = (~white_moved[:, 0] & king_around & (neighbours == king_sq[:, None]).any(axis=1) &
+                         ((king_neighbours == BLACK) | (king_neighbours == EMPTY_CASTLE)).all(axis=1))
+        board[rows[capture_rows], neighbours[capture_rows, capture_dirs]] = EMPTY
+        board[rows[king_captured], king_sq[king_captured]] = EMPTY
+        hashes ^= np.bitwise_xor.reduce(np.where(captured, keys[enemies, neighbours], 0), axis=1)
+        hashes ^= np.where(king_captured, keys[KING, king_sq], 0)
+        king_taken = king_captured | (captured & (enemies == KING)).any(axis=1)
+        self.king_square[rows] = np.where(king_taken, PAD, king_sq)
+
+        self.turn[rows] = np.where(white_moved[:, 0], BLACK, WHITE)
+        plies = self.plies[rows] + 1
+        self.plies[rows] = plies
+        self.hashes[rows] = hashes
+        self.history[rows, plies] = hashes
+        last_capture = np.where(captured.any(axis=1) | king_captured, plies, self.last_capture[rows])
+        self.last_capture[rows] = last_capture
+        # earlier positions with the same side to move, back to the last capture
+        earlier = plies[:, None] - 2 * np.arange(int((plies - last_capture).max()) // 2 + 1)
+        seen = ((self.history[rows[:, None], np.maximum(earlier, 0)] == hashes[:, None]) &
+                (earlier >= last_capture[:, None]))
+        self.repetition[rows] = seen.sum(axis=1)
+        self.mask = None
+
+    def is_surround(self, rows=None):
+        """
+        Returns mask of games, all or those in rows, where the white pieces are surrounded, by a flood fill from the
+        edge. Games drop out of the fill as soon as it reaches a defender.
+        """
+        board = self.board[:, :NUM_SQUARES] if rows is None else self.board[rows, :NUM_SQUARES]
+        board = board.reshape(-1, LEN_ROW, LEN_ROW)
+        edge = EDGE_SQUARES.reshape(LEN_ROW, LEN_ROW)
+        defenders = (board == WHITE) | (board == KING)
+        # the empty castle blocks like an attacker
+        open_squares = board == EMPTY
+        surrounded = ~(defenders & edge).any(axis=(1, 2))
+        pending = np.flatnonzero(surrounded)
+        defenders = defenders[pending]
+        open_squares = open_squares[pending]
+        region = edge & open_squares
+        while len(pending):
+            grown = dilate(region)
+            reached = (grown & defenders).any(axis=(1, 2))
+            surrounded[pending[reached]] = False
+            grown = (grown & open_squares) | region
+            # games whose region stopped growing without reaching a defender are surrounded
+            keep = ~reached & (grown != region).any(axis=(1, 2))
+            pending = pending[keep]
+            region = grown[keep]
+            defenders = defenders[keep]
+            open_squares = open_squares[keep]
+        return surrounded
+
+    def is_terminal(self):
+        """
+        Detects terminal positions at the start of each game's turn, as Board.is_terminal does. Returns ((B,) terminal
+        mask, (B,) winners with EMPTY for games still going).
+        """
+        no_moves = ~self.legal_mask().any(axis=1)
+        black_turn = self.turn == BLACK
+        # white wins if the King reaches the edge or black has no moves
+        white_wins = black_turn & (KING_ESCAPED[self.king_square] | no_moves)
+        # black wins by capture, repetition, white having no moves, or surrounding
+        black_wins = ~black_turn & ((self.king_square == PAD) | (self.repetition >= 3) | no_moves)
+        undecided = np.flatnonzero(~black_turn & ~black_wins)
+        if len(undecided):
+            black_wins[undecided] = self.is_surround(undecided)
+        winners = np.where(white_wins, WHITE, np.where(black_wins, BLACK, EMPTY)).astype(np.uint8)
+        return white_wins | black_wins | (self.plies >= self.max_plies), winners
+
+    def sample_moves(self, rng, logits=None):
+        """
+        Returns (B,) policy indexes sampled among legal moves, uniformly or from softmax(logits) if given (B, 1296).
+        Games without legal moves get -1.
+        """
+        mask = self.legal_mask()
+        if logits is None:
+            # pick each game's move among the legal ones listed in row order
+            counts = mask.sum(axis=1)
+            legal = np.nonzero(mask)[1]
+            picks = np.cumsum(counts) - counts + (rng.random(len(counts)) * counts).astype(np.int64)
+            return np.where(counts > 0, np.append(legal, -1)[np.minimum(picks, len(legal))], -1)
+        # Gumbel max trick samples from softmax(logits) with one argmax
+        scores = np.where(mask, logits + rng.gumbel(size=mask.shape), -np.inf)
+        return np.where(mask.any(axis=1), scores.argmax(axis=1), -1)
+
+    def play(self, rng=None, policy_fn=None, max_plies=None):
+        """
+        Plays every game to the end, sampling moves uniformly or from policy_fn(batch_board) logits. Games still going
+        after max_plies are left unfinished. Returns (winners, plies) with EMPTY winners for unfinished games.
+        """
+        rng = rng if rng is not None else np.random.default_rng()
+        max_plies = min(max_plies or self.max_plies, self.max_plies)
+        batch = self
+        rows = np.arange(self.batch_size)
+        while True:
+            terminal, winners = batch.is_terminal()
+            active = ~terminal & (batch.plies < max_plies)
+            if not active.any():
+                break
+            if 2 * np.count_nonzero(active) <= batch.batch_size:
+                # continue with the running games only
+                if batch is not self:
+                    self.put(rows, batch)
+                rows = rows[active]
+                batch = self.take(rows)
+                active = active[active]
+            logits = policy_fn(batch) if policy_fn is not None else None
+            batch.apply_moves(batch.sample_moves(rng, logits), active)
+        if batch is not self:
+            self.put(rows, batch)
+        winners = self.is_terminal()[1]
+        return winners, self.plies.copy()
+
+def dilate(region):
+    """
+    Returns (B, 9, 9) mask of squares orthogonally adjacent to region.
+    """
+    grown = np.zeros_like(region)
+    grown[:, 1:] |= region[:, :-1]
+    grown[:, :-1] |= region[:, 1:]
+    grown[:, :, 1:] |= region[:, :, :-1]
+    grown[:, :, :-1] |= region[:, :, 1:]
+    return grown
+
+def validate(batch_size=64, seed=0, max_plies=200):
+    """
+    Plays random games in a BatchBoard and replays each with the scalar Board, checking boards, legal moves, hashes,
+    repetition counts and results after every ply. Returns number of plies checked, raises AssertionError on mismatch.
+    """
+    rng = np.random.default_rng(seed)
+    batch = BatchBoard(batch_size, max_plies=max_plies)
+    batch.set_starting_position()
+    boards = []
+    for _ in range(batch_size):
+        b = Board(batch.zobrist)
+        b.set_starting_position()
+        boards.append(b)
+    checked = 0
+    while True:
+        terminal, winners = batch.is_terminal()
+        mask = batch.legal_mask()
+        for i, b in enumerate(boards):
+            if b is None:
+                continue
+            assert (batch.boards()[i] == b.to_array()).all(), f'board mismatch in game {i}'
+            assert batch.turn[i] == b.turn and int(batch.hashes[i]) == b.zobrist_hash, f'hash mismatch in game {i}'
+            assert batch.repetition[i] == b.repetition_counter, f'repetition mismatch in game {i}'
+            assert (mask[i] == b.generate_moves('mask')).all(), f'legal move mismatch in game {i}'
+            king_square = b.king_square if b.king else PAD
+            assert batch.king_square[i] == king_square, f'King square mismatch in game {i}'
+            is_terminal, winner = b.is_terminal()
+            # a game at max_plies is finished without a winner
+            at_limit = len(b.undo_stack) >= max_plies
+            assert terminal[i] == (is_terminal or at_limit) and winners[i] == (winner if is_terminal else EMPTY), \
+                f'result mismatch in game {i}'
+            checked += 1
+            if terminal[i]:
+                boards[i] = None
+        active = ~terminal
+        if not active.any():
+            return checked
+        moves = batch.sample_moves(rng)
+        batch.apply_moves(moves, active)
+        for i in np.flatnonzero(active):
+            boards[i].apply_move(Board.INDEX_TO_MOVE[int(moves[i])])
@@ -0,0 +1,551 @@
+"""
+Engine benchmarks. Run from this directory:
+
+    python bench.py [--json PATH] [--quick] [--section NAME ...]
+
+--json writes every result as JSON (to stdout for '-') so runs can be compared between versions. Perft counts are
+checked against known values and any mismatch is reported.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+from game import Board, EDGE_MASK, FULL_MASK, dilate
+import mcts
+import tree
+from encoder import Encoder
+from batch_board import BatchBoard, validate
+from instrument import SearchStats
+from rl_train import ReinfLearn
+from solver import Solver
+from testing import (PERFT_EXPECTED, PERFT_POSITIONS, CountingNetwork, LatencyNetwork, UniformNetwork,
+                     load_legacy_board, new_root, perft, perft_board)
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+NOTEBOOK_PATH = os.path.join(HERE, 'tablut_rl.ipynb')
+
+def bench_perft(max_depth=3, midgame_depth=2):
+    """
+    Runs perft from the starting position to max_depth and from the midgame positions to midgame_depth. Returns node
+    counts, whether they match PERFT_EXPECTED and nodes per second for each position.
+    """
+    results = {}
+    for name in PERFT_POSITIONS:
+        b = perft_board(name)
+        depths = range(1, (max_depth if name == 'start' else midgame_depth) + 1)
+        start = time.perf_counter()
+        counts = [perft(b, depth) for depth in depths]
+        elapsed = time.perf_counter() - start
+        results[name] = {'counts': counts, 'ok': counts == PERFT_EXPECTED[name][:len(counts)],
+                         'nodes_per_second': sum(counts) / elapsed}
+    return results
+
+def load_notebook_board():
+    """
+    Executes the 9x9 NumPy Board cell (and its helpers) from tablut_rl.ipynb for comparison. Returns None if not found.
+    """
+    try:
+        with open(NOTEBOOK_PATH) as f:
+            cells = json.load(f)['cells']
+    except (OSError, ValueError):
+        return None
+    namespace = {'np': np, 'random': random}
+    for cell in cells:
+        source = ''.join(cell['source'])
+        if cell['cell_type'] == 'code' and ('def generate_edges_set' in source or 'class Board' in source):
+            exec(source, namespace)
+    return namespace.get('Board')
+
+def sample_positions(num_games=20, seed=0):
+    """
+    Plays random games and returns list of (board array, turn) for every position reached.
+    """
+    rng = random.Random(seed)
+    positions = []
+    b = Board()
+    for _ in range(num_games):
+        b.set_starting_position()
+        while not b.is_terminal()[0]:
+            positions.append((b.to_array(), b.turn))
+            b.apply_move(rng.choice(b.generate_moves()))
+    return positions
+
+def time_loop(fn, items, min_time=1.0, rounds=3):
+    """
+    Repeatedly calls fn on every item until min_time has passed. Returns best calls per second over rounds.
+    """
+    best = 0.
+    for _ in range(rounds):
+        calls = 0
+        start = time.perf_counter()
+        while True:
+            for item in items:
+                fn(item)
+            calls += len(items)
+            elapsed = time.perf_counter() - start
+            if elapsed >= min_time / rounds:
+                break
+        best = max(best, calls / elapsed)
+    return best
+
+def sample_midgame_positions(num_games=40, min_ply=16, seed=0):
+    """
+    Plays random games and returns (board array, turn) for every White to move position from min_ply on, in game order
+    so successive positions are two plies apart.
+    """
+    rng = random.Random(seed)
+    positions = []
+    b = Board()
+    for _ in range(num_games):
+        b.set_starting_position()
+        ply = 0
+        while not b.is_terminal()[0]:
+            if ply >= min_ply and b.turn == Board.WHITE:
+                positions.append((b.to_array(), b.turn))
+            b.apply_move(rng.choice(b.generate_moves()))
+            ply += 1
+    return positions
+
+def flood_surround(b):
+    """
+    Full bitboard flood fill from the edges on every call, without early exit or reuse between positions.
+    """
+    defenders = b.white | b.king
+    if defenders & EDGE_MASK:
+        return False
+    open_squares = FULL_MASK & ~(defenders | b.black | (Board.CASTLE_MASK if b.castle_empty else 0))
+    region = EDGE_MASK & open_squares
+    while True:
+        grown = (region | dilate(region)) & open_squares
+        if grown == region:
+            break
+        region = grown
+    return not dilate(region) & defenders
+
+def bench_surround(positions, min_time=1.0):
+    """
+    Measures surround checks per second over positions in order. The incremental check runs on one board moved through
+    the positions, as it is during play. Compared against a full flood fill per position and the notebook's recursive
+    DFS.
+    """
+    states = []
+    for board_array, turn in positions:
+        b = Board()
+        b.set_position(board_array, turn)
+        states.append((b.white, b.black, b.king, b.castle_empty))
+    board = Board()
+
+    def incremental(state):
+        board.white, board.black, board.king, board.castle_empty = state
+        board.is_surround()
+
+    results = {'incremental': time_loop(incremental, states, min_time)}
+    boards = []
+    for board_array, turn in positions:
+        b = Board()
+        b.set_position(board_array, turn)
+        boards.append(b)
+    results['full_flood'] = time_loop(flood_surround, boards, min_time)
+
+    NotebookBoard = load_notebook_board()
+    if NotebookBoard is not None:
+        notebook_boards = []
+        for board_array, turn in positions:
+            nb = NotebookBoard(zobrist=None)
+            nb.board = np.array(board_array, dtype=int)
+            nb.turn = turn
+            notebook_boards.append(nb)
+        results['notebook'] = time_loop(lambda nb: nb.is_surround(), notebook_boards, min_time)
+    return results
+
+def bench_generate_moves(positions, min_time=1.0):
+    """
+    Measures generate_moves throughput (positions per second) for the bitboard Board and, where they can be loaded, the
+    legacy list Board and the notebook NumPy Board.
+    """
+    boards = []
+    for board_array, turn in positions:
+        b = Board()
+        b.set_position(board_array, turn)
+        boards.append(b)
+
+    def bitboard_gen(b):
+        b.legal_moves = None
+        b.generate_moves()
+
+    results = {'bitboard': time_loop(bitboard_gen, boards, min_time)}
+
+    LegacyBoard = load_legacy_board()
+    if LegacyBoard is not None:
+        legacy_boards = []
+        for board_array, turn in positions:
+            lb = LegacyBoard()
+            # legacy board has no vacated castle marker
+            lb.board = [int(p) if p != Board.EMPTY_CASTLE else LegacyBoard.EMPTY for p in board_array.reshape(-1)]
+            lb.turn = turn
+            legacy_boards.append(lb)
+
+        def legacy_gen(lb):
+            lb.legal_moves = None
+            lb.generate_moves()
+
+        results['legacy'] = time_loop(legacy_gen, legacy_boards, min_time)
+        results['legacy_speedup'] = results['bitboard'] / results['legacy']
+
+    NotebookBoard = load_notebook_board()
+    if NotebookBoard is not None:
+        notebook_boards = []
+        for board_array, turn in positions:
+            nb = NotebookBoard(zobrist=None)
+            nb.board = np.array(board_array, dtype=int)
+            nb.turn = turn
+            king = np.argwhere(nb.board == Board.KING)
+            nb.king_position = tuple(king[0]) if len(king) else None
+            notebook_boards.append(nb)
+
+        def notebook_gen(nb):
+            nb.legal_moves = None
+            nb.generate_moves()
+
+        results['notebook'] = time_loop(notebook_gen, notebook_boards, min_time)
+        results['notebook_speedup'] = results['bitboard'] / results['notebook']
+    return results
+
+def bench_board_ops(positions, min_time=1.0):
+    """
+    Measures apply_move + undo_move (first legal move) and is_terminal throughput, in calls per second.
+    """
+    boards = []
+    for board_array, turn in positions:
+        b = Board()
+        b.set_position(board_array, turn)
+        if b.generate_moves():
+            boards.append(b)
+
+    def apply_undo(b):
+        b.apply_move(b.legal_moves[0])
+        b.undo_move()
+
+    def terminal(b):
+        b.legal_moves = None
+        b.is_terminal()
+
+    return {'apply_undo_move': time_loop(apply_undo, boards, min_time), 'is_terminal': time_loop(terminal, boards, min_time)}
+
+def bench_encoder(batch_size=256, min_time=1.0):
+    """
+    Measures network input encoding in positions per second, one board at a time and in batches, both written into a
+    preallocated Encoder buffer.
+    """
+    rng = random.Random(0)
+    boards = []
+    for _ in range(batch_size):
+        # boards with a full 8 position history
+        b = Board()
+        b.set_starting_position()
+        for _ in range(10):
+            b.apply_move(rng.choice(b.generate_moves()))
+        boards.append(b)
+    encoder = Encoder(batch_size)
+    results = {'encoder_single': time_loop(lambda board: encoder.encode([board]), boards, min_time)}
+    results['encoder_batch'] = time_loop(encoder.encode, [boards], min_time) * batch_size
+    return results
+
+def bench_self_play(games=4, iterations=50, seed=0):
+    """
+    Plays self-play games with the stub network. Returns games per hour, positions per second and average game length.
+    """
+    np.random.seed(seed)
+    learner = ReinfLearn(UniformNetwork(), iterations=iterations)
+    positions = 0
+    start = time.perf_counter()
+    for _ in range(games):
+        positions += len(learner.play_game()[0])
+    elapsed = time.perf_counter() - start
+    return {'games_per_hour': games * 3600 / elapsed, 'positions_per_second': positions / elapsed,
+            'average_length': positions / games, 'iterations': iterations}
+
+def bench_batch_games(games=256, batch_sizes=(1, 64, 256), max_plies=512, seed=0):
+    """
+    Plays random games one at a time with Board and in lockstep with BatchBoard, after checking BatchBoard against Board
+    with validate. Returns plies per second by mode.
+    """
+    rng = random.Random(seed)
+    b = Board()
+    plies = 0
+    start = time.perf_counter()
+    for _ in range(games):
+        b.set_starting_position()
+        while not b.is_terminal()[0] and len(b.undo_stack) < max_plies:
+            b.apply_move(rng.choice(b.generate_moves()))
+        plies += len(b.undo_stack)
+    results = {'validated_plies': validate(32, seed), 'board': plies / (time.perf_counter() - start)}
+    for batch_size in batch_sizes:
+        batch = BatchBoard(batch_size, max_plies=max_plies)
+        np_rng = np.random.default_rng(seed)
+        plies = 0
+        start = time.perf_counter()
+        for _ in range(max(1, games // batch_size)):
+            batch.set_starting_position()
+            plies += int(batch.play(np_rng)[1].sum())
+        results[f'batch_{batch_size}'] = plies / (time.perf_counter() - start)
+    return results
+
+def bench_search_memory(iterations=400):
+    """
+    Measures peak memory (bytes) and time of one search from the starting position with lazy and eager child expansion.
+    """
+    results = {}
+    for lazy in (True, False):
+        b = Board()
+        b.set_starting_position()
+        searcher = mcts.MCTS(UniformNetwork(), iterations=iterations, lazy_expansion=lazy)
+        tracemalloc.start()
+        start = time.perf_counter()
+        searcher.search(new_root(b), b)
+        elapsed = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        results['lazy' if lazy else 'eager'] = {'peak_bytes': peak, 'seconds': elapsed}
+    return results
+
+def bench_search_speed(iterations=2000, batch_sizes=(1, 32)):
+    """
+    Measures simulations per second of one search from the starting position for the object tree MCTS (with and
+    without instrumentation) and the struct-of-arrays ArrayMCTS at each leaf batch size, all with the stub network.
+    """
+    results = {}
+    b = Board()
+    b.set_starting_position()
+    for batch_size in batch_sizes:
+        for mode, stats in (('object_tree', None), ('instrumented', SearchStats(measure_memory=False))):
+            searcher = mcts.MCTS(UniformNetwork(), iterations=iterations, batch_size=batch_size, early_stop=False,
+                                 stats=stats)
+            start = time.perf_counter()
+            searcher.search(new_root(b), b)
+            results[f'{mode}_{batch_size}'] = iterations / (time.perf_counter() - start)
+        searcher = tree.ArrayMCTS(UniformNetwork(), iterations=iterations, batch_size=batch_size)
+        start = time.perf_counter()
+        searcher.search(b)
+        results[f'array_tree_{batch_size}'] = iterations / (time.perf_counter() - start)
+    return results
+
+def bench_batched_search(iterations=256, batch_sizes=(1, 8, 32)):
+    """
+    Measures search time from the starting position for several virtual loss batch sizes with the latency stub network.
+    """
+    results = {}
+    for batch_size in batch_sizes:
+        b = Board()
+        b.set_starting_position()
+        searcher = mcts.MCTS(LatencyNetwork(), iterations=iterations, batch_size=batch_size)
+        start = time.perf_counter()
+        searcher.search(new_root(b), b)
+        results[batch_size] = time.perf_counter() - start
+    return results
+
+def bench_evaluation_cache(iterations=800, moves=6, cache_size=100000):
+    """
+    Plays moves with a searcher sharing one EvaluationCache (and transposition table when enabled) across searches.
+    Returns network calls, cache stats and total time for each mode.
+    """
+    results = {}
+    for transpositions in (False, True):
+        b = Board()
+        b.set_starting_position()
+        network = CountingNetwork()
+        cache = mcts.EvaluationCache(cache_size)
+        searcher = mcts.MCTS(network, iterations=iterations, cache=cache, transpositions=transpositions)
+        start = time.perf_counter()
+        for _ in range(moves):
+            move_probs = searcher.search(new_root(b), b)
+            b.apply_move(max(move_probs, key=lambda x: x[2])[0])
+        results['transpositions' if transpositions else 'cache'] = {
+            'network_calls': network.calls, 'transposition_hits': searcher.transposition_hits,
+            'seconds': time.perf_counter() - start, **cache.stats()}
+    return results
+
+def bench_tree_reuse(iterations=400, moves=10):
+    """
+    Plays moves with the most visited move, promoting the chosen child to root each time. Returns average visits the new
+    root inherited from the previous search and the seconds taken.
+    """
+    b = Board()
+    b.set_starting_position()
+    searcher = mcts.MCTS(UniformNetwork(), iterations=iterations)
+    root_node = searcher.new_root(b)
+    inherited = []
+    start = time.perf_counter()
+    for _ in range(moves):
+        move_probs = searcher.search(root_node, b)
+        move = max(move_probs, key=lambda x: x[2])[0]
+        b.apply_move(move)
+        root_node = searcher.advance(move, b)
+        inherited.append(root_node.parent_edge.N)
+    return {'inherited_visits': sum(inherited) / len(inherited), 'seconds': time.perf_counter() - start}
+
+def bench_solver(positions, min_time=1.0, max_plies=3):
+    """
+    Solves every position with an uncached Solver. Returns solves per second and the share of positions proven for
+    each side.
+    """
+    solver = Solver(max_plies, max_size=0)
+    boards = []
+    for board_array, turn in positions:
+        b = Board()
+        b.set_position(board_array, turn)
+        boards.append(b)
+    results = [solver.solve(b) for b in boards]
+    return {'solves_per_second': time_loop(solver.solve, boards, min_time),
+            'white_wins': sum(r is not None and r[0] == Board.WHITE for r in results) / len(boards),
+            'black_wins': sum(r is not None and r[0] == Board.BLACK for r in results) / len(boards)}
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=HERE, capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return None
+
+SECTIONS = ('perft', 'generate_moves', 'board_ops', 'surround', 'encoder', 'search_memory', 'search_speed',
+            'batched_search', 'evaluation_cache', 'tree_reuse', 'self_play', 'batch_games', 'solver')
+
+def run_benchmarks(sections=SECTIONS, quick=False):
+    """
+    Runs the named benchmark sections. Returns dictionary of results plus run metadata. quick shortens timings and
+    perft depths for a smoke run.
+    """
+    min_time = 0.3 if quick else 1.0
+    results = {'meta': {'revision': git_revision(), 'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                        'python': platform.python_version(), 'numpy': np.__version__, 'machine': platform.machine(),
+                        'quick': quick}}
+    positions = sample_positions() if {'generate_moves', 'board_ops', 'encoder', 'solver'} & set(sections) else None
+    if 'perft' in sections:
+        results['perft'] = bench_perft(2 if quick else 3, 1 if quick else 2)
+    if 'generate_moves' in sections:
+        results['generate_moves'] = bench_generate_moves(positions, min_time)
+    if 'board_ops' in sections:
+        results['board_ops'] = bench_board_ops(positions, min_time)
+    if 'surround' in sections:
+        results['surround'] = bench_surround(sample_midgame_positions(), min_time)
+    if 'encoder' in sections:
+        results['encoder'] = bench_encoder(min_time=min_time)
+    if 'search_memory' in sections:
+        results['search_memory'] = bench_search_memory()
+    if 'search_speed' in sections:
+        results['search_speed'] = bench_search_speed(500 if quick else 2000)
+    if 'batched_search' in sections:
+        results['batched_search'] = bench_batched_search(64 if quick else 256)
+    if 'evaluation_cache' in sections:
+        results['evaluation_cache'] = bench_evaluation_cache(200 if quick else 800)
+    if 'tree_reuse' in sections:
+        results['tree_reuse'] = bench_tree_reuse(100 if quick else 400)
+    if 'self_play' in sections:
+        results['self_play'] = bench_self_play(1 if quick else 4)
+    if 'batch_games' in sections:
+        results['batch_games'] = bench_batch_games(64 if quick else 256)
+    if 'solver' in sections:
+        results['solver'] = bench_solver(positions, min_time)
+    return results
+
+def print_report(results):
+    if 'perft' in results:
+        print("perft leaf counts by depth:")
+        for name, result in results['perft'].items():
+            status = 'ok' if result['ok'] else f"MISMATCH, expected {PERFT_EXPECTED[name][:len(result['counts'])]}"
+            print(f"  {name + ':':28} {result['counts']} {status} ({result['nodes_per_second']:,.0f} nodes/s)")
+
+    if 'generate_moves' in results:
+        result = results['generate_moves']
+        print("generate_moves over random game positions:")
+        print(f"  bitboard: {result['bitboard']:,.0f} positions/s")
+        for baseline in ('legacy', 'notebook'):
+            if baseline in result:
+                print(f"  {baseline + ':':9} {result[baseline]:,.0f} positions/s ({result[baseline + '_speedup']:.1f}x slower)")
+
+    if 'board_ops' in results:
+        print("Board operations over random game positions:")
+        for name, rate in results['board_ops'].items():
+            print(f"  {name + ':':16} {rate:,.0f} calls/s")
+
+    if 'surround' in results:
+        result = results['surround']
+        print("is_surround over random game midgame positions:")
+        for mode, rate in result.items():
+            print(f"  {mode + ':':12} {rate:,.0f} positions/s ({result['incremental'] / rate:.1f}x)")
+
+    if 'encoder' in results:
+        print("Network input encoding:")
+        for mode, rate in results['encoder'].items():
+            print(f"  {mode + ':':20} {rate:,.0f} positions/s")
+
+    if 'search_memory' in results:
+        print("MCTS search peak memory, 400 iterations from the starting position:")
+        for mode, result in results['search_memory'].items():
+            print(f"  {mode + ':':9} {result['peak_bytes'] / 1024:,.0f} KiB in {result['seconds']:.2f}s")
+
+    if 'search_speed' in results:
+        print("MCTS simulations per second, stub network, from the starting position:")
+        for mode, result in results['search_speed'].items():
+            print(f"  {mode + ':':16} {result:,.0f}")
+
+    if 'batched_search' in results:
+        print("MCTS search time with a 20ms per call stub network, by leaf batch size:")
+        for batch_size, seconds in results['batched_search'].items():
+            print(f"  {batch_size:>3}: {seconds:.2f}s")
+
+    if 'evaluation_cache' in results:
+        print("MCTS evaluation cache, 6 moves from the starting position:")
+        for mode, result in results['evaluation_cache'].items():
+            print(f"  {mode + ':':16} {result['network_calls']:,} network calls, {result['hit_rate']:.0%} cache hits, "
+                  f"{result['transposition_hits']:,} transpositions, {result['seconds']:.2f}s")
+
+    if 'tree_reuse' in results:
+        result = results['tree_reuse']
+        print("MCTS subtree reuse, 10 moves from the starting position:")
+        print(f"  {result['inherited_visits']:.0f} visits inherited per move on average, {result['seconds']:.2f}s")
+
+    if 'self_play' in results:
+        result = results['self_play']
+        print(f"Self-play with the stub network, {result['iterations']} iterations per move:")
+        print(f"  {result['games_per_hour']:,.0f} games/hour, {result['positions_per_second']:,.1f} positions/s, "
+              f"{result['average_length']:.0f} plies per game")
+
+    if 'batch_games' in results:
+        result = results['batch_games']
+        print(f"Random games, BatchBoard validated over {result['validated_plies']:,} plies:")
+        for mode, rate in result.items():
+            if mode != 'validated_plies':
+                print(f"  {mode + ':':10} {rate:,.0f} plies/s")
+
+    if 'solver' in results:
+        result = results['solver']
+        print("King escape/capture solver, 3 plies, over random game positions:")
+        print(f"  {result['solves_per_second']:,.0f} solves/s, {result['white_wins']:.0%} proven White wins, "
+              f"{result['black_wins']:.0%} proven Black wins")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Tablut engine benchmarks')
+    parser.add_argument('--json', metavar='PATH', help="write results as JSON to PATH ('-' for stdout)")
+    parser.add_argument('--quick', action='store_true', help='shorter timings and shallower perft')
+    parser.add_argument('--section', action='append', choices=SECTIONS, help='run only these sections')
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.section or SECTIONS, args.quick)
+    if args.json == '-':
+        json.dump(results, sys.stdout, indent=1)
+        print()
+    else:
+        print_report(results)
+        if args.json:
+            with open(args.json, 'w') as f:
+                json.dump(results, f, indent=1)
+    if 'perft' in results and not all(result['ok'] for result in results['perft'].values()):
+        sys.exit(1)
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# modules here import each other by name, as when run from this directory
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
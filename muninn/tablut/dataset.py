@@ -0,0 +1,203 @@
+"""
+Supervised dataset builder. Replays the scraped games in tablut_games_clean.csv across a process pool and writes the
+encoded positions, legal move masks, moves played and results to versioned shards. Later builds with the same CSV and
+encoding load the shards instead of replaying. Run from this directory:
+
+    python dataset.py [csv path]
+"""
+import csv
+import hashlib
+import json
+import os
+import shutil
+import sys
+from multiprocessing import Pool
+
+import numpy as np
+
+from game import Board, LEN_ROW, NUM_SQUARES
+from encoder import HISTORY_LENGTH, STORED_PLANES, Encoder, num_planes
+from mcts import terminal_value
+
+# bump whenever the input planes, targets or shard layout change so stale shards are rebuilt
+ENCODING_VERSION = 1
+DEFAULT_CSV_PATH = '../../data/tablut_games_clean.csv'
+DEFAULT_CACHE_DIR = '../../data/supervised_shards'
+MANIFEST_FILE = 'manifest.json'
+SHARD_ARRAYS = ('planes', 'legal', 'moves', 'values', 'games')
+
+file_to_index = {chr(i): i - ord('a') for i in range(ord('a'), ord('i') + 1)}
+
+def translate_move(move):
+    """
+    Translates a move in the CSV format (eg. 'e3-e5') into a (from_sq, to_sq) tuple.
+    """
+    from_col = file_to_index[move[0]]
+    from_row = int(move[1]) - 1
+    to_col = file_to_index[move[3]]
+    to_row = int(move[4]) - 1
+    return (from_row * LEN_ROW + from_col, to_row * LEN_ROW + to_col)
+
+def read_games(csv_path):
+    """
+    Reads the games CSV in one pass. Returns list of (game id, winner, [moves]) in file order.
+    """
+    games = {}
+    with open(csv_path, newline='') as f:
+        for row in csv.DictReader(f):
+            game = games.get(row['Game_ID'])
+            if game is None:
+                game = games[row['Game_ID']] = (row['Game_ID'], row['Winner'], [])
+            game[2].append(translate_move(row['Move']))
+    return list(games.values())
+
+def file_digest(path):
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            sha1.update(block)
+    return sha1.hexdigest()
+
+def dataset_key(csv_digest, history_length=HISTORY_LENGTH):
+    """
+    Returns the shard directory name for a CSV digest under the current encoding.
+    """
+    return hashlib.sha1(f'{csv_digest}:{ENCODING_VERSION}:{history_length}'.encode()).hexdigest()[:16]
+
+def replay_games(games):
+    """
+    Replays games, returning dictionary of the shard arrays for every position before a move. A game stops at its
+    first move the engine doesn't accept as legal. Also returns number of such games.
+    """
+    encoder = Encoder(1, dtype=np.uint8)
+    b = Board()
+    planes = []
+    legal = []
+    moves = []
+    values = []
+    game_numbers = []
+    rejected = 0
+    for game_number, winner, game_moves in games:
+        b.set_starting_position()
+        value = terminal_value(Board.WHITE if winner == 'White' else Board.BLACK)
+        for move in game_moves:
+            legal_moves = b.generate_moves()
+            if move not in legal_moves:
+                rejected += 1
+                break
+            x = encoder.encode([b])[0]
+            planes.append(np.packbits(x.reshape(NUM_SQUARES, -1)[:, :STORED_PLANES].reshape(-1)))
+            legal.append(np.packbits(b.generate_moves('mask')))
+            moves.append(Board.MOVE_TO_INDEX[move])
+            values.append(value)
+            game_numbers.append(game_number)
+            b.apply_move(move)
+    arrays = {
+        'planes': np.array(planes, dtype=np.uint8).reshape(len(planes), NUM_SQUARES * STORED_PLANES // 8),
+        'legal': np.array(legal, dtype=np.uint8).reshape(len(legal), Board.LEN_OUTPUT_INDEX // 8),
+        'moves': np.array(moves, dtype=np.int16),
+        'values': np.array(values, dtype=np.float32),
+        'games': np.array(game_numbers, dtype=np.int32),
+    }
+    return arrays, rejected
+
+def write_shard(task):
+    """
+    Pool task: replays a chunk of games and saves them as shard name inside directory. Returns (name, positions,
+    rejected games).
+    """
+    directory, name, games = task
+    arrays, rejected = replay_games(games)
+    path = os.path.join(directory, name)
+    os.makedirs(path, exist_ok=True)
+    for array_name, array in arrays.items():
+        np.save(os.path.join(path, array_name + '.npy'), array)
+    return name, len(arrays['moves']), rejected
+
+def build_directory(directory, build):
+    """
+    Builds directory through a temporary directory next to it that is moved into place once complete, replacing any
+    previous build, so a reader never finds a partial one. build(tmp_directory) writes the contents and returns the
+    manifest, which is saved as MANIFEST_FILE.
+    """
+    tmp_directory = directory + '.tmp'
+    shutil.rmtree(tmp_directory, ignore_errors=True)
+    os.makedirs(tmp_directory)
+    manifest = build(tmp_directory)
+    with open(os.path.join(tmp_directory, MANIFEST_FILE), 'w') as f:
+        json.dump(manifest, f, indent=1)
+    shutil.rmtree(directory, ignore_errors=True)
+    os.replace(tmp_directory, directory)
+
+def build_dataset(csv_path=DEFAULT_CSV_PATH, cache_dir=DEFAULT_CACHE_DIR, games_per_shard=64, processes=None,
+                  rebuild=False):
+    """
+    Builds the shards for csv_path under cache_dir, or reuses them if they already exist for this CSV and encoding.
+    Returns the shard directory.
+    """
+    csv_digest = file_digest(csv_path)
+    directory = os.path.join(cache_dir, dataset_key(csv_digest))
+    if not rebuild and os.path.exists(os.path.join(directory, MANIFEST_FILE)):
+        return directory
+
+    def write_shards(tmp_directory):
+        games = read_games(csv_path)
+        # games are numbered in file order so shards can be concatenated back in order
+        numbered = [(number, winner, moves) for number, (_, winner, moves) in enumerate(games)]
+        tasks = [(tmp_directory, f'shard_{i // games_per_shard:05d}', numbered[i:i + games_per_shard])
+                 for i in range(0, len(numbered), games_per_shard)]
+        with Pool(processes) as pool:
+            results = sorted(pool.imap_unordered(write_shard, tasks))
+        return {'version': ENCODING_VERSION, 'history_length': HISTORY_LENGTH, 'csv': os.path.abspath(csv_path),
+                'csv_sha1': csv_digest, 'games': len(games), 'positions': sum(result[1] for result in results),
+                'rejected_games': sum(result[2] for result in results),
+                'shards': [{'name': name, 'positions': positions} for name, positions, _ in results]}
+    build_directory(directory, write_shards)
+    return directory
+
+def load_shards(directory, mmap_mode='r'):
+    """
+    Returns dictionary of the shard arrays concatenated in game order (memory mapped per shard before concatenating).
+    """
+    with open(os.path.join(directory, MANIFEST_FILE)) as f:
+        manifest = json.load(f)
+    arrays = {name: [] for name in SHARD_ARRAYS}
+    for shard in manifest['shards']:
+        for name in SHARD_ARRAYS:
+            arrays[name].append(np.load(os.path.join(directory, shard['name'], name + '.npy'), mmap_mode=mmap_mode))
+    return {name: np.concatenate(parts) for name, parts in arrays.items()}
+
+def decode_planes(planes, dtype=np.float32):
+    """
+    Unpacks (N, 486) packed planes into (N, 9, 9, 49) network inputs.
+    """
+    count = len(planes)
+    x = np.empty((count, LEN_ROW, LEN_ROW, num_planes(HISTORY_LENGTH)), dtype=dtype)
+    x.reshape(count, NUM_SQUARES, -1)[:, :, :STORED_PLANES] = np.unpackbits(planes, axis=1).reshape(count, NUM_SQUARES, STORED_PLANES)
+    x[..., -1] = 1
+    return x
+
+def policy_targets(legal, moves):
+    """
+    Builds (N, 1296) policy targets as the notebook did: -1 for illegal moves, 0 for legal moves and 1 for the move
+    played.
+    """
+    mask = np.unpackbits(legal, axis=1).astype(bool)
+    policy = np.where(mask, 0., -1.).astype(np.float32)
+    policy[np.arange(len(moves)), moves] = 1.
+    return policy
+
+def load_dataset(csv_path=DEFAULT_CSV_PATH, cache_dir=DEFAULT_CACHE_DIR, processes=None):
+    """
+    Returns (board tensors, policy vectors, result values) ready for model.fit, building the shards first if needed.
+    """
+    arrays = load_shards(build_dataset(csv_path, cache_dir, processes=processes))
+    return decode_planes(arrays['planes']), policy_targets(arrays['legal'], arrays['moves']), arrays['values']
+
+if __name__ == '__main__':
+    csv_path = sys.argv[1] if len(sys.argv) > 1 else DEFAULT_CSV_PATH
+    directory = build_dataset(csv_path)
+    with open(os.path.join(directory, MANIFEST_FILE)) as f:
+        manifest = json.load(f)
+    print(f"{manifest['positions']} positions from {manifest['games']} games ({manifest['rejected_games']} stopped at an "
+          f"illegal move) in {directory}")
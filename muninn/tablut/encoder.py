@@ -0,0 +1,110 @@
+"""
+Network input encoding. encode_histories is the one encoder: it writes the channels last (batch, 9, 9, 49) planes of a
+batch of positions, history included, straight into a caller's array. Every plane, flags included, is laid out as
+bitboard bytes ordered (byte, position, plane), so a single unpack along the byte axis yields each square's channels in
+order and the planes are written with one assignment, without transposing. Encoder wraps it around a preallocated
+batch buffer, used by search and to encode games as they are played or replayed.
+"""
+import numpy as np
+
+from game import Board, LEN_ROW, NUM_SQUARES
+
+HISTORY_LENGTH = 8
+PLANES_PER_POSITION = 6
+
+def num_planes(history_length=HISTORY_LENGTH):
+    """
+    Returns number of input planes: 6 per position plus the constant plane of 1s.
+    """
+    return PLANES_PER_POSITION * history_length + 1
+
+# (9, 9, 49) network input
+INPUT_SHAPE = (LEN_ROW, LEN_ROW, num_planes())
+# planes stored for training, all but the constant plane of 1s
+STORED_PLANES = PLANES_PER_POSITION * HISTORY_LENGTH
+
+# bytes of a bitboard's little endian words, the low word holding squares 0-63 and the high word squares 64-80
+WORD_BYTES = 16
+BYTE_SHIFTS = np.arange(0, 64, 8, dtype=np.uint64)
+SQUARE_BYTES = (NUM_SQUARES + 7) // 8
+# the empty castle, repetition and turn planes as bitboard words, set where the flag is
+CASTLE_PLANE = (1 << Board.CASTLE).to_bytes(WORD_BYTES, 'little')
+FULL_PLANE = ((1 << NUM_SQUARES) - 1).to_bytes(WORD_BYTES, 'little')
+EMPTY_PLANE = bytes(WORD_BYTES)
+
+def history_planes(out):
+    """
+    Returns view of the history planes of out, C-contiguous (batch, 9, 9, 6 * history_length + 1) inputs, as (batch,
+    square, position, plane). Raises ValueError if out isn't C-contiguous, as writes to a copy would be lost.
+    """
+    if not out.flags.c_contiguous:
+        raise ValueError('network inputs must be written to a C-contiguous array')
+    history_length = (out.shape[-1] - 1) // PLANES_PER_POSITION
+    return out.reshape(len(out), NUM_SQUARES, -1)[:, :, :-1].reshape(len(out), NUM_SQUARES, history_length,
+                                                                       PLANES_PER_POSITION)
+
+def encode_histories(histories, turns, out):
+    """
+    Encodes positions given as Board.history lists, with the side to move in each, into out, a C-contiguous
+    (len(histories), 9, 9, 6 * history_length + 1) array of any dtype. Each position contributes the planes [white,
+    black, king, empty castle, repetition, turn] for itself and the positions before it, newest first and zeros before
+    the start of the game, then a constant plane of 1s. Returns out.
+    """
+    count = len(histories)
+    planes = history_planes(out)
+    length = planes.shape[2]
+    lengths = np.fromiter(map(len, histories), dtype=np.int64, count=count)
+    present = np.arange(length) < lengths[:, None]
+    white_to_move = [turn == Board.WHITE for turn in turns]
+    # every plane as a bitboard's (low, high) words, (batch, position, plane, word), zero for missing history. present
+    # is True for a prefix of each row, so masked assignment puts the flattened positions in their places. Sides
+    # alternate going back through the history
+    words = np.zeros((count, length, PLANES_PER_POSITION, 2), dtype=np.uint64)
+    words[present] = np.frombuffer(b''.join([
+        white.to_bytes(WORD_BYTES, 'little') + black.to_bytes(WORD_BYTES, 'little') + king.to_bytes(WORD_BYTES, 'little')
+        + (CASTLE_PLANE if castle_empty else EMPTY_PLANE) + (FULL_PLANE if repetition_counter > 1 else EMPTY_PLANE)
+        + (FULL_PLANE if (h % 2 == 0) == white_turn else EMPTY_PLANE)
+        for history, white_turn in zip(histories, white_to_move)
+        for h, (white, black, king, castle_empty, repetition_counter) in enumerate(history)]),
+        dtype='<u8').reshape(-1, PLANES_PER_POSITION, 2)
+    # the words' bytes laid out (batch, byte, position, plane), so unpacking the byte axis gives each square's bits in
+    # channel order, written to out in one pass
+    pieces = np.empty((count, SQUARE_BYTES, length, PLANES_PER_POSITION), dtype=np.uint8)
+    pieces[:, :8] = words[:, None, ..., 0] >> BYTE_SHIFTS[:, None, None]
+    pieces[:, 8:] = words[:, None, ..., 1] >> BYTE_SHIFTS[:SQUARE_BYTES - 8, None, None]
+    planes[:] = np.unpackbits(pieces, axis=1, count=NUM_SQUARES, bitorder='little')
+    out[..., -1] = 1
+    return out
+
+class Encoder():
+    """
+    Preallocated batch of network inputs. encode writes each board (with its history from the undo stack) straight into
+    its slot and returns a view of the filled part, ready to pass to predict. The view is overwritten by the next call.
+    """
+    def __init__(self, batch_size=1, history_length=HISTORY_LENGTH, dtype=np.float32):
+        self.history_length = history_length
+        self.buffer = np.zeros((batch_size, LEN_ROW, LEN_ROW, num_planes(history_length)), dtype=dtype)
+
+    def grow(self, batch_size):
+        """
+        Reallocates the buffer to hold at least batch_size inputs.
+        """
+        if batch_size > len(self.buffer):
+            self.buffer = np.zeros((batch_size,) + self.buffer.shape[1:], dtype=self.buffer.dtype)
+
+    def encode(self, boards):
+        """
+        Encodes boards, each with its history from the undo stack, into the buffer. Returns a (len(boards), 9, 9, 49)
+        view.
+        """
+        return self.encode_histories([board.history(self.history_length) for board in boards],
+                                     [board.turn for board in boards])
+
+    def encode_histories(self, histories, turns):
+        """
+        Encodes positions given as Board.history lists, with the side to move in each, into the buffer. Returns a
+        (len(histories), 9, 9, 49) view. Lets a caller take each position's history while its board is there, and
+        encode them together later.
+        """
+        self.grow(len(histories))
+        return encode_histories(histories, turns, self.buffer[:len(histories)])
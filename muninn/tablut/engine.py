@@ -0,0 +1,331 @@
+"""
+Persistent engine process speaking a line-based protocol on stdin/stdout. The network is loaded once and the search
+tree is kept between commands: applying a move promotes the searched child to root, so earlier work carries over, and
+with pondering on the engine keeps searching in a background thread while waiting for the next command. Run from this
+directory:
+
+    python engine.py [--weights PATH.npz | --model PATH.keras [--backend function]] [--book DIR] [--ponder]
+                     [--ponder-nodes N]
+
+Commands, one per line:
+
+    isready                             replies readyok
+    newgame                             starting position, fresh tree and caches
+    position startpos [moves M ...]     starting position, then moves
+    position board ROWS w|b [moves ...] position from 9 rows of W B K x . (squares 0-8 first) joined by '/'
+    move M                              applies one move, eg. e3-e5
+    go [nodes N] [movetime MS] [infinite]
+                                        searches in the background, then prints info and bestmove lines
+    stop                                ends the running search, which still reports its best move
+    ponder on|off                       search on the opponent's time while idle, up to --ponder-nodes root visits
+    show                                prints the position
+    legal                               prints the legal moves
+    quit
+
+Moves use the games CSV notation, from and to squares as file a-i and rank 1-9. Scores are the searched value for the
+side to move, from -1 to 1. Errors are reported as 'error <message>' lines.
+
+The engine imports neither TensorFlow nor matplotlib unless a Keras model is loaded, so rule-only use (legal, show) and
+the NumPy backend start fast.
+"""
+import argparse
+import math
+import sys
+import threading
+import time
+
+import numpy as np
+
+import mcts
+from game import Board, LEN_ROW, NUM_SQUARES, PIECE_SYMBOLS
+from dataset import file_to_index, translate_move
+from solver import Solver
+
+FILES = sorted(file_to_index, key=file_to_index.get)
+SYMBOLS = {piece: symbol for symbol, piece in PIECE_SYMBOLS.items()}
+
+def parse_move(text):
+    """
+    Parses a move such as 'e3-e5' into a (from_sq, to_sq) tuple. Raises ValueError if malformed.
+    """
+    if len(text) != 5 or text[2] != '-' or text[0] not in file_to_index or text[3] not in file_to_index \
+            or not text[1].isdigit() or not text[4].isdigit() or text[1] == '0' or text[4] == '0':
+        raise ValueError(f"bad move {text!r}")
+    return translate_move(text)
+
+def format_move(move):
+    """
+    Returns a (from_sq, to_sq) move in the 'e3-e5' notation.
+    """
+    return '-'.join(f'{FILES[sq % LEN_ROW]}{sq // LEN_ROW + 1}' for sq in move)
+
+def parse_board(rows, turn):
+    """
+    Returns a Board for a position command's rows and turn. Raises ValueError if malformed.
+    """
+    symbols = rows.replace('/', '')
+    if len(symbols) != NUM_SQUARES or any(symbol not in PIECE_SYMBOLS for symbol in symbols):
+        raise ValueError(f"bad board {rows!r}")
+    if turn not in ('w', 'b'):
+        raise ValueError(f"bad turn {turn!r}")
+    b = Board()
+    b.set_position(np.array([PIECE_SYMBOLS[symbol] for symbol in symbols]).reshape(LEN_ROW, LEN_ROW),
+                   Board.WHITE if turn == 'w' else Board.BLACK)
+    return b
+
+def principal_variation(root_node, max_length=10):
+    """
+    Returns the most visited line from root_node.
+    """
+    moves = []
+    node = root_node
+    while node is not None and node.child_edges and len(moves) < max_length:
+        edge = max(node.child_edges, key=lambda edge: edge.N)
+        if not edge.N:
+            break
+        moves.append(Board.INDEX_TO_MOVE[edge.move])
+        node = edge.child_node
+    return moves
+
+class Engine():
+    """
+    Holds the board, the searcher and its tree between commands. Searches run in a background thread. Commands that
+    change the position stop the running search first, so the board is only ever used by one thread at a time. output
+    is called with each reply line.
+    """
+    def __init__(self, network, nodes=800, batch_size=8, solver=True, book=None, ponder=False, ponder_nodes=100000,
+                 output=print):
+        self.searcher = mcts.MCTS(network, iterations=None, batch_size=batch_size, cache=mcts.EvaluationCache(),
+                                  solver=Solver() if solver else None, book=book)
+        # default budget of a go without limits
+        self.nodes = nodes
+        self.ponder = ponder
+        # visits the root may reach by pondering, which bounds the tree grown while idle
+        self.ponder_nodes = ponder_nodes
+        self.output_lock = threading.Lock()
+        self.output_fn = output
+        self.thread = None
+        self.new_game()
+
+    def output(self, line):
+        with self.output_lock:
+            self.output_fn(line)
+
+    def new_game(self):
+        self.stop()
+        if self.searcher.cache is not None:
+            self.searcher.cache.clear()
+        if self.searcher.solver is not None:
+            self.searcher.solver.clear()
+        b = Board()
+        b.set_starting_position()
+        self.set_board(b)
+
+    def set_board(self, board, moves=()):
+        """
+        Sets the position to board followed by moves, starting a fresh tree. Raises ValueError on an illegal move,
+        leaving the position and any running search unchanged.
+        """
+        # board isn't the searched one, so the moves are checked before stopping the search
+        for move in moves:
+            if move not in board.generate_moves():
+                raise ValueError(f"illegal move {format_move(move)}")
+            board.apply_move(move)
+        self.stop()
+        self.board = board
+        self.root = self.searcher.new_root(board)
+        self.start_ponder()
+
+    def apply_move(self, move):
+        """
+        Plays move, keeping the searched subtree below it. Raises ValueError if illegal, pondering on as before.
+        """
+        # the search is using the board, so it is stopped before checking the move
+        self.stop()
+        if self.board.is_terminal()[0] or move not in self.board.generate_moves():
+            self.start_ponder()
+            raise ValueError(f"illegal move {format_move(move)}")
+        self.board.apply_move(move)
+        self.root = self.searcher.advance(move, self.board)
+        self.start_ponder()
+
+    def go(self, nodes=None, movetime=None, infinite=False):
+        """
+        Starts a search reporting its best move when done. Without limits it runs self.nodes simulations.
+        """
+        self.stop()
+        if self.board.is_terminal()[0]:
+            self.output('bestmove none')
+            return
+        if infinite:
+            time_limit = math.inf
+        else:
+            time_limit = movetime / 1000 if movetime is not None else None
+            if nodes is None and time_limit is None:
+                nodes = self.nodes
+        self.start_search(nodes, time_limit, report=True)
+
+    def start_ponder(self):
+        """
+        Ponders until stopped or until the root has ponder_nodes visits, counting those it already has.
+        """
+        nodes = self.ponder_nodes - self.root.parent_edge.N
+        if self.ponder and nodes > 0 and not self.board.is_terminal()[0]:
+            self.start_search(nodes, math.inf, report=False)
+
+    def start_search(self, nodes, time_limit, report):
+        self.thread = threading.Thread(target=self.run_search, args=(nodes, time_limit, report),
+                                       name='search' if report else 'ponder', daemon=True)
+        self.thread.start()
+
+    def run_search(self, nodes, time_limit, report):
+        start = time.perf_counter()
+        move_probs = self.searcher.search(self.root, self.board, nodes, time_limit)
+        if report:
+            self.report(move_probs, time.perf_counter() - start)
+
+    def report(self, move_probs, elapsed):
+        """
+        Prints the info line and best move for a finished search.
+        """
+        move, _, _, value = max(move_probs, key=lambda entry: (entry[1], entry[2]))
+        # values are from White's perspective
+        score = value if self.board.turn == Board.WHITE else -value
+        pv = principal_variation(self.root)
+        if not pv or pv[0] != move:
+            pv = [move]
+        simulations = self.searcher.simulations
+        self.output(f"info nodes {simulations} visits {self.root.parent_edge.N} time {elapsed * 1000:.0f} "
+                    f"nps {simulations / elapsed if elapsed > 0 else 0:.0f} score {score:.3f} "
+                    f"stop {self.searcher.stop_reason} pv {' '.join(format_move(move) for move in pv)}")
+        self.output(f"bestmove {format_move(move)}")
+
+    def stop(self):
+        """
+        Ends the running search, if any, and waits for it. A go search still reports its best move.
+        """
+        if self.thread is not None:
+            self.searcher.stop_requested = True
+            self.thread.join()
+            self.searcher.stop_requested = False
+            self.thread = None
+
+    def show(self):
+        for row in self.board.to_array():
+            self.output(' '.join(SYMBOLS[piece] for piece in row))
+        terminal, winner = self.board.is_terminal()
+        if terminal:
+            self.output(f"result {'white' if winner == Board.WHITE else 'black'} wins")
+        else:
+            self.output(f"turn {'white' if self.board.turn == Board.WHITE else 'black'}")
+
+    def handle(self, line):
+        """
+        Runs one command line. Returns False on quit.
+        """
+        words = line.split()
+        if not words:
+            return True
+        command, args = words[0], words[1:]
+        try:
+            if command == 'quit':
+                self.stop()
+                return False
+            elif command == 'isready':
+                self.output('readyok')
+            elif command == 'newgame':
+                self.new_game()
+            elif command == 'position':
+                self.position(args)
+            elif command == 'move' and len(args) == 1:
+                self.apply_move(parse_move(args[0]))
+            elif command == 'go':
+                self.go(**parse_go(args))
+            elif command == 'stop':
+                self.stop()
+            elif command == 'ponder' and args in (['on'], ['off']):
+                self.ponder = args[0] == 'on'
+                if self.ponder:
+                    if self.thread is None or not self.thread.is_alive():
+                        self.start_ponder()
+                elif self.thread is not None and self.thread.name == 'ponder':
+                    self.stop()
+            elif command == 'show':
+                self.show()
+            elif command == 'legal':
+                self.output(' '.join(format_move(move) for move in self.board.generate_moves()))
+            else:
+                raise ValueError(f"unknown command {line.strip()!r}")
+        except ValueError as e:
+            self.output(f'error {e}')
+        return True
+
+    def position(self, args):
+        moves = []
+        if 'moves' in args:
+            split = args.index('moves')
+            args, moves = args[:split], [parse_move(move) for move in args[split + 1:]]
+        if args == ['startpos']:
+            b = Board()
+            b.set_starting_position()
+        elif len(args) == 3 and args[0] == 'board':
+            b = parse_board(args[1], args[2])
+        else:
+            raise ValueError('position needs startpos or board ROWS w|b')
+        self.set_board(b, moves)
+
+def parse_go(args):
+    """
+    Returns go keyword arguments from a go command's words.
+    """
+    kwargs = {}
+    i = 0
+    while i < len(args):
+        if args[i] == 'infinite':
+            kwargs['infinite'] = True
+            i += 1
+        elif args[i] in ('nodes', 'movetime') and i + 1 < len(args) and args[i + 1].isdigit():
+            kwargs[args[i]] = int(args[i + 1])
+            i += 2
+        else:
+            raise ValueError(f"bad go argument {args[i]!r}")
+    return kwargs
+
+def serve(engine, lines=sys.stdin):
+    """
+    Runs commands from lines until quit or end of input.
+    """
+    for line in lines:
+        if not engine.handle(line):
+            break
+    engine.stop()
+
+def load_engine_network(weights=None, model=None, backend='function'):
+    """
+    Returns the engine's network: NumPy weights from an export_weights .npz, or a Keras model run by backend.
+    """
+    from inference import DEFAULT_MODEL_PATH, NumpyNetwork, load_network
+    if weights is not None:
+        return NumpyNetwork(weights)
+    return load_network(backend, model_path=model or DEFAULT_MODEL_PATH)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Tablut engine speaking a line-based protocol')
+    parser.add_argument('--weights', help='export_weights .npz for the NumPy backend, no TensorFlow needed')
+    parser.add_argument('--model', help='Keras model (default: the supervised model)')
+    parser.add_argument('--backend', default='function', help='backend for a Keras model')
+    parser.add_argument('--nodes', type=int, default=800, help='simulations for a go without limits')
+    parser.add_argument('--batch-size', type=int, default=8)
+    parser.add_argument('--book', help='game database directory to use as opening book')
+    parser.add_argument('--no-solver', action='store_true')
+    parser.add_argument('--ponder', action='store_true')
+    parser.add_argument('--ponder-nodes', type=int, default=100000, help='root visits at which pondering stops')
+    args = parser.parse_args()
+
+    book = None
+    if args.book:
+        from gamedb import GameDatabase, OpeningBook
+        book = OpeningBook(GameDatabase(args.book))
+    engine = Engine(load_engine_network(args.weights, args.model, args.backend), args.nodes, args.batch_size,
+                    not args.no_solver, book, args.ponder, args.ponder_nodes, output=lambda line: print(line, flush=True))
+    serve(engine)
@@ -1 +1,738 @@
+"""
+Bitboard Tablut engine. Every piece type is stored as an 81-bit integer where bit (row * 9 + col) is set if the piece
+occupies that square. Moves are (from_sq, to_sq) tuples of square indexes. All geometry (sliding rays, capture pairs,
+edges, castle) is precomputed once at import so the hot loops never do bounds checks.
+"""
+import random
 import numpy as np
+
+LEN_ROW = 9
+NUM_SQUARES = LEN_ROW**2
+FULL_MASK = (1 << NUM_SQUARES) - 1
+BITBOARD_BYTES = 11
+
+def square(row, col):
+    """
+    Converts (row, col) coordinates to a square index.
+    """
+    return row * LEN_ROW + col
+
+def generate_square_masks():
+    """
+    Returns list of single bit masks for every square.
+    """
+    return [1 << sq for sq in range(NUM_SQUARES)]
+
+def generate_column_mask(col):
+    """
+    Returns mask of all squares in given column.
+    """
+    mask = 0
+    for row in range(LEN_ROW):
+        mask |= 1 << square(row, col)
+    return mask
+
+def generate_edge_mask():
+    """
+    Returns mask of all the board edge squares.
+    """
+    mask = 0
+    for sq in range(NUM_SQUARES):
+        row, col = divmod(sq, LEN_ROW)
+        if row in (0, LEN_ROW - 1) or col in (0, LEN_ROW - 1):
+            mask |= 1 << sq
+    return mask
+
+# direction order used in all ray tables: up, down, left, right
+DIRECTIONS = ((-1, 0), (1, 0), (0, -1), (0, 1))
+
+def generate_rays():
+    """
+    Creates sliding ray masks. Returns RAYS[sq][d] (mask of every square passed through when sliding from sq in direction d)
+    and RAY_SQUARES[sq][d] (tuple of those squares ordered by distance from sq).
+    """
+    rays = []
+    ray_squares = []
+    for sq in range(NUM_SQUARES):
+        row, col = divmod(sq, LEN_ROW)
+        sq_rays = []
+        sq_ray_squares = []
+        for dr, dc in DIRECTIONS:
+            mask = 0
+            squares = []
+            r, c = row + dr, col + dc
+            while 0 <= r < LEN_ROW and 0 <= c < LEN_ROW:
+                mask |= 1 << square(r, c)
+                squares.append(square(r, c))
+                r += dr
+                c += dc
+            sq_rays.append(mask)
+            sq_ray_squares.append(tuple(squares))
+        rays.append(tuple(sq_rays))
+        ray_squares.append(tuple(sq_ray_squares))
+    return rays, ray_squares
+
+def generate_neighbour_masks():
+    """
+    Returns list of masks of the (up to 4) orthogonally adjacent squares for every square.
+    """
+    neighbours = []
+    for sq in range(NUM_SQUARES):
+        row, col = divmod(sq, LEN_ROW)
+        mask = 0
+        for dr, dc in DIRECTIONS:
+            r, c = row + dr, col + dc
+            if 0 <= r < LEN_ROW and 0 <= c < LEN_ROW:
+                mask |= 1 << square(r, c)
+        neighbours.append(mask)
+    return neighbours
+
+def generate_capture_pairs():
+    """
+    Returns CAPTURE_PAIRS[sq], a tuple of (enemy_mask, anvil_mask) for every direction in which a piece landing on sq could
+    sandwich an enemy against a square two over. Directions that would run off the board are left out.
+    """
+    capture_pairs = []
+    for sq in range(NUM_SQUARES):
+        row, col = divmod(sq, LEN_ROW)
+        pairs = []
+        for dr, dc in DIRECTIONS:
+            r, c = row + 2 * dr, col + 2 * dc
+            if 0 <= r < LEN_ROW and 0 <= c < LEN_ROW:
+                pairs.append((1 << square(row + dr, col + dc), 1 << square(r, c)))
+        capture_pairs.append(tuple(pairs))
+    return capture_pairs
+
+def build_policy_map():
+    """
+    Creates the policy head move index in the same order as the network PolicyMap layer. Returns a flattened (32, 9, 9)
+    policy map of move indexes (-1 for impossible moves), and dictionaries index_to_move / move_to_index where moves
+    are (from_sq, to_sq) tuples.
+    """
+    policy_map = np.full((32, LEN_ROW, LEN_ROW), -1)
+    index_to_move = {}
+    index = 0
+    for row in range(LEN_ROW):
+        for col in range(LEN_ROW):
+            from_sq = square(row, col)
+            for left_moves in range(0, 8):
+                if col > left_moves:
+                    policy_map[(left_moves, row, col)] = index
+                    index_to_move[index] = (from_sq, square(row, col - left_moves - 1))
+                    index += 1
+
+            for right_moves in range(0, 8):
+                if col < 8 - right_moves:
+                    policy_map[(8 + right_moves, row, col)] = index
+                    index_to_move[index] = (from_sq, square(row, col + right_moves + 1))
+                    index += 1
+
+            for up_moves in range(0, 8):
+                if row > up_moves:
+                    policy_map[(16 + up_moves, row, col)] = index
+                    index_to_move[index] = (from_sq, square(row - up_moves - 1, col))
+                    index += 1
+
+            for down_moves in range(0, 8):
+                if row < 8 - down_moves:
+                    policy_map[(24 + down_moves, row, col)] = index
+                    index_to_move[index] = (from_sq, square(row + down_moves + 1, col))
+                    index += 1
+
+    move_to_index = {move: idx for idx, move in index_to_move.items()}
+
+    return policy_map.flatten(), index_to_move, move_to_index
+
+def build_mapping_indices():
+    """
+    Returns vector of length 1296 where index = move index and value = index into the flattened policy convolution output.
+    Both the network's PolicyMap layer and the NumPy forward pass gather the policy logits with it.
+    """
+    mapping_indices = np.zeros(len(INDEX_TO_MOVE), dtype=np.int64)
+    for index, value in enumerate(POLICY_MAP):
+        if value != -1:
+            mapping_indices[value] = index
+    return mapping_indices
+
+def bitboard_to_array(bitboard):
+    """
+    Converts an 81-bit bitboard to a length 81 uint8 array of 0/1.
+    """
+    return np.unpackbits(np.frombuffer(bitboard.to_bytes(BITBOARD_BYTES, 'little'), dtype=np.uint8), bitorder='little')[:NUM_SQUARES]
+
+def array_to_bitboard(array):
+    """
+    Converts any 81 element boolean-like array to an 81-bit bitboard.
+    """
+    packed = np.packbits(np.asarray(array, dtype=bool).reshape(-1), bitorder='little')
+    return int.from_bytes(packed.tobytes(), 'little')
+
+def iter_squares(bitboard):
+    """
+    Yields square indexes of all set bits in bitboard, lowest first.
+    """
+    while bitboard:
+        lsb = bitboard & -bitboard
+        yield lsb.bit_length() - 1
+        bitboard ^= lsb
+
+SQUARE_MASKS = generate_square_masks()
+NOT_COL_0 = FULL_MASK ^ generate_column_mask(0)
+NOT_COL_8 = FULL_MASK ^ generate_column_mask(LEN_ROW - 1)
+EDGE_MASK = generate_edge_mask()
+RAYS, RAY_SQUARES = generate_rays()
+NEIGHBOURS = generate_neighbour_masks()
+CAPTURE_PAIRS = generate_capture_pairs()
+
+def dilate(bitboard):
+    """
+    Returns mask of every square orthogonally adjacent to a set square in bitboard.
+    """
+    return (((bitboard << LEN_ROW) | (bitboard >> LEN_ROW) | ((bitboard << 1) & NOT_COL_0) |
+             ((bitboard >> 1) & NOT_COL_8)) & FULL_MASK)
+
+class ZobristHashing():
+    """
+    Zobrist keys for every (piece, square) pair plus a side to move key. Seeded so that hashes agree across processes.
+    """
+    DEFAULT_SEED = 0x7AB107
+
+    def __init__(self, seed=DEFAULT_SEED):
+        self.pieces = [1, 2, 3, 4]
+        rng = random.Random(seed)
+        # zobrist_table[piece][sq], index 0 unused so pieces index directly
+        self.zobrist_table = [None] + [[rng.getrandbits(64) for _ in range(NUM_SQUARES)] for _ in self.pieces]
+        self.black_to_move = rng.getrandbits(64)
+
+    def compute_hash(self, board):
+        """
+        Returns hash computed from scratch for inputted Board.
+        """
+        hash_value = 0
+        for piece, bitboard in ((Board.WHITE, board.white), (Board.BLACK, board.black), (Board.KING, board.king)):
+            for sq in iter_squares(bitboard):
+                hash_value ^= self.zobrist_table[piece][sq]
+        if board.castle_empty:
+            hash_value ^= self.zobrist_table[Board.EMPTY_CASTLE][Board.CASTLE]
+        if board.turn == Board.BLACK:
+            hash_value ^= self.black_to_move
+        return hash_value
+
+    def update_hash(self, hash_value, piece, from_sq, to_sq, captures):
+        """
+        Returns incrementally updated hash value given old hash, piece moved, from square, to square and list of captures
+        (piece, sq). Always flips side to move.
+        """
+        table = self.zobrist_table
+        hash_value ^= table[piece][from_sq] ^ table[piece][to_sq] ^ self.black_to_move
+        # XOR in the empty castle when the King leaves it, XOR it out when he returns
+        if piece == Board.KING:
+            if from_sq == Board.CASTLE:
+                hash_value ^= table[Board.EMPTY_CASTLE][Board.CASTLE]
+            if to_sq == Board.CASTLE:
+                hash_value ^= table[Board.EMPTY_CASTLE][Board.CASTLE]
+        for captured_piece, sq in captures:
+            hash_value ^= table[captured_piece][sq]
+        return hash_value
+
+def _slide_moves(from_sq, direction, blockers, castle_allowed):
+    """
+    Returns tuple of (from_sq, to_sq) moves sliding from from_sq in direction until the first blocker.
+    """
+    moves = []
+    for to_sq in RAY_SQUARES[from_sq][direction]:
+        if blockers & SQUARE_MASKS[to_sq]:
+            break
+        if to_sq == Board.CASTLE and not castle_allowed:
+            continue
+        moves.append((from_sq, to_sq))
+    return tuple(moves)
+
+def generate_byte_squares():
+    """
+    Returns BYTE_SQUARES[byte_index][byte], the squares set in a given byte of a little endian bitboard.
+    """
+    return [[tuple(byte_index * 8 + bit for bit in range(8) if byte >> bit & 1) for byte in range(256)]
+            for byte_index in range(BITBOARD_BYTES)]
+
+BYTE_SQUARES = generate_byte_squares()
+CROSSES = [rays[0] | rays[1] | rays[2] | rays[3] for rays in RAYS]
+
+# slide tables keyed by [sq][direction][occupancy of the ray], filled in lazily as occupancies are seen
+SLIDE_TABLE = [[{} for _ in DIRECTIONS] for _ in range(NUM_SQUARES)]
+KING_SLIDE_TABLE = [[{} for _ in DIRECTIONS] for _ in range(NUM_SQUARES)]
+# all moves of a piece keyed by [sq][occupancy of its row and column]. One lookup per piece, bounded by clearing.
+CROSS_SLIDE_CACHE = [{} for _ in range(NUM_SQUARES)]
+KING_CROSS_SLIDE_CACHE = [{} for _ in range(NUM_SQUARES)]
+CROSS_SLIDE_CACHE_LIMIT = 1024
+# the same moves as policy indexes, filled in when generate_move_indices asks for them
+CROSS_INDEX_CACHE = [{} for _ in range(NUM_SQUARES)]
+KING_CROSS_INDEX_CACHE = [{} for _ in range(NUM_SQUARES)]
+POLICY_MAP, INDEX_TO_MOVE, MOVE_TO_INDEX = build_policy_map()
+
+# all moves of the pieces set in one byte of a side's bitboard, keyed by [byte index][byte][occupancy of their rows and
+# columns]. One lookup covers every piece in the byte, and misses are filled in from the per piece caches.
+BYTE_SLIDE_CACHE = [[{} for _ in range(256)] for _ in range(BITBOARD_BYTES)]
+BYTE_INDEX_CACHE = [[{} for _ in range(256)] for _ in range(BITBOARD_BYTES)]
+BYTE_CACHE_LIMIT = 256
+
+def generate_byte_entries(caches):
+    """
+    Returns entries[byte_index][byte], the (cache, union of the cross masks, squares) of the squares set in a given byte
+    of a little endian bitboard, so the move generators reach a byte's cache and cross mask in one step.
+    """
+    entries = []
+    for byte_index, byte_squares in enumerate(BYTE_SQUARES):
+        index_entries = []
+        for byte, squares in enumerate(byte_squares):
+            squares = tuple(sq for sq in squares if sq < NUM_SQUARES)
+            cross = 0
+            for sq in squares:
+                cross |= CROSSES[sq]
+            index_entries.append((caches[byte_index][byte], cross, squares))
+        entries.append(index_entries)
+    return entries
+
+BYTE_SLIDE_ENTRIES = generate_byte_entries(BYTE_SLIDE_CACHE)
+BYTE_INDEX_ENTRIES = generate_byte_entries(BYTE_INDEX_CACHE)
+
+def ray_slides(table, from_sq, occupied, castle_allowed):
+    """
+    Returns tuple of all slides from from_sq, looking each direction up by ray occupancy.
+    """
+    slides = ()
+    rays = RAYS[from_sq]
+    sq_table = table[from_sq]
+    for direction in range(4):
+        blockers = rays[direction] & occupied
+        direction_slides = sq_table[direction].get(blockers)
+        if direction_slides is None:
+            direction_slides = _slide_moves(from_sq, direction, blockers, castle_allowed)
+            sq_table[direction][blockers] = direction_slides
+        slides += direction_slides
+    return slides
+
+def cache_cross_slides(from_sq, occupied, is_king=False):
+    """
+    Computes slides for a piece on from_sq and stores them in the cross cache. Returns the slides.
+    """
+    cache = KING_CROSS_SLIDE_CACHE[from_sq] if is_king else CROSS_SLIDE_CACHE[from_sq]
+    if len(cache) >= CROSS_SLIDE_CACHE_LIMIT:
+        cache.clear()
+    slides = ray_slides(KING_SLIDE_TABLE if is_king else SLIDE_TABLE, from_sq, occupied, is_king)
+    cache[occupied & CROSSES[from_sq]] = slides
+    return slides
+
+def cache_cross_indices(from_sq, occupied, is_king=False):
+    """
+    Computes the policy indexes of the slides for a piece on from_sq and stores them in the cross index cache. Returns
+    the indexes.
+    """
+    cache = KING_CROSS_INDEX_CACHE[from_sq] if is_king else CROSS_INDEX_CACHE[from_sq]
+    if len(cache) >= CROSS_SLIDE_CACHE_LIMIT:
+        cache.clear()
+    slides_cache = KING_CROSS_SLIDE_CACHE[from_sq] if is_king else CROSS_SLIDE_CACHE[from_sq]
+    slides = slides_cache.get(occupied & CROSSES[from_sq])
+    if slides is None:
+        slides = cache_cross_slides(from_sq, occupied, is_king)
+    indices = tuple(MOVE_TO_INDEX[move] for move in slides)
+    cache[occupied & CROSSES[from_sq]] = indices
+    return indices
+
+def cache_byte_slides(entry, occupied):
+    """
+    Collects the slides of every piece in a BYTE_SLIDE_ENTRIES entry and stores them in its byte cache. Returns the
+    slides.
+    """
+    cache, cross, squares = entry
+    if len(cache) >= BYTE_CACHE_LIMIT:
+        cache.clear()
+    slides = ()
+    for sq in squares:
+        piece_slides = CROSS_SLIDE_CACHE[sq].get(occupied & CROSSES[sq])
+        if piece_slides is None:
+            piece_slides = cache_cross_slides(sq, occupied)
+        slides += piece_slides
+    cache[occupied & cross] = slides
+    return slides
+
+def cache_byte_indices(entry, occupied):
+    """
+    Collects the policy indexes of the slides of every piece in a BYTE_INDEX_ENTRIES entry and stores them in its byte
+    cache. Returns the indexes.
+    """
+    cache, cross, squares = entry
+    if len(cache) >= BYTE_CACHE_LIMIT:
+        cache.clear()
+    indices = ()
+    for sq in squares:
+        piece_indices = CROSS_INDEX_CACHE[sq].get(occupied & CROSSES[sq])
+        if piece_indices is None:
+            piece_indices = cache_cross_indices(sq, occupied)
+        indices += piece_indices
+    cache[occupied & cross] = indices
+    return indices
+
+class Board():
+    """
+    Board object that encodes all information about current position as bitboards.
+    """
+    # Basic piece constants
+    EMPTY = 0
+    WHITE = 1
+    BLACK = 2
+    KING = 3
+    EMPTY_CASTLE = 4
+
+    # Board specific constants
+    CASTLE = square(4, 4)
+    CASTLE_SQUARES = {square(3, 4), square(4, 3), square(4, 4), square(4, 5), square(5, 4)}
+    CASTLE_MASK = 1 << CASTLE
+    CASTLE_AREA_MASK = sum(1 << sq for sq in CASTLE_SQUARES)
+
+    EDGES = set(iter_squares(EDGE_MASK))
+
+    POLICY_MAP = POLICY_MAP
+    INDEX_TO_MOVE = INDEX_TO_MOVE
+    MOVE_TO_INDEX = MOVE_TO_INDEX
+    LEN_OUTPUT_INDEX = len(INDEX_TO_MOVE)
+    # from and to squares of every policy index
+    MOVE_FROM = np.array([INDEX_TO_MOVE[index][0] for index in range(len(INDEX_TO_MOVE))])
+    MOVE_TO = np.array([INDEX_TO_MOVE[index][1] for index in range(len(INDEX_TO_MOVE))])
+
+    STARTING_POSITION = np.array([[0, 0, 0, 2, 2, 2, 0, 0, 0],
+                                  [0, 0, 0, 0, 2, 0, 0, 0, 0],
+                                  [0, 0, 0, 0, 1, 0, 0, 0, 0],
+                                  [2, 0, 0, 0, 1, 0, 0, 0, 2],
+                                  [2, 2, 1, 1, 3, 1, 1, 2, 2],
+                                  [2, 0, 0, 0, 1, 0, 0, 0, 2],
+                                  [0, 0, 0, 0, 1, 0, 0, 0, 0],
+                                  [0, 0, 0, 0, 2, 0, 0, 0, 0],
+                                  [0, 0, 0, 2, 2, 2, 0, 0, 0]])
+
+    def __init__(self, zobrist=None):
+        self.zobrist = zobrist if zobrist is not None else ZobristHashing()
+        self.turn = self.WHITE
+        # piece bitboards
+        self.white = 0
+        self.black = 0
+        self.king = 0
+        self.legal_moves = None
+        # legal moves as a policy index array, computed on request
+        self.legal_indices = None
+        # Tracker for King restrictions
+        self.king_square = None
+        self.king_around_castle = False
+        # set once the King has left the castle, the empty castle is then hostile to both sides
+        self.castle_empty = False
+        # number of times the current position has occurred, tracked through position_counts keyed by Zobrist hash
+        self.repetition_counter = 0
+        self.position_counts = {}
+        self.zobrist_hash = 0
+        # one record per applied move so that undo_move can restore the previous position exactly
+        self.undo_stack = []
+        # blocking squares and edge-reachable open squares from the last surround check, reused as the next fill's seed
+        self.surround_blockers = FULL_MASK
+        self.surround_region = 0
+
+    def set_starting_position(self):
+        """
+        Sets board state to Tablut starting position, sets King castle location flag.
+        """
+        self.set_position(self.STARTING_POSITION, self.WHITE)
+
+    def set_position(self, board_array, turn):
+        """
+        Sets board state from a 9x9 array using the piece constants (EMPTY_CASTLE on the castle square marks it as vacated).
+        """
+        board_array = np.asarray(board_array).reshape(-1)
+        self.white = array_to_bitboard(board_array == self.WHITE)
+        self.black = array_to_bitboard(board_array == self.BLACK)
+        self.king = array_to_bitboard(board_array == self.KING)
+        self.castle_empty = bool(board_array[self.CASTLE] == self.EMPTY_CASTLE)
+        self.king_square = self.king.bit_length() - 1 if self.king else None
+        self.king_around_castle = self.king_square in self.CASTLE_SQUARES
+        self.turn = turn
+        self.legal_moves = None
+        self.legal_indices = None
+        self.zobrist_hash = self.zobrist.compute_hash(self)
+        self.repetition_counter = 1
+        self.position_counts = {self.zobrist_hash: 1}
+        self.undo_stack = []
+
+    def to_array(self):
+        """
+        Returns the position as a 9x9 array of piece constants, in the notebook draw_board format.
+        """
+        board_array = (bitboard_to_array(self.white) * self.WHITE + bitboard_to_array(self.black) * self.BLACK +
+                       bitboard_to_array(self.king) * self.KING)
+        if self.castle_empty:
+            board_array[self.CASTLE] = self.EMPTY_CASTLE
+        return board_array.reshape((LEN_ROW, LEN_ROW))
+
+    def piece_at(self, sq):
+        """
+        Returns piece constant on given square.
+        """
+        mask = SQUARE_MASKS[sq]
+        if self.white & mask:
+            return self.WHITE
+        if self.black & mask:
+            return self.BLACK
+        if self.king & mask:
+            return self.KING
+        if sq == self.CASTLE and self.castle_empty:
+            return self.EMPTY_CASTLE
+        return self.EMPTY
+
+    def find_captures(self, to_sq):
+        """
+        Checks for any captures resulting from a piece landing on to_sq. Returns bitboard of captured squares.
+        """
+        captured = 0
+        castle_hostile = self.CASTLE_MASK if self.castle_empty else 0
+        if self.turn == self.WHITE:
+            anvils = self.white | self.king | castle_hostile
+            black = self.black
+            for enemy_mask, anvil_mask in CAPTURE_PAIRS[to_sq]:
+                if anvil_mask & anvils and enemy_mask & black:
+                    captured |= enemy_mask
+        else:
+            anvils = self.black | castle_hostile
+            white = self.white
+            # King is captured like any other piece away from the castle
+            king = 0 if self.king_around_castle else self.king
+            for enemy_mask, anvil_mask in CAPTURE_PAIRS[to_sq]:
+                if anvil_mask & anvils and enemy_mask & (white | king):
+                    captured |= enemy_mask
+            # in or next to the castle the King must be surrounded on all four sides by attackers or the empty castle
+            if self.king_around_castle and NEIGHBOURS[to_sq] & self.king:
+                if not NEIGHBOURS[self.king_square] & ~anvils:
+                    captured |= self.king
+        return captured
+
+    def apply_move(self, move):
+        """
+        Applies a move to the board. Takes a (from_sq, to_sq) move as input, pushes an undo record and resets legal move 'cache'.
+        """
+        from_sq, to_sq = move
+        move_mask = SQUARE_MASKS[from_sq] | SQUARE_MASKS[to_sq]
+        # undo record: (move, piece moved, captures, white, black, king, king square, king around castle, castle empty,
+        # zobrist hash, repetition counter, legal moves). Filled in once the moved piece and captures are known.
+        previous_state = (self.white, self.black, self.king, self.king_square, self.king_around_castle, self.castle_empty,
+                          self.zobrist_hash, self.repetition_counter, self.legal_moves)
+
+        if self.turn == self.BLACK:
+            piece_moved = self.BLACK
+            self.black ^= move_mask
+        elif self.king_square == from_sq:
+            piece_moved = self.KING
+            self.king ^= move_mask
+            # vacating the castle leaves it hostile, returning to it makes it a normal occupied square again
+            if from_sq == self.CASTLE:
+                self.castle_empty = True
+            if to_sq == self.CASTLE:
+                self.castle_empty = False
+            self.king_square = to_sq
+            self.king_around_castle = to_sq in self.CASTLE_SQUARES
+        else:
+            piece_moved = self.WHITE
+            self.white ^= move_mask
+
+        # captures check
+        captured = self.find_captures(to_sq)
+        captures = []
+        if captured:
+            if self.turn == self.WHITE:
+                self.black ^= captured
+                captures = [(self.BLACK, sq) for sq in iter_squares(captured)]
+            else:
+                if captured & self.king:
+                    captures.append((self.KING, self.king_square))
+                    self.king = 0
+                    self.king_square = None
+                    captured ^= SQUARE_MASKS[captures[0][1]]
+                self.white ^= captured
+                captures += [(self.WHITE, sq) for sq in iter_squares(captured)]
+
+        # switch to next player turn
+        self.turn = self.BLACK if self.turn == self.WHITE else self.WHITE
+        # reset legal move cache
+        self.legal_moves = None
+        self.legal_indices = None
+
+        # generate Zobrist for new boardstate and count its repetitions
+        self.zobrist_hash = self.zobrist.update_hash(hash_value=self.zobrist_hash, piece=piece_moved,
+                                                     from_sq=from_sq, to_sq=to_sq, captures=captures)
+        self.repetition_counter = self.position_counts.get(self.zobrist_hash, 0) + 1
+        self.position_counts[self.zobrist_hash] = self.repetition_counter
+
+        self.undo_stack.append((move, piece_moved, captures) + previous_state)
+
+    def undo_move(self):
+        """
+        Takes back the last applied move, restoring pieces, King flags, hash, repetition state and legal move 'cache'.
+        Returns the move that was undone.
+        """
+        (move, _, _, self.white, self.black, self.king, self.king_square, self.king_around_castle, self.castle_empty,
+         zobrist_hash, self.repetition_counter, self.legal_moves) = self.undo_stack.pop()
+        count = self.position_counts[self.zobrist_hash] - 1
+        if count:
+            self.position_counts[self.zobrist_hash] = count
+        else:
+            del self.position_counts[self.zobrist_hash]
+        self.zobrist_hash = zobrist_hash
+        self.turn = self.BLACK if self.turn == self.WHITE else self.WHITE
+        self.legal_indices = None
+        return move
+
+    def apply_move_index(self, index):
+        """
+        Applies the move with policy index index.
+        """
+        self.apply_move(INDEX_TO_MOVE[index])
+
+    def generate_moves(self, output=None):
+        """
+        Collates and returns all legal moves for the given board state, as a list of (from_sq, to_sq) moves. output
+        'index' returns them as an array of policy indexes instead (in the same order), 'mask' as a (1296,) boolean mask.
+        """
+        if output is not None:
+            if output == 'index':
+                return self.generate_move_indices()
+            if output == 'mask':
+                mask = np.zeros(self.LEN_OUTPUT_INDEX, dtype=bool)
+                mask[self.generate_move_indices()] = True
+                return mask
+            raise ValueError(f"unknown output {output!r}")
+        if self.legal_moves is None:
+            moves = []
+            occupied = self.white | self.black | self.king
+            if self.turn == self.WHITE:
+                pieces = self.white
+                if self.king:
+                    king_square = self.king_square
+                    try:
+                        moves += KING_CROSS_SLIDE_CACHE[king_square][occupied & CROSSES[king_square]]
+                    except KeyError:
+                        moves += cache_cross_slides(king_square, occupied, is_king=True)
+            else:
+                pieces = self.black
+            # walk the pieces a byte at a time, looking up the slides of all of a byte's pieces with the occupancy of
+            # their rows and columns
+            for entries, byte in zip(BYTE_SLIDE_ENTRIES, pieces.to_bytes(BITBOARD_BYTES, 'little')):
+                if byte:
+                    entry = entries[byte]
+                    try:
+                        moves += entry[0][occupied & entry[1]]
+                    except KeyError:
+                        moves += cache_byte_slides(entry, occupied)
+            self.legal_moves = moves
+        return self.legal_moves
+
+    def generate_move_indices(self):
+        """
+        Returns the legal moves as an int64 array of policy indexes, in generate_moves order. Built from the per piece
+        index caches, so no move is looked up individually once a piece's row and column occupancy has been seen.
+        """
+        if self.legal_indices is None:
+            indices = ()
+            occupied = self.white | self.black | self.king
+            if self.turn == self.WHITE:
+                pieces = self.white
+                if self.king:
+                    king_square = self.king_square
+                    try:
+                        indices += KING_CROSS_INDEX_CACHE[king_square][occupied & CROSSES[king_square]]
+                    except KeyError:
+                        indices += cache_cross_indices(king_square, occupied, is_king=True)
+            else:
+                pieces = self.black
+            for entries, byte in zip(BYTE_INDEX_ENTRIES, pieces.to_bytes(BITBOARD_BYTES, 'little')):
+                if byte:
+                    entry = entries[byte]
+                    try:
+                        indices += entry[0][occupied & entry[1]]
+                    except KeyError:
+                        indices += cache_byte_indices(entry, occupied)
+            self.legal_indices = np.fromiter(indices, dtype=np.int64, count=len(indices))
+        return self.legal_indices
+
+    def is_surround(self):
+        """
+        Determines if white pieces are surrounded to meet conditions for Black win.
+        Returns True if surrounded, False otherwise.
+        """
+        defenders = self.white | self.king
+        if defenders & EDGE_MASK:
+            return False
+        # flood fill open squares inwards from the edges, the vacated castle blocks like an attacker
+        castle_hostile = self.CASTLE_MASK if self.castle_empty else 0
+        blockers = defenders | self.black | castle_hostile
+        open_squares = FULL_MASK & ~blockers
+        # squares reached by the last fill stay reachable unless one of them has since been blocked, so the fill can
+        # restart from them instead of from the edges
+        region = self.surround_region
+        if (blockers & ~self.surround_blockers) & region:
+            region = 0
+        region = (region | EDGE_MASK) & open_squares
+        surrounded = True
+        while True:
+            # any open square reached next to a defender means white isn't surrounded
+            if dilate(region) & defenders:
+                surrounded = False
+                break
+            grown = (region | dilate(region)) & open_squares
+            if grown == region:
+                break
+            region = grown
+        self.surround_blockers = blockers
+        self.surround_region = region
+        return surrounded
+
+    def is_terminal(self):
+        """
+        Detects terminal position, returns tuple (bool, int)
+        """
+        # terminal check occurs at beginning of each player's turn (each player can only win on the other's turn)
+        if self.turn == self.BLACK:
+            # white wins if King reaches edge or black has no moves
+            if self.king & EDGE_MASK or not self.generate_moves():
+                return True, self.WHITE
+        # black wins by capture, or game repetition, or no moves, or surrounding.
+        elif not self.king or self.repetition_counter >= 3 or not self.generate_moves() or self.is_surround():
+            return True, self.BLACK
+        return False, None
+
+    def is_winning_move(self):
+        """
+        Checks to see if white has a winning move, the King sliding to an edge. Returns (first) winning move if available.
+        """
+        if self.turn != self.WHITE or not self.king:
+            return None
+        # King slides are generated first
+        for move in self.generate_moves():
+            if move[0] != self.king_square:
+                break
+            if (1 << move[1]) & EDGE_MASK:
+                return move
+        return None
+
+    def get_network_output_index(self, move):
+        """
+        For given move, returns network output index value.
+        """
+        return self.MOVE_TO_INDEX[move]
+
+    def history(self, history_length=8):
+        """
+        Returns the current position and up to history_length - 1 positions before it, newest first, as (white, black,
+        king, castle empty, repetition counter) tuples. Earlier positions are read from the undo stack.
+        """
+        positions = [(self.white, self.black, self.king, self.castle_empty, self.repetition_counter)]
+        for record in reversed(self.undo_stack[max(0, len(self.undo_stack) - history_length + 1):]):
+            positions.append((record[3], record[4], record[5], record[8], record[10]))
+        return positions
+
+# board diagram symbols: W white, B black, K king, x vacated castle, . empty
+PIECE_SYMBOLS = {'.': Board.EMPTY, 'W': Board.WHITE, 'B': Board.BLACK, 'K': Board.KING, 'x': Board.EMPTY_CASTLE}
@@ -0,0 +1,202 @@
+"""
+Indexed game database and opening book. Games are stored as one uint16 policy index per move, and every position
+reached is indexed by Zobrist hash, so win/loss statistics and move frequencies for any position come from a binary
+search instead of replaying games. Run from this directory to build the database from the games CSV:
+
+    python gamedb.py [csv path]
+
+A database directory holds memory-mapped .npy arrays:
+
+    moves           (M,) uint16     policy index of every move, games one after another
+    game_offsets    (G + 1,) int64  each game's moves in moves
+    results         (G,) int8       1 White won, -1 Black won, 0 unfinished
+    hashes          (P,) uint64     Zobrist hash of every position before a move, sorted
+    position_games  (P,) int32      game of each indexed position
+    position_plies  (P,) int16      ply of each indexed position, so its move is moves[game_offsets[game] + ply]
+
+Built from a CSV, the database is reused as long as the CSV is unchanged, so replaying it happens once.
+"""
+import json
+import os
+import sys
+
+import numpy as np
+
+from game import Board
+from dataset import DEFAULT_CSV_PATH, MANIFEST_FILE, build_directory, file_digest, read_games
+
+DATABASE_VERSION = 1
+DEFAULT_DIRECTORY = '../../data/game_database'
+DATABASE_ARRAYS = ('moves', 'game_offsets', 'results', 'hashes', 'position_games', 'position_plies')
+
+def result_code(winner):
+    return 1 if winner == Board.WHITE else -1 if winner == Board.BLACK else 0
+
+def build_arrays(games):
+    """
+    Replays games, an iterable of (winner, moves) with winner a Board piece constant or None and moves (from, to)
+    tuples. A game stops at its first move the engine doesn't accept as legal. Returns (dictionary of the database
+    arrays, number of such games).
+    """
+    b = Board()
+    moves = []
+    offsets = [0]
+    results = []
+    hashes = []
+    position_games = []
+    position_plies = []
+    rejected = 0
+    for game_number, (winner, game_moves) in enumerate(games):
+        b.set_starting_position()
+        for ply, move in enumerate(game_moves):
+            if move not in b.generate_moves():
+                rejected += 1
+                break
+            hashes.append(b.zobrist_hash)
+            position_games.append(game_number)
+            position_plies.append(ply)
+            moves.append(Board.MOVE_TO_INDEX[move])
+            b.apply_move(move)
+        offsets.append(len(moves))
+        results.append(result_code(winner))
+    hashes = np.array(hashes, dtype=np.uint64)
+    order = np.argsort(hashes, kind='stable')
+    arrays = {
+        'moves': np.array(moves, dtype=np.uint16),
+        'game_offsets': np.array(offsets, dtype=np.int64),
+        'results': np.array(results, dtype=np.int8),
+        'hashes': hashes[order],
+        'position_games': np.array(position_games, dtype=np.int32)[order],
+        'position_plies': np.array(position_plies, dtype=np.int16)[order],
+    }
+    return arrays, rejected
+
+class GameDatabase():
+    """
+    Read access to a database directory. Arrays are memory-mapped, so opening it reads only the manifest.
+    """
+    def __init__(self, directory):
+        self.directory = directory
+        with open(os.path.join(directory, MANIFEST_FILE)) as f:
+            self.manifest = json.load(f)
+        for name in DATABASE_ARRAYS:
+            setattr(self, name, np.load(os.path.join(directory, name + '.npy'), mmap_mode='r'))
+
+    @classmethod
+    def build(cls, games, directory, info=None):
+        """
+        Builds a database from games ((winner, moves) pairs, see build_arrays) into directory and returns it opened.
+        """
+        arrays, rejected = build_arrays(games)
+
+        def write_arrays(tmp_directory):
+            for name, array in arrays.items():
+                np.save(os.path.join(tmp_directory, name + '.npy'), array)
+            return {'version': DATABASE_VERSION, 'games': len(arrays['results']), 'moves': len(arrays['moves']),
+                        'rejected_games': rejected, **(info or {})}
+        build_directory(directory, write_arrays)
+        return cls(directory)
+
+    @classmethod
+    def from_csv(cls, csv_path=DEFAULT_CSV_PATH, directory=DEFAULT_DIRECTORY, rebuild=False):
+        """
+        Opens the database for csv_path in directory, building it first if it is missing or was built from another
+        version of the CSV.
+        """
+        csv_digest = file_digest(csv_path)
+        manifest_path = os.path.join(directory, MANIFEST_FILE)
+        if not rebuild and os.path.exists(manifest_path):
+            with open(manifest_path) as f:
+                manifest = json.load(f)
+            if manifest.get('csv_sha1') == csv_digest and manifest.get('version') == DATABASE_VERSION:
+                return cls(directory)
+        games = [(Board.WHITE if winner == 'White' else Board.BLACK, moves) for _, winner, moves in read_games(csv_path)]
+        return cls.build(games, directory, {'csv': os.path.abspath(csv_path), 'csv_sha1': csv_digest})
+
+    def __len__(self):
+        return len(self.results)
+
+    def game_moves(self, game):
+        """
+        Returns the moves of game as (from, to) tuples.
+        """
+        start, end = self.game_offsets[game], self.game_offsets[game + 1]
+        return [Board.INDEX_TO_MOVE[index] for index in self.moves[start:end]]
+
+    def occurrences(self, board):
+        """
+        Returns (games, plies) arrays for every time board's position occurred before a move, in any game.
+        """
+        key = np.uint64(board.zobrist_hash)
+        start = np.searchsorted(self.hashes, key, side='left')
+        end = np.searchsorted(self.hashes, key, side='right')
+        return self.position_games[start:end], self.position_plies[start:end]
+
+    def position_stats(self, board):
+        """
+        Returns statistics over every occurrence of board's position: occurrence count, White wins, Black wins,
+        unfinished games, and moves played from it as a list of (move, count), most frequent first.
+        """
+        games, plies = self.occurrences(board)
+        results = self.results[games]
+        move_indices, counts = np.unique(self.moves[self.game_offsets[games] + plies], return_counts=True)
+        order = np.argsort(-counts, kind='stable')
+        return {'occurrences': len(games), 'white_wins': int(np.sum(results == 1)),
+                'black_wins': int(np.sum(results == -1)), 'unfinished': int(np.sum(results == 0)),
+                'moves': [(Board.INDEX_TO_MOVE[int(move_indices[i])], int(counts[i])) for i in order]}
+
+class OpeningBook():
+    """
+    Opening book over a GameDatabase for the first max_plies plies of a game. A position is in the book once it occurred
+    at least min_games times. MCTS with a book either plays from it without searching (mode 'play', returning the book
+    frequencies as the move probabilities) or searches with the root priors mixed with the book frequencies (mode 'bias',
+    weight being the book's share).
+    """
+    MODES = ('play', 'bias')
+
+    def __init__(self, database, max_plies=8, min_games=5, mode='play', weight=0.5):
+        if mode not in self.MODES:
+            raise ValueError(f"unknown opening book mode {mode!r}")
+        self.database = database
+        self.max_plies = max_plies
+        self.min_games = min_games
+        self.mode = mode
+        self.weight = weight
+
+    def lookup(self, board):
+        """
+        Returns {move: frequency} over the legal moves played from board's position, or None if it isn't in the book.
+        Only occurrences in a game's first max_plies plies count, so a position set up without its moves is gated the
+        same as one played to.
+        """
+        games, plies = self.database.occurrences(board)
+        opening = plies < self.max_plies
+        games, plies = games[opening], plies[opening]
+        if len(games) < self.min_games:
+            return None
+        move_indices, counts = np.unique(self.database.moves[self.database.game_offsets[games] + plies],
+                                         return_counts=True)
+        legal = board.generate_moves('mask')[move_indices]
+        if not legal.any():
+            return None
+        total = counts[legal].sum()
+        return {Board.INDEX_TO_MOVE[int(index)]: count / total
+                for index, count in zip(move_indices[legal], counts[legal])}
+
+    def bias(self, priors, moves, frequencies):
+        """
+        Returns priors for moves mixed with the book frequencies.
+        """
+        book = np.fromiter((frequencies.get(move, 0.) for move in moves), dtype=np.float64, count=len(moves))
+        return (1 - self.weight) * np.asarray(priors) + self.weight * book
+
+if __name__ == '__main__':
+    csv_path = sys.argv[1] if len(sys.argv) > 1 else DEFAULT_CSV_PATH
+    database = GameDatabase.from_csv(csv_path)
+    b = Board()
+    b.set_starting_position()
+    stats = database.position_stats(b)
+    print(f"{len(database)} games, {len(database.moves)} moves ({database.manifest['rejected_games']} games stopped at "
+          f"an illegal move) in {database.directory}")
+    print(f"starting position: {stats['white_wins']} White wins, {stats['black_wins']} Black wins, most played "
+          f"{stats['moves'][:5]}")
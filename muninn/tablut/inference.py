@@ -0,0 +1,394 @@
+"""
+Inference backends for the policy/value network. MCTS, ArrayMCTS and ReinfLearn only call network.predict(x, verbose=0)
+on a (B, 9, 9, 49) float32 batch and read back [policy (B, 1296) logits, value (B, 1)], so any object with that method
+can stand in for the Keras model:
+
+    FunctionNetwork     the model's forward pass compiled once as a tf.function with a fixed input signature
+    TFLiteNetwork       a TFLite export of the model, optionally float16 or int8 quantized
+    NumpyNetwork        a pure NumPy forward pass of the SE-ResNet from weights saved by export_weights, no TensorFlow
+
+TensorFlow is only imported by the backends that need it. Run from this directory to compare backends on CPU:
+
+    python inference.py [model path]
+"""
+import importlib.util
+import sys
+import time
+
+import numpy as np
+
+from game import Board, build_mapping_indices
+from encoder import INPUT_SHAPE, Encoder
+
+DEFAULT_MODEL_PATH = '../saved_models/supervised_model_tablut_muninn.keras'
+BACKENDS = ('keras', 'function', 'tflite', 'tflite_float16', 'tflite_int8', 'numpy')
+
+class FunctionNetwork():
+    """
+    Wraps a Keras model in a tf.function called directly on a tensor, skipping the dataset and callback machinery of
+    Model.predict. The input signature has an open batch dimension so every batch size reuses the one trace. Shares the
+    model's weights, so training the model updates the backend too.
+    """
+    def __init__(self, model, jit_compile=False):
+        import tensorflow as tf
+        self.tf = tf
+        self.model = model
+        self.function = tf.function(lambda x: model(x, training=False), jit_compile=jit_compile,
+                                    input_signature=[tf.TensorSpec((None,) + INPUT_SHAPE, tf.float32)])
+
+    def predict(self, x, verbose=0):
+        policy, value = self.function(self.tf.convert_to_tensor(x, dtype=self.tf.float32))
+        return [policy.numpy(), value.numpy()]
+
+def export_tflite(model, path=None, quantization=None, representative_inputs=None):
+    """
+    Converts a Keras model to a TFLite flatbuffer, saved to path if given. quantization is None, 'float16' (weights
+    stored as float16) or 'int8' (weights and activations, calibrated on representative_inputs, a (N, 9, 9, 49) array
+    of real positions). Returns the flatbuffer bytes.
+    """
+    import tensorflow as tf
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    if quantization == 'float16':
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.target_spec.supported_types = [tf.float16]
+    elif quantization == 'int8':
+        if representative_inputs is None:
+            raise ValueError("int8 quantization needs representative_inputs to calibrate activation ranges")
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.representative_dataset = lambda: ([x[np.newaxis].astype(np.float32)] for x in representative_inputs)
+    elif quantization is not None:
+        raise ValueError(f"unknown quantization {quantization!r}")
+    flatbuffer = converter.convert()
+    if path is not None:
+        with open(path, 'wb') as f:
+            f.write(flatbuffer)
+    return flatbuffer
+
+class TFLiteNetwork():
+    """
+    Runs a TFLite flatbuffer (bytes or a .tflite path) with the TFLite interpreter. The input is resized only when the
+    batch size changes. Outputs are told apart by shape, since the converter doesn't keep the Keras output order.
+    """
+    def __init__(self, model_content=None, model_path=None, num_threads=None):
+        import tensorflow as tf
+        self.interpreter = tf.lite.Interpreter(model_content=model_content, model_path=model_path,
+                                               num_threads=num_threads)
+        self.input_index = self.interpreter.get_input_details()[0]['index']
+        self.batch_size = None
+
+    def resize(self, batch_size):
+        self.interpreter.resize_tensor_input(self.input_index, (batch_size,) + INPUT_SHAPE)
+        self.interpreter.allocate_tensors()
+        self.batch_size = batch_size
+        outputs = self.interpreter.get_output_details()
+        self.policy_index = next(output['index'] for output in outputs if output['shape'][-1] == Board.LEN_OUTPUT_INDEX)
+        self.value_index = next(output['index'] for output in outputs if output['shape'][-1] == 1)
+
+    def predict(self, x, verbose=0):
+        if len(x) != self.batch_size:
+            self.resize(len(x))
+        self.interpreter.set_tensor(self.input_index, np.asarray(x, dtype=np.float32))
+        self.interpreter.invoke()
+        return [self.interpreter.get_tensor(self.policy_index).copy(), self.interpreter.get_tensor(self.value_index).copy()]
+
+def layer_input(layer, producers):
+    """
+    Returns the layer whose output feeds layer, or None for the model input. For an Add, follows the residual branch
+    (the SqueezeExcitation output) rather than the shortcut.
+    """
+    inputs = layer.input if isinstance(layer.input, (list, tuple)) else [layer.input]
+    sources = [producers.get(id(tensor)) for tensor in inputs]
+    for source in sources:
+        if type(source).__name__ == 'SqueezeExcitation':
+            return source
+    source = sources[0]
+    return None if source is None or type(source).__name__ == 'InputLayer' else source
+
+def walk_back(layer, producers, stop=None):
+    """
+    Yields layer and the layers feeding it, back to (not including) stop or the model input.
+    """
+    while layer is not None and layer is not stop:
+        yield layer
+        layer = layer_input(layer, producers)
+
+def weighted_layers(layer, producers, stop=None):
+    """
+    Returns the layers with weights (Conv2D, BatchNormalization, Dense, SqueezeExcitation) from stop to layer, in
+    forward order.
+    """
+    return [layer for layer in walk_back(layer, producers, stop) if layer.get_weights()][::-1]
+
+def batch_norm_weights(layer):
+    gamma, beta, mean, variance = layer.get_weights()
+    return {'gamma': gamma, 'beta': beta, 'mean': mean, 'variance': variance, 'epsilon': np.float32(layer.epsilon)}
+
+def export_weights(model, path=None):
+    """
+    Extracts the weights of a create_model network into a flat dictionary of arrays for NumpyNetwork, following the
+    layer graph back from the two heads so layer names and ordering don't matter. Saves them as .npz to path if given.
+    Returns the dictionary.
+    """
+    producers = {id(layer.output): layer for layer in model.layers}
+    policy_head = model.get_layer('policy_head')
+    value_head = model.get_layer('value_head')
+    # the trunk ends where the policy and value branches split: the first layer both heads trace back through
+    value_path = {id(layer) for layer in walk_back(value_head, producers)}
+    trunk_end = next(layer for layer in walk_back(policy_head, producers) if id(layer) in value_path)
+
+    weights = {'mapping_indices': np.asarray(policy_head.mapping_indices).astype(np.int64)}
+    trunk = weighted_layers(trunk_end, producers)
+    stem_conv, stem_bn = trunk[:2]
+    kernel, bias = stem_conv.get_weights()
+    weights.update({'stem/kernel': kernel, 'stem/bias': bias})
+    weights.update({f'stem/bn/{name}': array for name, array in batch_norm_weights(stem_bn).items()})
+    blocks = trunk[2:]
+    weights['num_blocks'] = np.int64(len(blocks) // 5)
+    for i in range(0, len(blocks), 5):
+        conv1, bn1, conv2, bn2, se = blocks[i:i + 5]
+        prefix = f'block{i // 5}/'
+        weights[prefix + 'conv1/kernel'] = conv1.get_weights()[0]
+        weights[prefix + 'conv2/kernel'] = conv2.get_weights()[0]
+        for name, array in batch_norm_weights(bn1).items():
+            weights[prefix + 'bn1/' + name] = array
+        for name, array in batch_norm_weights(bn2).items():
+            weights[prefix + 'bn2/' + name] = array
+        dense1_kernel, dense1_bias, dense2_kernel, dense2_bias = se.get_weights()
+        weights.update({prefix + 'se/dense1/kernel': dense1_kernel, prefix + 'se/dense1/bias': dense1_bias,
+                        prefix + 'se/dense2/kernel': dense2_kernel, prefix + 'se/dense2/bias': dense2_bias})
+
+    conv1, bn, conv2 = weighted_layers(policy_head, producers, trunk_end)
+    weights.update({'policy/conv1/kernel': conv1.get_weights()[0], 'policy/conv1/bias': conv1.get_weights()[1],
+                    'policy/conv2/kernel': conv2.get_weights()[0], 'policy/conv2/bias': conv2.get_weights()[1]})
+    weights.update({f'policy/bn/{name}': array for name, array in batch_norm_weights(bn).items()})
+
+    conv, bn, dense, head = weighted_layers(value_head, producers, trunk_end)
+    weights['value/conv/kernel'] = conv.get_weights()[0]
+    weights.update({f'value/bn/{name}': array for name, array in batch_norm_weights(bn).items()})
+    weights.update({'value/dense/kernel': dense.get_weights()[0], 'value/dense/bias': dense.get_weights()[1],
+                    'value/head/kernel': head.get_weights()[0], 'value/head/bias': head.get_weights()[1]})
+    if path is not None:
+        np.savez(path, **weights)
+    return weights
+
+def fold_batch_norm(weights, prefix, kernel, bias=None):
+    """
+    Folds inference mode batch normalization into the preceding convolution. Returns (kernel, bias) computing
+    bn(conv(x)) as one convolution.
+    """
+    scale = weights[prefix + 'gamma'] / np.sqrt(weights[prefix + 'variance'] + weights[prefix + 'epsilon'])
+    if bias is None:
+        bias = np.zeros(kernel.shape[-1], dtype=np.float32)
+    folded_bias = weights[prefix + 'beta'] + (bias - weights[prefix + 'mean']) * scale
+    return (kernel * scale).astype(np.float32), folded_bias.astype(np.float32)
+
+def conv(x, kernel, bias=None):
+    """
+    'same' padded, stride 1 convolution of channels last x (B, 9, 9, C) with kernel (k, k, C, F), as one matrix multiply
+    over the k * k shifted copies of x.
+    """
+    size = kernel.shape[0]
+    batch, rows, cols, channels = x.shape
+    if size == 1:
+        out = x.reshape(-1, channels) @ kernel.reshape(channels, -1)
+    else:
+        pad = size // 2
+        padded = np.zeros((batch, rows + 2 * pad, cols + 2 * pad, channels), dtype=x.dtype)
+        padded[:, pad:pad + rows, pad:pad + cols] = x
+        # columns ordered (kernel row, kernel col, channel) to match the kernel's layout
+        columns = np.concatenate([padded[:, i:i + rows, j:j + cols] for i in range(size) for j in range(size)], axis=-1)
+        out = columns.reshape(-1, size * size * channels) @ kernel.reshape(size * size * channels, -1)
+    if bias is not None:
+        out += bias
+    return out.reshape(batch, rows, cols, -1)
+
+def relu(x):
+    return np.maximum(x, 0, out=x)
+
+def sigmoid(x):
+    return 1 / (1 + np.exp(-x))
+
+class NumpyNetwork():
+    """
+    SE-ResNet forward pass in NumPy float32, from export_weights output (a dictionary or .npz path). Batch normalization
+    is folded into the convolutions when loading, so each block is two matrix multiplies plus the squeeze-excitation.
+    Matches the Keras model in inference mode up to float rounding.
+    """
+    def __init__(self, weights):
+        if isinstance(weights, str):
+            with np.load(weights) as f:
+                weights = dict(f)
+        self.mapping_indices = weights['mapping_indices']
+        self.stem = fold_batch_norm(weights, 'stem/bn/', weights['stem/kernel'], weights['stem/bias'])
+        self.blocks = []
+        for i in range(int(weights['num_blocks'])):
+            prefix = f'block{i}/'
+            self.blocks.append((
+                fold_batch_norm(weights, prefix + 'bn1/', weights[prefix + 'conv1/kernel']),
+                fold_batch_norm(weights, prefix + 'bn2/', weights[prefix + 'conv2/kernel']),
+                tuple(weights[prefix + 'se/' + name].astype(np.float32)
+                      for name in ('dense1/kernel', 'dense1/bias', 'dense2/kernel', 'dense2/bias')),
+            ))
+        self.policy_conv1 = fold_batch_norm(weights, 'policy/bn/', weights['policy/conv1/kernel'],
+                                            weights['policy/conv1/bias'])
+        self.policy_conv2 = (weights['policy/conv2/kernel'].astype(np.float32),
+                             weights['policy/conv2/bias'].astype(np.float32))
+        self.value_conv = fold_batch_norm(weights, 'value/bn/', weights['value/conv/kernel'])
+        self.value_dense = (weights['value/dense/kernel'].astype(np.float32), weights['value/dense/bias'].astype(np.float32))
+        self.value_head = (weights['value/head/kernel'].astype(np.float32), weights['value/head/bias'].astype(np.float32))
+
+    def squeeze_excitation(self, x, weights):
+        dense1_kernel, dense1_bias, dense2_kernel, dense2_bias = weights
+        excitation = relu(x.mean(axis=(1, 2)) @ dense1_kernel + dense1_bias) @ dense2_kernel + dense2_bias
+        scale, bias = np.split(excitation, 2, axis=-1)
+        return x * sigmoid(scale)[:, None, None] + bias[:, None, None]
+
+    def predict(self, x, verbose=0):
+        x = np.asarray(x, dtype=np.float32)
+        batch = len(x)
+        x = relu(conv(x, *self.stem))
+        for conv1, conv2, se in self.blocks:
+            shortcut = x
+            y = relu(conv(x, *conv1))
+            y = self.squeeze_excitation(conv(y, *conv2), se)
+            x = relu(y + shortcut)
+        policy = conv(relu(conv(x, *self.policy_conv1)), *self.policy_conv2)
+        policy = policy.reshape(batch, -1)[:, self.mapping_indices]
+        value = relu(conv(x, *self.value_conv)).reshape(batch, -1)
+        value = relu(value @ self.value_dense[0] + self.value_dense[1])
+        value = np.tanh(value @ self.value_head[0] + self.value_head[1])
+        return [policy, value]
+
+def random_weights(filters=64, num_residual_blocks=10, se_ratio=4, policy_conv_size=36, value_conv_size=32, seed=0):
+    """
+    Returns export_weights style dictionary of random weights with create_model's default shapes, for timing the NumPy
+    backend without a trained model.
+    """
+    rng = np.random.default_rng(seed)
+
+    def normal(*shape):
+        return (rng.standard_normal(shape) / np.sqrt(np.prod(shape[:-1]))).astype(np.float32)
+
+    def batch_norm(prefix, channels):
+        return {prefix + 'gamma': np.ones(channels, np.float32), prefix + 'beta': np.zeros(channels, np.float32),
+                prefix + 'mean': np.zeros(channels, np.float32), prefix + 'variance': np.ones(channels, np.float32),
+                prefix + 'epsilon': np.float32(1e-3)}
+
+    channels = INPUT_SHAPE[-1]
+    weights = {'mapping_indices': build_mapping_indices(), 'num_blocks': np.int64(num_residual_blocks),
+               'stem/kernel': normal(3, 3, channels, filters), 'stem/bias': np.zeros(filters, np.float32)}
+    weights.update(batch_norm('stem/bn/', filters))
+    for i in range(num_residual_blocks):
+        prefix = f'block{i}/'
+        weights.update({prefix + 'conv1/kernel': normal(3, 3, filters, filters),
+                        prefix + 'conv2/kernel': normal(3, 3, filters, filters),
+                        prefix + 'se/dense1/kernel': normal(filters, filters // se_ratio),
+                        prefix + 'se/dense1/bias': np.zeros(filters // se_ratio, np.float32),
+                        prefix + 'se/dense2/kernel': normal(filters // se_ratio, 2 * filters),
+                        prefix + 'se/dense2/bias': np.zeros(2 * filters, np.float32)})
+        weights.update(batch_norm(prefix + 'bn1/', filters))
+        weights.update(batch_norm(prefix + 'bn2/', filters))
+    weights.update({'policy/conv1/kernel': normal(3, 3, filters, filters), 'policy/conv1/bias': np.zeros(filters, np.float32),
+                    'policy/conv2/kernel': normal(3, 3, filters, policy_conv_size),
+                    'policy/conv2/bias': np.zeros(policy_conv_size, np.float32)})
+    weights.update(batch_norm('policy/bn/', filters))
+    weights['value/conv/kernel'] = normal(1, 1, filters, value_conv_size)
+    weights.update(batch_norm('value/bn/', value_conv_size))
+    weights.update({'value/dense/kernel': normal(81 * value_conv_size, 128), 'value/dense/bias': np.zeros(128, np.float32),
+                    'value/head/kernel': normal(128, 1), 'value/head/bias': np.zeros(1, np.float32)})
+    return weights
+
+def load_network(backend, model_path=DEFAULT_MODEL_PATH, weights_path=None):
+    """
+    Returns a network with a predict method for backend, one of BACKENDS. The numpy backend loads weights_path (an
+    export_weights .npz) when given, so it never imports TensorFlow; otherwise weights come from the Keras model.
+    """
+    if backend == 'numpy' and weights_path is not None:
+        return NumpyNetwork(weights_path)
+    from model import load_model
+    return backend_network(backend, load_model(model_path))
+
+def backend_network(backend, model, calibration_positions=256):
+    """
+    Returns model wrapped in backend, one of BACKENDS. The int8 export calibrates its activation ranges on
+    calibration_positions positions from random games.
+    """
+    if backend == 'keras':
+        return model
+    if backend == 'function':
+        return FunctionNetwork(model)
+    if backend == 'tflite':
+        return TFLiteNetwork(export_tflite(model))
+    if backend == 'tflite_float16':
+        return TFLiteNetwork(export_tflite(model, quantization='float16'))
+    if backend == 'tflite_int8':
+        return TFLiteNetwork(export_tflite(model, quantization='int8',
+                                           representative_inputs=sample_inputs(calibration_positions, seed=1)))
+    if backend == 'numpy':
+        return NumpyNetwork(export_weights(model))
+    raise ValueError(f"unknown backend {backend!r}")
+
+def sample_inputs(count, seed=0):
+    """
+    Returns (count, 9, 9, 49) network inputs from random games.
+    """
+    rng = np.random.default_rng(seed)
+    x = np.empty((count,) + INPUT_SHAPE, dtype=np.float32)
+    encoder = Encoder(1)
+    b = Board()
+    b.set_starting_position()
+    for i in range(count):
+        if b.is_terminal()[0]:
+            b.set_starting_position()
+        x[i] = encoder.encode([b])[0]
+        moves = b.generate_moves()
+        b.apply_move(moves[rng.integers(len(moves))])
+    return x
+
+def bench_backend(network, x, batch_sizes=(1, 8, 64), min_time=1.0):
+    """
+    Returns {batch size: (milliseconds per call, positions per second)} for network.predict, after a warm-up call.
+    """
+    results = {}
+    for batch_size in batch_sizes:
+        batch = x[:batch_size]
+        network.predict(batch, verbose=0)
+        calls = 0
+        start = time.perf_counter()
+        while time.perf_counter() - start < min_time:
+            network.predict(batch, verbose=0)
+            calls += 1
+        elapsed = time.perf_counter() - start
+        results[batch_size] = (1000 * elapsed / calls, calls * batch_size / elapsed)
+    return results
+
+def compare_backends(backends, model_path=DEFAULT_MODEL_PATH, batch_sizes=(1, 8, 64), min_time=1.0):
+    """
+    Times each backend and checks its outputs against the first one. Returns {backend: (timings, max policy difference,
+    max value difference)}.
+    """
+    x = sample_inputs(max(batch_sizes))
+    results = {}
+    reference = None
+    for backend in backends:
+        network = load_network(backend, model_path)
+        policy, value = network.predict(x, verbose=0)[:2]
+        if reference is None:
+            reference = (policy, value)
+        results[backend] = (bench_backend(network, x, batch_sizes, min_time),
+                            float(np.abs(policy - reference[0]).max()), float(np.abs(value - reference[1]).max()))
+    return results
+
+if __name__ == '__main__':
+    model_path = sys.argv[1] if len(sys.argv) > 1 else DEFAULT_MODEL_PATH
+    if importlib.util.find_spec('tensorflow') is None:
+        # without TensorFlow only the NumPy forward pass can run, timed on random weights
+        print("TensorFlow not available, timing the NumPy backend with random weights")
+        timings = bench_backend(NumpyNetwork(random_weights()), sample_inputs(64))
+        results = {'numpy': (timings, 0., 0.)}
+    else:
+        results = compare_backends(BACKENDS, model_path)
+    for backend, (timings, policy_error, value_error) in results.items():
+        print(f"{backend}: max difference from {next(iter(results))} policy {policy_error:.2e}, value {value_error:.2e}")
+        for batch_size, (latency, throughput) in timings.items():
+            print(f"  batch {batch_size:>3}: {latency:.2f} ms/call, {throughput:,.0f} positions/s")
@@ -0,0 +1,194 @@
+"""
+Optional search instrumentation. Pass a SearchStats to MCTS (stats=...) to collect per-phase timers and counters; it
+emits one report per search to a sink, eg. a JsonLinesWriter or any callable. Without one MCTS holds NULL_STATS, whose
+methods do nothing, so the search code calls its hooks unconditionally and pays one empty call per hook.
+
+Phases are timed as laps: each lap(name) adds the time since the previous lap to name, so consecutive phases cost
+one perf_counter call each. Node level counts (nodes created and expanded, edges created, transposition hits) are
+counted by the searcher, which creates every node and edge, so Node and Edge stay plain slotted records. Board methods
+can be timed as well inside a board_timers block, which wraps them on one board instance for its duration only, so
+other boards (another search, a ponder thread) are neither timed nor affected.
+"""
+import json
+import sys
+import time
+from contextlib import contextmanager
+
+from game import Board
+
+BOARD_METHODS = ('apply_move', 'undo_move', 'generate_moves', 'is_terminal', 'is_surround', 'history')
+
+class SearchStats():
+    """
+    Timers, counters and observed values for one search at a time. Timers map name to [seconds, calls], observations
+    (batch sizes, leaf depths) map name to [count, total, max]. end_search builds the search report, passes it to sink
+    and starts the next search from zero.
+    """
+    def __init__(self, sink=None, measure_memory=True):
+        self.sink = sink
+        # walks the tree after each search to measure node count and memory
+        self.measure_memory = measure_memory
+        self.searches = 0
+        self.last_report = None
+        self.reset()
+
+    def reset(self):
+        self.timers = {}
+        self.counters = {}
+        self.observations = {}
+        self.start = self.last = time.perf_counter()
+
+    def lap(self, name=None):
+        """
+        Adds the time since the last lap to timer name. Without a name only restarts the lap.
+        """
+        now = time.perf_counter()
+        if name is not None:
+            self.add_time(name, now - self.last)
+        self.last = now
+
+    def add_time(self, name, seconds):
+        timer = self.timers.get(name)
+        if timer is None:
+            self.timers[name] = [seconds, 1]
+        else:
+            timer[0] += seconds
+            timer[1] += 1
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def observe(self, name, value):
+        observation = self.observations.get(name)
+        if observation is None:
+            self.observations[name] = [1, value, value]
+        else:
+            observation[0] += 1
+            observation[1] += value
+            if value > observation[2]:
+                observation[2] = value
+
+    def end_search(self, searcher, root_node, board):
+        """
+        Builds the report for the search just finished, sends it to the sink and resets for the next search. Returns the
+        report.
+        """
+        elapsed = time.perf_counter() - self.start
+        report = {
+            'search': self.searches,
+            'ply': len(board.undo_stack),
+            'turn': 'white' if board.turn == Board.WHITE else 'black',
+            'simulations': searcher.simulations,
+            'stop_reason': searcher.stop_reason,
+            'seconds': elapsed,
+            'simulations_per_second': searcher.simulations / elapsed if elapsed > 0 else 0.,
+            'timers': {name: {'seconds': seconds, 'calls': calls} for name, (seconds, calls) in self.timers.items()},
+            'counters': dict(self.counters),
+            'observations': {name: {'mean': total / count, 'max': maximum, 'count': count}
+                             for name, (count, total, maximum) in self.observations.items()},
+        }
+        if self.measure_memory:
+            report['tree'] = tree_memory(root_node)
+        self.searches += 1
+        self.last_report = report
+        if self.sink is not None:
+            self.sink(report)
+        self.reset()
+        return report
+
+class NullStats():
+    """
+    Stand-in for SearchStats when instrumentation is off: every hook does nothing.
+    """
+    def reset(self):
+        pass
+
+    def lap(self, name=None):
+        pass
+
+    def add_time(self, name, seconds):
+        pass
+
+    def count(self, name, n=1):
+        pass
+
+    def observe(self, name, value):
+        pass
+
+    def end_search(self, searcher, root_node, board):
+        return None
+
+NULL_STATS = NullStats()
+
+def tree_memory(root_node):
+    """
+    Walks the tree below root_node. Returns node and edge counts, maximum depth and bytes per node (nodes, edges, their
+    lists and priors arrays, as sys.getsizeof counts them).
+    """
+    nodes = edges = total_bytes = max_depth = 0
+    seen = set()
+    stack = [(root_node, 0)]
+    while stack:
+        node, depth = stack.pop()
+        if id(node) in seen:
+            continue
+        seen.add(id(node))
+        nodes += 1
+        max_depth = max(max_depth, depth)
+        total_bytes += sys.getsizeof(node) + sys.getsizeof(node.child_edges)
+        if node.moves is not None:
+            total_bytes += sys.getsizeof(node.moves) + node.priors.nbytes
+        for edge in node.child_edges:
+            edges += 1
+            total_bytes += sys.getsizeof(edge)
+            if edge.child_node is not None:
+                stack.append((edge.child_node, depth + 1))
+    return {'nodes': nodes, 'edges': edges, 'max_depth': max_depth, 'bytes': total_bytes,
+            'bytes_per_node': total_bytes / nodes}
+
+class JsonLinesWriter():
+    """
+    Sink writing each report as one JSON line to path (appending) or an open file.
+    """
+    def __init__(self, path_or_file):
+        if isinstance(path_or_file, str):
+            self.file = open(path_or_file, 'a')
+            self.owned = True
+        else:
+            self.file = path_or_file
+            self.owned = False
+
+    def __call__(self, report):
+        self.file.write(json.dumps(report) + '\n')
+        self.file.flush()
+
+    def close(self):
+        if self.owned:
+            self.file.close()
+
+@contextmanager
+def board_timers(stats, board, methods=BOARD_METHODS):
+    """
+    Times every call to the named methods of board into stats as 'board.<method>' timers while the block runs. The
+    methods are wrapped on the instance, so calls on other boards, eg. in other threads, aren't timed. Timers are
+    inclusive, so is_terminal also counts the generate_moves and is_surround calls it makes.
+    """
+    def timed(name, method):
+        timer_name = 'board.' + name
+
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                stats.add_time(timer_name, time.perf_counter() - start)
+        return wrapper
+
+    for name in methods:
+        setattr(board, name, timed(name, getattr(board, name)))
+    try:
+        yield stats
+    finally:
+        # the instance attributes shadowed the class methods, removing them restores the originals
+        for name in methods:
+            delattr(board, name)
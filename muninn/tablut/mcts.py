@@ -0,0 +1,567 @@
+import math
+import random
+import time
+from collections import OrderedDict
+import numpy as np
+from game import Board
+from encoder import Encoder
+from instrument import NULL_STATS
+
+def terminal_value(winner):
+    """
+    Returns reward for a finished game from White's perspective.
+    """
+    if winner == Board.WHITE:
+        return 1.0
+    if winner == Board.BLACK:
+        return -1.0
+    return 0.0
+
+def legal_priors(move_indices, policy):
+    """
+    Turns a network policy output into priors over the legal moves, given as policy indexes as generate_moves('index')
+    returns them. Returns (move indexes, priors) sorted by prior, highest first.
+    """
+    # policy head outputs logits, so priors are the softmax over the legal moves, gathered in one step
+    logits = np.asarray(policy, dtype=np.float32)[move_indices]
+    if not len(move_indices):
+        return move_indices, logits
+    priors = np.exp(logits - logits.max())
+    priors /= priors.sum()
+    order = np.argsort(-priors, kind='stable')
+    return move_indices[order], priors[order]
+
+class EvaluationCache():
+    """
+    Bounded LRU cache of network evaluations keyed by Zobrist hash. Stores the sorted legal moves (as policy indexes),
+    their priors and the value for each position. History planes aren't part of the key, so a position reached by
+    another move order reuses the first evaluation.
+    """
+    def __init__(self, max_size=100000):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def key(self, board):
+        """
+        Returns cache key for board's position.
+        """
+        return board.zobrist_hash
+
+    def get(self, key):
+        """
+        Returns (moves, priors, value) for key, or None. Counts hits and misses.
+        """
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry
+
+    def put(self, key, moves, priors, value):
+        """
+        Stores an evaluation, evicting the least recently used entries once over max_size.
+        """
+        self.entries[key] = (moves, priors, value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def stats(self):
+        """
+        Returns dictionary of size, hits, misses, evictions and hit rate.
+        """
+        lookups = self.hits + self.misses
+        return {'size': len(self.entries), 'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.}
+
+    def clear(self):
+        self.entries.clear()
+
+class Edge():
+    """
+    Object representing the 'connection' between nodes - ie action that moves from one state to another. move is the
+    action's policy index.
+    """
+    __slots__ = ('parent_node', 'move', 'N', 'W', 'Q', 'P', 'child_node')
+
+    def __init__(self, move, parent_node):
+        self.parent_node = parent_node
+        self.move = move
+        # Node reached by this edge, None until the edge is first selected when expansion is lazy. With transpositions
+        # several edges can lead to the same node
+        self.child_node = None
+        # How many times Node is visited
+        self.N = 0
+        # Total reward
+        self.W = 0
+        # Total reward / number of Node visits
+        self.Q = 0
+        # Initial probability provided by network during expansion
+        self.P = 0
+
+class Node():
+    """
+    Represents gamestate. Has parent edge and child edge(s), each edge leading to a child node. Nodes don't hold a board:
+    the searcher walks a single Board down the tree with apply_move and back up with undo_move.
+    """
+    __slots__ = ('parent_edge', 'turn', 'child_edges', 'moves', 'priors', 'next_child')
+
+    def __init__(self, parent_edge, turn):
+        self.parent_edge = parent_edge
+        self.turn = turn
+        # edges that have been created, in creation order
+        self.child_edges = []
+        # legal moves as an array of policy indexes and their priors, sorted by prior (highest first), None until expanded
+        self.moves = None
+        self.priors = None
+        # moves[next_child:] have no edge yet. They are unvisited, so the next one has the best PUCT score among them
+        self.next_child = 0
+
+    @property
+    def child_edge_node(self):
+        """
+        List of (edge, child node) pairs for the edges created so far.
+        """
+        return [(edge, edge.child_node) for edge in self.child_edges]
+
+    def set_children(self, moves, priors, lazy=True):
+        """
+        Stores legal moves and priors (sorted by prior, highest first). Creates every child edge and node unless lazy.
+        Returns number of nodes created.
+        """
+        self.moves = moves
+        self.priors = priors
+        if lazy:
+            return 0
+        created = len(self.moves) - self.next_child
+        while self.next_child < len(self.moves):
+            edge = self.add_child()
+            edge.child_node = Node(edge, Board.BLACK if self.turn == Board.WHITE else Board.WHITE)
+        return created
+
+    def add_child(self):
+        """
+        Creates the edge for the highest prior move without one. Returns the edge, its node is created by the searcher.
+        """
+        edge = Edge(int(self.moves[self.next_child]), self)
+        edge.P = float(self.priors[self.next_child])
+        self.child_edges.append(edge)
+        self.next_child += 1
+        return edge
+
+    def is_leaf(self):
+        """
+        Checks to see whether Node has been expanded.
+        """
+        return self.moves is None
+
+class MCTS():
+    """
+    MCT Searcher
+    """
+    def __init__(self, network, iterations=100, lazy_expansion=True, batch_size=1, virtual_loss=1, cache=None,
+                 transpositions=False, time_limit=None, early_stop=True, stats=None, solver=None,
+                 book=None):
+        self.network = network
+        # optional gamedb.OpeningBook. In its first plies the search plays book moves without a network call, or mixes
+        # the book frequencies into the root priors
+        self.book = book
+        self.book_root = None
+        # optional solver.Solver proving short King escapes and captures. Proven leaves back up exact values without a
+        # network call and are never expanded, and proven wins at the root are played without searching
+        self.solver = solver
+        # optional instrument.SearchStats collecting phase timers and counters. Without one the hooks go to NULL_STATS
+        self.stats = stats if stats is not None else NULL_STATS
+        self.root_node = None
+        # optional EvaluationCache shared across searches, checked before any network call
+        self.cache = cache
+        # when set, positions reached by different move orders share one node (and so its statistics) within a search.
+        # Children are then always created lazily so every new node goes through the table
+        self.transpositions = {} if transpositions else None
+        self.transposition_hits = 0
+        # search budget: at most iterations select / expand / backpropagate simulations and at most time_limit seconds
+        # per search, either can be None for no limit
+        self.iterations = iterations
+        self.time_limit = time_limit
+        # stop once the most visited root move can't be overtaken within the remaining budget
+        self.early_stop = early_stop
+        # simulations run by the last search and why it stopped: 'forced', 'book', 'decided', 'time', 'iterations' or
+        # 'stopped'
+        self.simulations = 0
+        self.stop_reason = None
+        # set from another thread to end the running search after its current batch. The caller clears it again
+        self.stop_requested = False
+        # when lazy, child nodes are only created once their edge is first selected
+        self.lazy_expansion = lazy_expansion
+        # leaves selected under virtual loss and sent to the network together in one predict call. virtual_loss is the
+        # number of lost visits added to every edge on a pending leaf's path
+        self.batch_size = batch_size
+        self.virtual_loss = virtual_loss
+        # preallocated network inputs for a batch of leaves
+        self.encoder = Encoder(batch_size)
+        # controls the balance between exploration and exploitation
+        self.tau = 1.0
+        self.c_puct = 1.0
+
+    def uct_value(self, edge, parent_N):
+        """
+        Computes and returns UCT value for an edge
+        """
+        return self.c_puct * edge.P * (math.sqrt(parent_N) / (1+edge.N))
+
+    def select(self, node, board):
+        """
+        Walks down from node to a leaf by best UCT score, applying each chosen move to board. Returns the leaf node and
+        the path of edges taken, starting with node's parent edge.
+        """
+        path = [node.parent_edge]
+        while not node.is_leaf():
+            if self.transpositions is None:
+                parent_N = node.parent_edge.N
+            else:
+                # a shared node's parent edge only counts visits through one of its parents
+                parent_N = 1 + sum(edge.N for edge in node.child_edges)
+            max_uct_value = -10000000.
+            # to store best children in case mutliple have same uct score. None stands for the next edge not yet created.
+            all_best_edges = []
+            for edge in node.child_edges:
+                val = -edge.Q if node.turn == Board.BLACK else edge.Q
+                uct_val_child = val + self.uct_value(edge, parent_N)
+                if uct_val_child > max_uct_value:
+                    max_uct_value = uct_val_child
+                    all_best_edges = [edge]
+                elif uct_val_child == max_uct_value:
+                    all_best_edges.append(edge)
+            if node.next_child < len(node.moves):
+                uct_val_child = self.c_puct * node.priors[node.next_child] * math.sqrt(parent_N)
+                if uct_val_child > max_uct_value:
+                    max_uct_value = uct_val_child
+                    all_best_edges = [None]
+                elif uct_val_child == max_uct_value:
+                    all_best_edges.append(None)
+            # if no child found
+            if not all_best_edges:
+                raise ValueError('unable to identify child with best uct value')
+            # randomly selects one of best child if there are tied scores, otherwise returns top scoring child
+            edge = random.choice(all_best_edges)
+            if edge is None:
+                edge = node.add_child()
+                self.stats.count('edges_created')
+            board.apply_move_index(edge.move)
+            if edge.child_node is None:
+                edge.child_node = self.new_node(edge, board)
+            node = edge.child_node
+            path.append(edge)
+        return node, path
+
+    def new_node(self, edge, board):
+        """
+        Returns node for the position board has just reached through edge. With transpositions an existing node for the
+        same position is reused. Repetition count is part of the key so repeated positions can't form a cycle.
+        """
+        turn = Board.BLACK if edge.parent_node.turn == Board.WHITE else Board.WHITE
+        if self.transpositions is not None:
+            node = self.transpositions.get((board.zobrist_hash, board.repetition_counter))
+            if node is not None:
+                self.transposition_hits += 1
+                self.stats.count('transposition_hits')
+                return node
+        self.stats.count('nodes_created')
+        node = Node(edge, turn)
+        if self.transpositions is not None:
+            self.transpositions[(board.zobrist_hash, board.repetition_counter)] = node
+        return node
+
+    def evaluate(self, board):
+        """
+        Returns (move indexes, priors, value) for board's position, from the cache if possible, otherwise from the
+        network.
+        """
+        if self.cache is not None:
+            entry = self.cache.get(self.cache.key(board))
+            if entry is not None:
+                self.stats.count('cache_hits')
+                return entry
+        self.stats.count('network_calls')
+        self.stats.observe('batch_size', 1)
+        q = self.network.predict(self.encoder.encode([board]), verbose=0)
+        moves, priors = legal_priors(board.generate_moves('index'), q[0][0])
+        v = q[1][0][0]
+        if self.cache is not None:
+            self.cache.put(self.cache.key(board), moves, priors, v)
+        return moves, priors, v
+
+    def expand_and_evaluate(self, node, path, board):
+        """
+        Combined expansion and evaluation for leaf nodes. If node is terminal, passes the reward back up the tree to the root node.
+        """
+        # if terminal, returns value and backpropagates
+        terminal, winner = board.is_terminal()
+        if terminal == True:
+            self.backpropagate(terminal_value(winner), path)
+            return
+        # otherwise, expands node, receiving eval value for the node as predicted by model, propagates this back up the tree
+        moves, priors, v = self.evaluate(board)
+        node.set_children(moves, priors, self.lazy_expansion or self.transpositions is not None)
+        self.backpropagate(v, path)
+
+    def backpropagate(self, v, path):
+        """
+        Adds a visit and reward v to every edge on path.
+        """
+        for edge in path:
+            # add one visit count
+            edge.N += 1
+            # update reward
+            edge.W = edge.W + v
+            # update reward / visits
+            edge.Q = edge.W / edge.N
+
+    def add_virtual_loss(self, path, loss):
+        """
+        Adds loss visits to every edge on path that count as losses for the player choosing the edge, so that selections
+        made before the batch is evaluated spread out. Negative loss removes it again.
+        """
+        for edge in path:
+            edge.N += loss
+            # Q is from White's perspective, so a loss for the side choosing the edge moves W against that side
+            if edge.parent_node is not None:
+                edge.W += -loss if edge.parent_node.turn == Board.WHITE else loss
+                edge.Q = edge.W / edge.N if edge.N else 0
+
+    def count_expansion(self, created):
+        """
+        Counts a node expansion that created created child nodes (none when lazy: they come with their edges).
+        """
+        self.stats.count('nodes_expanded')
+        if created:
+            self.stats.count('nodes_created', created)
+            self.stats.count('edges_created', created)
+
+    def run_batch(self, root_node, board, batch_size):
+        """
+        Selects up to batch_size leaves under virtual loss, evaluates them with one network call, then expands and
+        backpropagates them together. Terminal leaves, leaves the solver proves and cache hits are backpropagated straight
+        away. Stops selecting early if a leaf already waiting for evaluation is selected again. Returns number of
+        simulations run.
+        """
+        root_depth = len(board.undo_stack)
+        lazy = self.lazy_expansion or self.transpositions is not None
+        stats = self.stats
+        pending = []
+        # each pending leaf's position history and side to move, encoded together once selection is done
+        histories = []
+        turns = []
+        simulations = 0
+        stats.lap()
+        for i in range(0, batch_size):
+            leaf, path = self.select(root_node, board)
+            stats.lap('select')
+            stats.observe('depth', len(path) - 1)
+            terminal, winner = board.is_terminal()
+            if not terminal and self.solver is not None:
+                solved = self.solver.solve(board)
+                if solved is not None:
+                    terminal, winner = True, solved[0]
+                    stats.count('solved_leaves')
+            stats.lap('terminal')
+            collision = False
+            cache_key = self.cache.key(board) if self.cache is not None and not terminal else None
+            if terminal:
+                self.backpropagate(terminal_value(winner), path)
+                simulations += 1
+                stats.count('terminal_leaves')
+            elif any(leaf is pending_leaf for pending_leaf, _, _, _ in pending):
+                collision = True
+                stats.count('collisions')
+            elif cache_key is not None and (entry := self.cache.get(cache_key)) is not None:
+                moves, priors, v = entry
+                self.count_expansion(leaf.set_children(moves, priors, lazy))
+                self.backpropagate(v, path)
+                simulations += 1
+                stats.count('cache_hits')
+            else:
+                self.add_virtual_loss(path, self.virtual_loss)
+                pending.append((leaf, path, board.generate_moves('index'), cache_key))
+                histories.append(board.history(self.encoder.history_length))
+                turns.append(board.turn)
+            # walk the board back up to the root
+            while len(board.undo_stack) > root_depth:
+                board.undo_move()
+            stats.lap('leaf')
+            if collision:
+                break
+        if pending:
+            x = self.encoder.encode_histories(histories, turns)
+            stats.lap('encode')
+            q = self.network.predict(x, verbose=0)
+            stats.lap('network')
+            stats.count('network_calls')
+            stats.observe('batch_size', len(pending))
+            for i, (leaf, path, moves, cache_key) in enumerate(pending):
+                self.add_virtual_loss(path, -self.virtual_loss)
+                moves, priors = legal_priors(moves, q[0][i])
+                v = q[1][i][0]
+                if self.cache is not None:
+                    self.cache.put(cache_key, moves, priors, v)
+                self.count_expansion(leaf.set_children(moves, priors, lazy))
+                self.backpropagate(v, path)
+            simulations += len(pending)
+            stats.lap('expand')
+        return simulations
+
+    def forced_move(self, board):
+        """
+        Returns (move, value) for a move to play without searching: a King escape or a win proven by the solver, or the
+        only legal move. None otherwise.
+        """
+        winning_move = board.is_winning_move()
+        if winning_move is not None:
+            return winning_move, terminal_value(Board.WHITE)
+        if self.solver is not None:
+            solved = self.solver.solve(board)
+            if solved is not None and solved[0] == board.turn:
+                return solved[1], terminal_value(solved[0])
+        moves = board.generate_moves()
+        if len(moves) == 1:
+            return moves[0], 0
+        return None
+
+    def bias_root(self, root_node, frequencies):
+        """
+        Mixes the opening book frequencies into the root priors. Edges already created keep their place, the moves
+        without one are sorted again by their new priors.
+        """
+        for edge in root_node.child_edges:
+            edge.P = float(self.book.bias(edge.P, [Board.INDEX_TO_MOVE[edge.move]], frequencies)[0])
+        created = root_node.next_child
+        moves = root_node.moves[created:]
+        priors = self.book.bias(root_node.priors[created:], [Board.INDEX_TO_MOVE[index] for index in moves], frequencies)
+        order = np.argsort(-priors, kind='stable')
+        root_node.moves = np.concatenate((root_node.moves[:created], moves[order]))
+        root_node.priors = np.concatenate(([edge.P for edge in root_node.child_edges], priors[order]))
+
+    def is_decided(self, root_node, remaining):
+        """
+        Checks whether no other root move can catch up with the most visited one in remaining more simulations.
+        """
+        best = second = 0
+        for edge in root_node.child_edges:
+            if edge.N > best:
+                best, second = edge.N, best
+            elif edge.N > second:
+                second = edge.N
+        return best - second > remaining
+
+    def search(self, root_node, board, iterations=None, time_limit=None):
+        """
+        Runs the search from root_node, which must correspond to board's current position. The board is returned to that
+        position once search completes. iterations and time_limit override the searcher's budget for this search.
+        Forced moves are returned without searching, with probability 1 and no visits.
+        """
+        iterations = self.iterations if iterations is None else iterations
+        time_limit = self.time_limit if time_limit is None else time_limit
+        if iterations is None and time_limit is None:
+            raise ValueError('search needs an iteration or time limit')
+        start = time.perf_counter()
+        self.stats.reset()
+        self.root_node = root_node
+        self.simulations = 0
+        forced = self.forced_move(board)
+        if forced is not None:
+            self.stop_reason = 'forced'
+            self.stats.end_search(self, root_node, board)
+            forced_move, value = forced
+            return [(move, 1.0, 0, value) if move == forced_move else (move, 0.0, 0, 0) for move in board.generate_moves()]
+        frequencies = self.book.lookup(board) if self.book is not None else None
+        if frequencies is not None and self.book.mode == 'play':
+            self.stop_reason = 'book'
+            self.stats.end_search(self, root_node, board)
+            return [(move, frequencies.get(move, 0.), 0, 0) for move in board.generate_moves()]
+        if self.transpositions is not None:
+            self.transpositions.clear()
+        if root_node.is_leaf():
+            moves, priors, _ = self.evaluate(board)
+            created = root_node.set_children(moves, priors, self.lazy_expansion or self.transpositions is not None)
+            self.count_expansion(created)
+            self.stats.lap('root')
+        if frequencies is not None and root_node is not self.book_root:
+            self.bias_root(root_node, frequencies)
+            self.book_root = root_node
+        simulations = 0
+        self.stop_reason = 'iterations'
+        while iterations is None or simulations < iterations:
+            batch_size = self.batch_size if iterations is None else min(self.batch_size, iterations - simulations)
+            # selects most promising leaves based on examining their potential moves using model
+            simulations += self.run_batch(root_node, board, batch_size)
+            if self.stop_requested:
+                self.stop_reason = 'stopped'
+                break
+            elapsed = time.perf_counter() - start
+            if time_limit is not None and elapsed >= time_limit:
+                self.stop_reason = 'time'
+                break
+            if self.early_stop:
+                # simulations still to come, estimating from the rate so far when time runs out first
+                remaining = math.inf if iterations is None else iterations - simulations
+                if time_limit is not None:
+                    remaining = min(remaining, (time_limit - elapsed) * simulations / elapsed)
+                if self.is_decided(root_node, remaining):
+                    self.stop_reason = 'decided'
+                    break
+        self.simulations = simulations
+        self.stats.end_search(self, root_node, board)
+        N_sum = 0
+        move_probs = []
+        for edge in root_node.child_edges:
+            N_sum += edge.N
+        for edge in root_node.child_edges:
+            prob = (edge.N ** (1 / self.tau)) / ((N_sum) ** (1/self.tau))
+            move_probs.append((Board.INDEX_TO_MOVE[edge.move], prob, edge.N, edge.Q))
+        # moves that never got an edge were never visited
+        for index in root_node.moves[root_node.next_child:]:
+            move_probs.append((Board.INDEX_TO_MOVE[index], 0.0, 0, 0))
+        return move_probs
+
+    def new_root(self, board):
+        """
+        Starts a fresh tree at board's position. Returns the root node, whose parent edge starts with one visit.
+        """
+        root_edge = Edge(None, None)
+        root_edge.N = 1
+        self.root_node = Node(root_edge, board.turn)
+        return self.root_node
+
+    def advance(self, move, board):
+        """
+        Reuses the tree after move is played: the child reached by move becomes the root, keeping its visits, priors and
+        subtree, and its siblings are dropped so they can be freed. board must already have move applied. Returns the new
+        root node, a fresh one if move was never searched or its node was never expanded.
+        """
+        old_root = self.root_node
+        index = Board.MOVE_TO_INDEX[move]
+        child = None
+        if old_root is not None:
+            for edge in old_root.child_edges:
+                if edge.move == index:
+                    child = edge.child_node
+                    break
+            # drop the old root's edges so the sibling subtrees are no longer referenced
+            old_root.child_edges = []
+        if child is None or child.is_leaf() or child.turn != board.turn:
+            return self.new_root(board)
+        # detach the child behind a new root edge holding the same statistics
+        root_edge = Edge(None, None)
+        root_edge.N = max(edge.N, 1)
+        root_edge.W = edge.W
+        root_edge.Q = edge.Q
+        root_edge.child_node = child
+        child.parent_edge = root_edge
+        self.root_node = child
+        return child
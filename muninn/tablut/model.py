@@ -0,0 +1,177 @@
+"""
+SE-ResNet policy/value network from tablut_rl.ipynb, with the custom layers and loss needed to build, compile and load
+saved models.
+"""
+import tensorflow as tf
+import keras
+from tensorflow.keras.layers import Conv2D, Layer, ReLU, Add, Dense, Flatten, Input, GlobalAveragePooling2D, Multiply, Reshape, Activation, BatchNormalization
+from tensorflow.keras.models import Model
+
+from game import build_mapping_indices
+from encoder import INPUT_SHAPE
+
+@keras.saving.register_keras_serializable(package="SELayer")
+class SqueezeExcitation(Layer):
+    def __init__(self, filters, se_ratio, **kwargs):
+        super().__init__(**kwargs)
+        self.filters = filters
+        self.se_ratio = se_ratio
+        self.dense1 = Dense(filters // se_ratio, activation='relu')
+        self.dense2 = Dense(2 * filters)
+        self.reshape = Reshape([1, 1, filters * 2])
+
+    def build(self, input_shape):
+        super(SqueezeExcitation, self).build(input_shape)
+
+    def call(self, input_x):
+        squeeze = GlobalAveragePooling2D()(input_x)
+
+        excitation = self.dense1(squeeze)
+        excitation = self.dense2(excitation)
+        excitation = self.reshape(excitation)
+        scale, bias = tf.split(excitation, num_or_size_splits=2, axis=-1)
+        scale = Activation('sigmoid')(scale)
+        output = Multiply()([input_x, scale])
+        output = Add()([output, bias])
+        return output
+
+    def get_config(self):
+        config = super().get_config()
+        config.update({
+            "filters": self.filters,
+            "se_ratio": self.se_ratio
+        })
+        return config
+
+    @classmethod
+    def from_config(cls, config):
+        filters = config.pop("filters")
+        se_ratio = config.pop("se_ratio")
+        return cls(filters, se_ratio, **config)
+
+@keras.saving.register_keras_serializable(package="PolicyMap")
+class PolicyMap(tf.keras.layers.Layer):
+    def __init__(self, mapping_indices, **kwargs):
+        super().__init__(**kwargs)
+        self.mapping_indices = tf.constant(mapping_indices, dtype=tf.int32)
+
+    def call(self, inputs):
+        batch_size = tf.shape(inputs)[0]
+        indices = tf.tile(tf.expand_dims(self.mapping_indices, 0), [batch_size, 1])
+        return tf.gather(inputs, indices, batch_dims=1)
+
+    def get_config(self):
+        config = super(PolicyMap, self).get_config()
+        config.update({'mapping_indices': self.mapping_indices.numpy().tolist()})
+        return config
+
+    @classmethod
+    def from_config(cls, config):
+        mapping_indices = config.pop('mapping_indices')
+        return cls(mapping_indices, **config)
+
+def residual_block(x, filters, se_ratio):
+    shortcut = x
+    x = Conv2D(filters, kernel_size=3, padding='same', use_bias=False)(x)
+    x = BatchNormalization()(x)
+    x = ReLU()(x)
+    x = Conv2D(filters, kernel_size=3, padding='same', use_bias=False)(x)
+    x = BatchNormalization()(x)
+    x = SqueezeExcitation(filters, se_ratio)(x)
+    x = Add()([x, shortcut])
+    x = ReLU()(x)
+    return x
+
+def policy_branch(x, filters, policy_conv_size):
+    # one conv2d, batch normalization, relu sequence
+    policy = Conv2D(filters, kernel_size=3, padding='same', use_bias=True)(x)
+    policy = BatchNormalization()(policy)
+    policy = ReLU()(policy)
+    # one convolution down to map size + padding
+    policy = Conv2D(policy_conv_size, kernel_size=3, padding='same', use_bias = True)(policy)
+    # flatten and map
+    policy = Flatten()(policy)
+
+    return policy
+
+def value_branch(x, value_conv_size):
+    # one conv2D down in size, batch normalization, relu sequence
+    value = Conv2D(value_conv_size, kernel_size=1, padding='same', use_bias=False)(x)
+    value = BatchNormalization()(value)
+    value = ReLU()(value)
+    # flatten and fully connected layer with relu
+    value = Flatten()(value)
+    value = Dense(128, activation='relu')(value)
+
+    return value
+
+def create_model(input_shape=INPUT_SHAPE, mapping_indices=None, filters=64, num_residual_blocks=10, se_ratio=4, policy_conv_size=36, value_conv_size=32):
+    if mapping_indices is None:
+        mapping_indices = build_mapping_indices()
+    inp = Input(shape=input_shape)
+
+    # Initial Input Convolutional Layer
+    x = Conv2D(filters, kernel_size=3, padding='same', use_bias=True)(inp)
+    x = BatchNormalization()(x)
+    x = ReLU()(x)
+
+    # Residual Blocks
+    for _ in range(num_residual_blocks):
+        x = residual_block(x, filters, se_ratio)
+
+    # Policy head
+    policy = policy_branch(x, filters, policy_conv_size)
+    policy_output = PolicyMap(mapping_indices, name='policy_head', trainable=False)(policy)
+
+    # Value head
+    value = value_branch(x, value_conv_size)
+    value_output = Dense(1, activation='tanh', name='value_head')(value)
+
+    model = Model(inp, [policy_output, value_output])
+    return model
+
+@keras.saving.register_keras_serializable()
+def policy_loss(target, output):
+    """
+    Cross-entropy over legal moves. Target entries of -1 mark illegal moves, whose logits are masked out before softmax.
+    """
+    def mask_policy(target, output):
+        output = tf.cast(output, tf.float32)
+
+        # mask illegal moves
+        move_is_legal = tf.greater_equal(target, 0)
+
+        # Replace logits of illegal moves with a large negative value
+        illegal_filler = tf.zeros_like(output) - 1.0e5
+        output = tf.where(move_is_legal, output, illegal_filler)
+
+        # turn all -1 values in target to 0
+        target = tf.nn.relu(target)
+
+        return target, output
+
+    target, output = mask_policy(target, output)
+
+    # Compute cross-entropy loss
+    policy_cross_entropy = tf.nn.softmax_cross_entropy_with_logits(
+        labels=tf.stop_gradient(target), logits=output
+    )
+
+    # Return the mean cross-entropy loss across batch
+    return tf.reduce_mean(policy_cross_entropy)
+
+def compile_model(model, learning_rate=0.2, jit_compile=False, steps_per_execution=1):
+    """
+    Compiles model with SGD with Nesterov momentum, MSE on the value head and the masked policy loss. learning_rate can
+    be a schedule. jit_compile compiles the training step, network and losses together, with XLA.
+    """
+    sgd_nesterov = tf.keras.optimizers.SGD(learning_rate=learning_rate, nesterov=True)
+    model.compile(optimizer = sgd_nesterov, loss={'value_head' : 'mean_squared_error', 'policy_head' : policy_loss},
+                  jit_compile=jit_compile, steps_per_execution=steps_per_execution)
+    return model
+
+def load_model(path):
+    """
+    Loads a saved model with the custom layers and loss registered.
+    """
+    return keras.models.load_model(path, custom_objects={'loss': policy_loss, 'policy_loss': policy_loss})
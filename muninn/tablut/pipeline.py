@@ -0,0 +1,286 @@
+"""
+Asynchronous self-play and training. Worker processes play self-play games continuously and send them to the trainer,
+which adds them to the replay buffer and keeps training on it instead of waiting for a round of games. Every
+steps_per_checkpoint steps the trainer publishes a numbered checkpoint, and workers load the newest one between games,
+so generation and training overlap and neither sits idle. Run from this directory:
+
+    python pipeline.py [--workers N] [--backend numpy] [--checkpoints N]
+
+Checkpoints are written as checkpoint_NNNNNN.keras for training and evaluation plus an export_weights .npz, so workers
+using the numpy backend never import TensorFlow. latest.json names the newest checkpoint and is replaced atomically
+once both files are written, so a worker never loads a partial checkpoint.
+"""
+import argparse
+import json
+import multiprocessing as mp
+import os
+import queue
+import time
+
+import numpy as np
+
+from inference import DEFAULT_MODEL_PATH, NumpyNetwork, load_network
+from replay import ReplayBuffer
+from rl_train import ReinfLearn
+
+LATEST_FILE = 'latest.json'
+
+class CheckpointStore():
+    """
+    Numbered checkpoints in directory. publish writes the next one and then points latest.json at it.
+    """
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, number, extension='.keras'):
+        return os.path.join(self.directory, f'checkpoint_{number:06d}{extension}')
+
+    def latest(self):
+        """
+        Returns the number of the newest checkpoint, or None before the first is published.
+        """
+        try:
+            with open(os.path.join(self.directory, LATEST_FILE)) as f:
+                return json.load(f)['number']
+        except FileNotFoundError:
+            return None
+
+    def numbers(self):
+        """
+        Returns the numbers of every published checkpoint, oldest first.
+        """
+        latest = self.latest()
+        if latest is None:
+            return []
+        return [number for number in range(latest + 1) if os.path.exists(self.path(number))]
+
+    def publish(self, model, info=None):
+        """
+        Saves model as the next checkpoint, with its NumPy weights, and makes it the latest. Returns its number.
+        """
+        from inference import export_weights
+        latest = self.latest()
+        number = 0 if latest is None else latest + 1
+        model.save(self.path(number))
+        export_weights(model, self.path(number, '.npz'))
+        self.set_latest(number, info)
+        return number
+
+    def set_latest(self, number, info=None):
+        """
+        Points latest.json at checkpoint number, whose files must already be written.
+        """
+        entry = {'number': number, 'time': time.time(), **(info or {})}
+        tmp_path = os.path.join(self.directory, LATEST_FILE + '.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(entry, f)
+        os.replace(tmp_path, os.path.join(self.directory, LATEST_FILE))
+
+    def load_network(self, number, backend='numpy'):
+        """
+        Returns checkpoint number as a network with a predict method, for inference.BACKENDS backend.
+        """
+        if backend == 'numpy':
+            return NumpyNetwork(self.path(number, '.npz'))
+        return load_network(backend, model_path=self.path(number))
+
+def worker_loop(worker_id, checkpoint_dir, game_queue, stop_event, backend, learner_kwargs, seed, poll_interval=1.0):
+    """
+    Runs in a worker process. Plays games until stop_event is set, checking for a newer checkpoint before each game, and
+    puts (worker_id, checkpoint number, game) on game_queue, waiting while the queue is full.
+    """
+    np.random.seed(seed)
+    checkpoints = CheckpointStore(checkpoint_dir)
+    learner = ReinfLearn(None, **learner_kwargs)
+    loaded = None
+    while not stop_event.is_set():
+        latest = checkpoints.latest()
+        if latest is None:
+            stop_event.wait(poll_interval)
+            continue
+        if latest != loaded:
+            # ReinfLearn builds a searcher per game, so the new network takes over from the next game on
+            learner.model = checkpoints.load_network(latest, backend)
+            loaded = latest
+            if learner.cache is not None:
+                learner.cache.clear()
+        game = learner.play_game()
+        while not stop_event.is_set():
+            try:
+                game_queue.put((worker_id, loaded, game), timeout=poll_interval)
+                break
+            except queue.Full:
+                pass
+
+def receive_games(game_queue, timeout=None):
+    """
+    Returns every game waiting on game_queue, first waiting up to timeout seconds for one if timeout is given.
+    """
+    games = []
+    try:
+        games.append(game_queue.get(timeout=timeout) if timeout else game_queue.get_nowait())
+        while True:
+            games.append(game_queue.get_nowait())
+    except queue.Empty:
+        pass
+    return games
+
+class Trainer():
+    """
+    Trains model on replay_buffer in rounds of steps_per_round steps, so games arriving meanwhile join the buffer
+    between rounds. Training starts once min_positions positions are in the buffer, and is held back so no position is
+    sampled more than max_sample_reuse times on average, which stops the trainer overfitting when workers fall behind.
+    New positions are written out as a shard once flush_positions are waiting.
+    """
+    def __init__(self, model, replay_buffer, batch_size=256, steps_per_round=50, min_positions=4096,
+                 max_sample_reuse=4., flush_positions=1024):
+        from symmetry import augment
+        self.model = model
+        self.replay_buffer = replay_buffer
+        self.batch_size = batch_size
+        self.steps_per_round = steps_per_round
+        self.min_positions = min_positions
+        self.max_sample_reuse = max_sample_reuse
+        self.flush_positions = flush_positions
+        # positions already in the buffer when resuming count towards the sample reuse limit
+        self.positions_added = len(replay_buffer)
+        self.steps = 0
+        self.train_seconds = 0.
+        # one endless stream of augmented batches, rereading the window at each pass so new shards are picked up
+        self.batches = augment(replay_buffer.batches(batch_size, repeat=True))
+
+    def add_game(self, game):
+        self.replay_buffer.add_game(*game)
+        self.positions_added += len(game[0])
+
+    def available_steps(self):
+        """
+        Returns how many steps the trainer may take now under min_positions and max_sample_reuse.
+        """
+        if self.positions_added < self.min_positions:
+            return 0
+        allowed = int(self.max_sample_reuse * self.positions_added / self.batch_size) - self.steps
+        return max(0, min(self.steps_per_round, allowed))
+
+    def train(self, steps):
+        # positions are only readable once written to a shard
+        if self.steps == 0 or len(self.replay_buffer.pending) >= self.flush_positions:
+            self.replay_buffer.flush()
+        start = time.perf_counter()
+        self.model.fit(self.batches, steps_per_epoch=steps, epochs=1, verbose=0)
+        self.train_seconds += time.perf_counter() - start
+        self.steps += steps
+
+class Pipeline():
+    """
+    Runs num_workers self-play processes against a trainer in this process. Training resumes from the newest checkpoint
+    in checkpoint_dir, or starts from initial_model. Workers run backend (see inference.BACKENDS); learner_kwargs go to
+    each worker's ReinfLearn.
+    """
+    def __init__(self, checkpoint_dir='../checkpoints', buffer_dir='../replay_buffer', initial_model=DEFAULT_MODEL_PATH,
+                 num_workers=None, backend='numpy', learner_kwargs=None, steps_per_checkpoint=500, window_games=500,
+                 max_queued_games=None, trainer_kwargs=None):
+        self.checkpoints = CheckpointStore(checkpoint_dir)
+        self.buffer_dir = buffer_dir
+        self.initial_model = initial_model
+        # one core is left for the trainer
+        self.num_workers = num_workers or max(1, (os.cpu_count() or 2) - 1)
+        self.backend = backend
+        self.learner_kwargs = learner_kwargs or {}
+        self.steps_per_checkpoint = steps_per_checkpoint
+        self.window_games = window_games
+        self.max_queued_games = max_queued_games or 4 * self.num_workers
+        self.trainer_kwargs = trainer_kwargs or {}
+        self.log = []
+
+    def load_model(self):
+        from model import load_model
+        latest = self.checkpoints.latest()
+        return load_model(self.initial_model if latest is None else self.checkpoints.path(latest))
+
+    def run(self, max_checkpoints=None, max_seconds=None, seed=0):
+        """
+        Trains until max_checkpoints more checkpoints are published or max_seconds have passed (forever if neither is
+        given). Returns the log, one entry per published checkpoint.
+        """
+        # spawned workers start without the trainer's TensorFlow state
+        ctx = mp.get_context('spawn')
+        game_queue = ctx.Queue(maxsize=self.max_queued_games)
+        stop_event = ctx.Event()
+        workers = [ctx.Process(target=worker_loop, args=(worker_id, self.checkpoints.directory, game_queue, stop_event,
+                                                         self.backend, self.learner_kwargs, seed + worker_id))
+                   for worker_id in range(self.num_workers)]
+        for worker in workers:
+            worker.start()
+
+        trainer = None
+        try:
+            model = self.load_model()
+            if self.checkpoints.latest() is None:
+                self.checkpoints.publish(model, {'steps': 0})
+            trainer = Trainer(model, ReplayBuffer(self.buffer_dir, window_games=self.window_games),
+                              **self.trainer_kwargs)
+            start = last_checkpoint_time = time.perf_counter()
+            published = 0
+            games = positions = staleness = 0
+            next_checkpoint = self.steps_per_checkpoint
+            while max_checkpoints is None or published < max_checkpoints:
+                if max_seconds is not None and time.perf_counter() - start > max_seconds:
+                    break
+                steps = trainer.available_steps()
+                # with nothing to train on, wait for the next game instead of spinning
+                received = receive_games(game_queue, timeout=None if steps else 1.0)
+                latest = self.checkpoints.latest()
+                for _, checkpoint, game in received:
+                    trainer.add_game(game)
+                    games += 1
+                    positions += len(game[0])
+                    staleness += latest - checkpoint
+                if received:
+                    steps = trainer.available_steps()
+                if not steps:
+                    continue
+                trainer.train(min(steps, next_checkpoint - trainer.steps))
+                if trainer.steps >= next_checkpoint:
+                    next_checkpoint += self.steps_per_checkpoint
+                    number = self.checkpoints.publish(model, {'steps': trainer.steps})
+                    published += 1
+                    now = time.perf_counter()
+                    entry = {'checkpoint': number, 'steps': trainer.steps, 'games': games, 'positions': positions,
+                             'games_per_hour': 3600 * games / (now - last_checkpoint_time),
+                             'samples_per_second': trainer.batch_size * trainer.steps / trainer.train_seconds,
+                             'average_staleness': staleness / games if games else 0.,
+                             'buffer_positions': len(trainer.replay_buffer)}
+                    self.log.append(entry)
+                    print(f"checkpoint {number}: {entry['steps']} steps, {games} games "
+                          f"({entry['games_per_hour']:,.0f}/hour) from checkpoints {entry['average_staleness']:.1f} "
+                          f"behind, {entry['samples_per_second']:,.0f} samples/s trained")
+                    games = positions = staleness = 0
+                    last_checkpoint_time = now
+        finally:
+            stop_event.set()
+            # keep draining so no worker stays blocked on a full queue
+            deadline = time.perf_counter() + 60
+            while any(worker.is_alive() for worker in workers) and time.perf_counter() < deadline:
+                for _, _, game in receive_games(game_queue, timeout=0.5):
+                    if trainer is not None:
+                        trainer.add_game(game)
+            for worker in workers:
+                if worker.is_alive():
+                    worker.terminate()
+                worker.join()
+            if trainer is not None:
+                trainer.replay_buffer.flush()
+        return self.log
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Asynchronous self-play and training')
+    parser.add_argument('--workers', type=int, help='self-play processes (default: cores - 1)')
+    parser.add_argument('--backend', default='numpy', help='network backend for self-play workers')
+    parser.add_argument('--checkpoints', type=int, help='stop after publishing this many checkpoints')
+    parser.add_argument('--hours', type=float, help='stop after this many hours')
+    args = parser.parse_args()
+
+    pipeline = Pipeline(num_workers=args.workers, backend=args.backend, learner_kwargs={'batch_size': 8})
+    pipeline.run(args.checkpoints, args.hours * 3600 if args.hours else None)
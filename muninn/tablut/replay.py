@@ -0,0 +1,215 @@
+"""
+On-disk replay buffer for self-play training data. Positions are stored in fixed-size shards of .npy files that are
+memory-mapped when read:
+
+    planes          (S, 486) uint8    48 history planes bit-packed with np.packbits, channels last
+    values          (S,) float32
+    games           (S,) int32        game number, for the sliding window
+    policy_offsets  (S + 1,) int64    each position's entries in policy_index / policy_prob
+    policy_index    (E,) int16        legal moves as policy indexes
+    policy_prob     (E,) float32      MCTS probability of each legal move
+
+The constant plane of 1s isn't stored. Policies are sparse over legal moves, which also gives the illegal move mask
+the policy loss needs. That is about 1 KB per position against 32 KB for float64 planes plus a dense policy.
+
+Shards are numbered in the order they are written, shard_000000 first, and positions are addressed by (shard number,
+position in shard), so an address stays valid while older shards are dropped.
+"""
+import json
+import os
+import shutil
+
+import numpy as np
+
+from game import Board, LEN_ROW, NUM_SQUARES
+from encoder import HISTORY_LENGTH, STORED_PLANES, num_planes
+
+PACKED_BYTES = NUM_SQUARES * STORED_PLANES // 8
+INDEX_FILE = 'index.json'
+SHARD_ARRAYS = ('planes', 'values', 'games', 'policy_offsets', 'policy_index', 'policy_prob')
+
+def shard_name(number):
+    return f'shard_{number:06d}'
+
+def shard_number(name):
+    return int(name[len('shard_'):])
+
+class ReplayBuffer():
+    """
+    Replay buffer in directory holding the positions of the most recent window_games games. add_game collects positions
+    in memory until shard_size are waiting, then writes them as a shard. Shards that fall entirely outside the window are
+    deleted.
+    """
+    def __init__(self, directory, shard_size=4096, window_games=500):
+        self.directory = directory
+        self.shard_size = shard_size
+        self.window_games = window_games
+        os.makedirs(directory, exist_ok=True)
+        index_path = os.path.join(directory, INDEX_FILE)
+        if os.path.exists(index_path):
+            with open(index_path) as f:
+                index = json.load(f)
+            self.shards = index['shards']
+            self.next_game = index['next_game']
+            self.next_shard = index['next_shard']
+        else:
+            self.shards = []
+            self.next_game = 0
+            self.next_shard = 0
+        self.pending = []
+        # memory maps of shards opened by the reader, keyed by shard name
+        self.open_shards = {}
+
+    def add_game(self, positions, policies, values):
+        """
+        Adds one game: network inputs (N, 9, 9, 49), dense policies (N, 1296) with -1 marking illegal moves, as
+        ReinfLearn.play_game returns them, and values (N,).
+        """
+        positions = np.asarray(positions)
+        policies = np.asarray(policies)
+        planes = np.packbits(positions[..., :STORED_PLANES].reshape(len(positions), -1) != 0, axis=1)
+        game = self.next_game
+        self.next_game += 1
+        for i in range(len(positions)):
+            legal = np.flatnonzero(policies[i] >= 0).astype(np.int16)
+            self.pending.append((planes[i], float(values[i]), game, legal, policies[i][legal].astype(np.float32)))
+            if len(self.pending) >= self.shard_size:
+                self.write_shard()
+
+    def flush(self):
+        """
+        Writes any waiting positions as a (smaller) shard.
+        """
+        if self.pending:
+            self.write_shard()
+
+    def write_shard(self):
+        """
+        Writes the waiting positions to a new shard directory, then updates the index and drops shards outside the window.
+        """
+        name = shard_name(self.next_shard)
+        self.next_shard += 1
+        pending, self.pending = self.pending[:self.shard_size], self.pending[self.shard_size:]
+        lengths = np.array([len(entry[3]) for entry in pending], dtype=np.int64)
+        arrays = {
+            'planes': np.stack([entry[0] for entry in pending]),
+            'values': np.array([entry[1] for entry in pending], dtype=np.float32),
+            'games': np.array([entry[2] for entry in pending], dtype=np.int32),
+            'policy_offsets': np.concatenate(([0], np.cumsum(lengths))),
+            'policy_index': np.concatenate([entry[3] for entry in pending]).astype(np.int16),
+            'policy_prob': np.concatenate([entry[4] for entry in pending]).astype(np.float32),
+        }
+        # written under a temporary name so readers never see a partial shard
+        tmp_path = os.path.join(self.directory, name + '.tmp')
+        os.makedirs(tmp_path, exist_ok=True)
+        for array_name, array in arrays.items():
+            np.save(os.path.join(tmp_path, array_name + '.npy'), array)
+        os.replace(tmp_path, os.path.join(self.directory, name))
+        self.shards.append({'name': name, 'count': len(pending), 'first_game': int(arrays['games'][0]),
+                            'last_game': int(arrays['games'][-1])})
+        first_game = self.first_game()
+        for shard in [shard for shard in self.shards if shard['last_game'] < first_game]:
+            self.shards.remove(shard)
+            self.open_shards.pop(shard['name'], None)
+            shutil.rmtree(os.path.join(self.directory, shard['name']), ignore_errors=True)
+        self.write_index()
+
+    def write_index(self):
+        index = {'version': 1, 'shard_size': self.shard_size, 'history_length': HISTORY_LENGTH, 'shards': self.shards,
+                 'next_game': self.next_game, 'next_shard': self.next_shard}
+        tmp_path = os.path.join(self.directory, INDEX_FILE + '.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(index, f)
+        os.replace(tmp_path, os.path.join(self.directory, INDEX_FILE))
+
+    def first_game(self):
+        """
+        Returns number of the oldest game inside the window.
+        """
+        return self.next_game - self.window_games
+
+    def shard(self, name):
+        """
+        Returns dictionary of read-only memory maps for a shard's arrays.
+        """
+        if name not in self.open_shards:
+            path = os.path.join(self.directory, name)
+            self.open_shards[name] = {array_name: np.load(os.path.join(path, array_name + '.npy'), mmap_mode='r')
+                                      for array_name in SHARD_ARRAYS}
+        return self.open_shards[name]
+
+    def window(self):
+        """
+        Returns (shard number, position) arrays for every written position inside the window.
+        """
+        first_game = self.first_game()
+        shard_ids = []
+        positions = []
+        for entry in self.shards:
+            if entry['last_game'] < first_game:
+                continue
+            games = self.shard(entry['name'])['games']
+            position = np.flatnonzero(games >= first_game)
+            shard_ids.append(np.full(len(position), shard_number(entry['name']), dtype=np.int32))
+            positions.append(position)
+        if not positions:
+            return np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.int64)
+        return np.concatenate(shard_ids), np.concatenate(positions)
+
+    def __len__(self):
+        return len(self.window()[0])
+
+    def steps_per_epoch(self, batch_size):
+        return max(1, len(self) // batch_size)
+
+    def decode(self, shard_ids, positions, dtype=np.float32, shards=None):
+        """
+        Decodes positions into (x, [policy, value]) training arrays: (B, 9, 9, 49) inputs, (B, 1296) policies with -1 for
+        illegal moves and (B,) values. shards optionally maps shard numbers to shard arrays already opened, which stay
+        readable after the shard is dropped from the window.
+        """
+        count = len(positions)
+        x = np.empty((count, LEN_ROW, LEN_ROW, num_planes(HISTORY_LENGTH)), dtype=dtype)
+        policy = np.full((count, Board.LEN_OUTPUT_INDEX), -1., dtype=np.float32)
+        value = np.empty(count, dtype=np.float32)
+        # unpack straight into the channels last layout the planes were packed from
+        planes = x.reshape(count, NUM_SQUARES, -1)[:, :, :STORED_PLANES]
+        rows = np.arange(count)
+        for shard_id in np.unique(shard_ids):
+            selected = rows[shard_ids == shard_id]
+            shard = shards[shard_id] if shards is not None else self.shard(shard_name(shard_id))
+            # sorted reads keep memory map access sequential
+            order = np.argsort(positions[selected])
+            selected = selected[order]
+            index = positions[selected]
+            bits = np.unpackbits(shard['planes'][index], axis=1)
+            planes[selected] = bits.reshape(len(index), NUM_SQUARES, STORED_PLANES)
+            value[selected] = shard['values'][index]
+            offsets = shard['policy_offsets']
+            for row, position in zip(selected, index):
+                start, end = offsets[position], offsets[position + 1]
+                policy[row, shard['policy_index'][start:end]] = shard['policy_prob'][start:end]
+        x[..., -1] = 1
+        return x, [policy, value]
+
+    def batches(self, batch_size=256, shuffle=True, repeat=False, seed=None):
+        """
+        Yields (x, [policy, value]) batches over the window without loading it into memory, in a fresh random order
+        each pass when shuffle is set. With repeat, passes continue forever, for model.fit with steps_per_epoch. Each pass
+        reads the window once and holds its shards open, so games added meanwhile join at the next pass and shards they
+        push out of the window are still read until this pass ends. Raises ValueError if the window holds fewer than
+        batch_size positions.
+        """
+        rng = np.random.default_rng(seed)
+        while True:
+            shard_ids, positions = self.window()
+            if len(positions) < batch_size:
+                raise ValueError(f"replay window holds {len(positions)} positions, fewer than a batch of {batch_size}")
+            # memory maps outlive the deleted files, so dropped shards stay readable through these references
+            shards = {int(number): self.shard(shard_name(number)) for number in np.unique(shard_ids)}
+            order = rng.permutation(len(positions)) if shuffle else np.arange(len(positions))
+            for start in range(0, len(order) - batch_size + 1, batch_size):
+                batch = order[start:start + batch_size]
+                yield self.decode(shard_ids[batch], positions[batch], shards=shards)
+            if not repeat:
+                break
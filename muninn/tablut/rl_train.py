@@ -0,0 +1,102 @@
+"""
+Self-play reinforcement learning loop. Run from this directory:
+
+    python rl_train.py
+
+The loop below alternates self-play and training. pipeline.py runs them side by side in separate processes.
+"""
+import numpy as np
+
+import mcts
+from game import Board, ZobristHashing
+from encoder import Encoder
+
+def fst(x):
+    return x[0]
+
+class ReinfLearn():
+    """
+    Plays self-play games with MCTS guided by model. The searcher keeps its tree between moves: after each move the
+    chosen child becomes the new root, so its visits carry over into the next search. Each search is limited to
+    iterations simulations and/or time_limit seconds, and stops early once its best move is settled. An optional
+    instrument.SearchStats reports every search, an optional solver.Solver settles short King escapes and captures
+    exactly, and an optional gamedb.OpeningBook plays or biases the first moves.
+    """
+    def __init__(self, model, iterations=100, batch_size=1, reuse_tree=True, cache=None, time_limit=None, stats=None,
+                 solver=None, book=None):
+        self.model = model
+        self.iterations = iterations
+        self.time_limit = time_limit
+        self.stats = stats
+        self.solver = solver
+        self.book = book
+        self.batch_size = batch_size
+        self.reuse_tree = reuse_tree
+        # optional mcts.EvaluationCache shared across games
+        self.cache = cache
+
+    def play_game(self):
+        """
+        Plays one game. Returns (positions, policies, values): network inputs, MCTS visit distributions over the 1296
+        policy index (-1 for illegal moves, as the policy loss expects) and results from White's perspective.
+        """
+        positions_data = []
+        move_probs_data = []
+        values_data = []
+
+        g = Board()
+        g.set_starting_position()
+        mcts_searcher = mcts.MCTS(self.model, iterations=self.iterations, batch_size=self.batch_size, cache=self.cache,
+                                  time_limit=self.time_limit, stats=self.stats, solver=self.solver,
+                                  book=self.book)
+        root_node = mcts_searcher.new_root(g)
+        encoder = Encoder(1)
+
+        while (not fst(g.is_terminal())):
+            positions_data.append(encoder.encode([g])[0].copy())
+
+            move_probs = mcts_searcher.search(root_node, g)
+            moves = [move for move, _, _, _ in move_probs]
+            probs = np.array([prob for _, prob, _, _ in move_probs])
+            output_vec = np.full(Board.LEN_OUTPUT_INDEX, -1.0)
+            output_vec[np.fromiter(map(Board.MOVE_TO_INDEX.__getitem__, moves), dtype=np.int64, count=len(moves))] = probs
+            next_move = moves[np.random.choice(len(moves), p=probs / probs.sum())]
+
+            move_probs_data.append(output_vec)
+            g.apply_move(next_move)
+            if self.reuse_tree:
+                root_node = mcts_searcher.advance(next_move, g)
+            else:
+                root_node = mcts_searcher.new_root(g)
+
+        else:
+            _, winner = g.is_terminal()
+            values_data = [mcts.terminal_value(winner)] * len(move_probs_data)
+        return (positions_data, move_probs_data, values_data)
+
+if __name__ == '__main__':
+    from tqdm import tqdm
+    from model import load_model
+    from inference import FunctionNetwork
+    from replay import ReplayBuffer
+    from solver import Solver
+    from symmetry import SymmetricEvaluationCache, augment
+
+    model = load_model("../saved_models/supervised_model_tablut_muninn.keras")
+    # self-play calls the compiled forward pass directly, sharing the weights model.fit updates
+    learner = ReinfLearn(FunctionNetwork(model), cache=SymmetricEvaluationCache(ZobristHashing()), solver=Solver())
+    replay_buffer = ReplayBuffer("../replay_buffer", window_games=500)
+
+    for i in range(0, 11):
+        print(f"Training Iteration: {i}")
+        for j in tqdm(range(0, 10)):
+            replay_buffer.add_game(*learner.play_game())
+        replay_buffer.flush()
+        # cached evaluations are stale once the model trains
+        learner.cache.clear()
+
+        batch_size = 16
+        model.fit(augment(replay_buffer.batches(batch_size, repeat=True)), steps_per_epoch=replay_buffer.steps_per_epoch(batch_size),
+                  epochs = 256, verbose=0)
+        if i % 10 == 0:
+            model.save(f'model_it{i}.keras')
@@ -0,0 +1,254 @@
+"""
+Multi-process self-play. Worker processes each play games with their own MCTS and send leaf positions to a single
+inference process, which batches requests across workers into one predict call. Run from this directory:
+
+    python selfplay.py
+"""
+import multiprocessing as mp
+import os
+import queue
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from game import Board
+from encoder import INPUT_SHAPE
+from rl_train import ReinfLearn
+
+def get_checked(q, check, poll_interval):
+    """
+    Returns the next item on q, calling check every poll_interval seconds while waiting. check raises RuntimeError once
+    the process that should answer has died, so a crash ends the wait instead of blocking it forever.
+    """
+    while True:
+        try:
+            return q.get(timeout=poll_interval)
+        except queue.Empty:
+            check()
+
+def check_parent():
+    """
+    Raises RuntimeError in a child process whose parent has exited.
+    """
+    parent = mp.parent_process()
+    if parent is not None and not parent.is_alive():
+        raise RuntimeError('self-play driver process exited')
+
+class SharedBuffers():
+    """
+    Per-worker input and output slots in shared memory. Worker i writes up to max_leaves network inputs into inputs[i]
+    and the inference process writes the policy and value outputs back into policies[i] and values[i], so only small
+    (worker, count) messages go through the queues.
+    """
+    def __init__(self, num_workers, max_leaves, names=None):
+        self.num_workers = num_workers
+        self.max_leaves = max_leaves
+        shapes = {'inputs': ((num_workers, max_leaves) + INPUT_SHAPE, np.float32),
+                  'policies': ((num_workers, max_leaves, Board.LEN_OUTPUT_INDEX), np.float32),
+                  'values': ((num_workers, max_leaves, 1), np.float32)}
+        self.blocks = {}
+        for name, (shape, dtype) in shapes.items():
+            size = int(np.prod(shape)) * np.dtype(dtype).itemsize
+            if names is None:
+                block = shared_memory.SharedMemory(create=True, size=size)
+            else:
+                block = shared_memory.SharedMemory(name=names[name])
+            self.blocks[name] = block
+            setattr(self, name, np.ndarray(shape, dtype=dtype, buffer=block.buf))
+
+    def names(self):
+        """
+        Returns the shared memory block names, for attaching from another process.
+        """
+        return {name: block.name for name, block in self.blocks.items()}
+
+    def close(self):
+        for name in list(self.blocks):
+            # drop the array views before closing the mapping
+            setattr(self, name, None)
+            self.blocks[name].close()
+
+    def unlink(self):
+        for block in self.blocks.values():
+            block.unlink()
+
+class RemoteNetwork():
+    """
+    Stands in for the model inside a worker. predict writes the positions into the worker's shared slot, asks the
+    inference process to evaluate them and returns the outputs in the model's [policy, value] layout. The driver
+    terminates the worker if the inference process dies, and the worker gives up itself if the driver dies.
+    """
+    def __init__(self, worker_id, buffers, request_queue, response_queue, poll_interval=1.0):
+        self.worker_id = worker_id
+        self.buffers = buffers
+        self.request_queue = request_queue
+        self.response_queue = response_queue
+        self.poll_interval = poll_interval
+
+    def predict(self, x, verbose=0):
+        count = len(x)
+        if count > self.buffers.max_leaves:
+            raise ValueError(f'batch of {count} positions is larger than the shared slot ({self.buffers.max_leaves})')
+        self.buffers.inputs[self.worker_id, :count] = x
+        self.request_queue.put((self.worker_id, count))
+        get_checked(self.response_queue, check_parent, self.poll_interval)
+        return [self.buffers.policies[self.worker_id, :count].copy(), self.buffers.values[self.worker_id, :count].copy()]
+
+def inference_loop(model_fn, buffer_names, num_workers, max_leaves, request_queue, response_queues, max_batch,
+                   timeout, stats_queue, poll_interval=1.0):
+    """
+    Runs in the inference process. Builds the model with model_fn, then repeatedly gathers requests until max_batch
+    positions are waiting or timeout seconds have passed since the first one, evaluates them in one predict call and
+    answers each worker. Stops when it receives None, or raises RuntimeError if the driver process exits.
+    """
+    model = model_fn()
+    buffers = SharedBuffers(num_workers, max_leaves, buffer_names)
+    calls = 0
+    positions = 0
+    running = True
+    while running:
+        request = get_checked(request_queue, check_parent, poll_interval)
+        if request is None:
+            break
+        requests = [request]
+        total = request[1]
+        deadline = time.perf_counter() + timeout
+        while total < max_batch:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                request = request_queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if request is None:
+                running = False
+                break
+            requests.append(request)
+            total += request[1]
+        x = np.concatenate([buffers.inputs[worker_id, :count] for worker_id, count in requests])
+        policy, value = model.predict(x, verbose=0)[:2]
+        offset = 0
+        for worker_id, count in requests:
+            buffers.policies[worker_id, :count] = policy[offset:offset + count]
+            buffers.values[worker_id, :count] = value[offset:offset + count]
+            offset += count
+            response_queues[worker_id].put(True)
+        calls += 1
+        positions += total
+    stats_queue.put({'predict_calls': calls, 'positions': positions})
+    buffers.close()
+
+def worker_loop(worker_id, num_games, buffer_names, num_workers, max_leaves, request_queue, response_queue,
+                result_queue, learner_kwargs, seed, poll_interval=1.0):
+    """
+    Runs in a worker process. Plays num_games self-play games through a RemoteNetwork and puts each game's
+    (positions, policies, values) on result_queue.
+    """
+    np.random.seed(seed)
+    buffers = SharedBuffers(num_workers, max_leaves, buffer_names)
+    network = RemoteNetwork(worker_id, buffers, request_queue, response_queue, poll_interval)
+    learner = ReinfLearn(network, **learner_kwargs)
+    for _ in range(num_games):
+        result_queue.put(learner.play_game())
+    result_queue.put(None)
+    buffers.close()
+
+class SelfPlay():
+    """
+    Self-play driver with num_workers game processes and one inference process. model_fn is a picklable function that
+    builds the model inside the inference process, so TensorFlow is only imported there. Leaves are batched across
+    workers up to max_batch positions or timeout seconds. Every process checks that the ones it waits on are alive each
+    poll_interval seconds, and run raises RuntimeError if any of them dies.
+    """
+    def __init__(self, model_fn, num_workers=None, iterations=100, batch_size=8, max_batch=None, timeout=0.002,
+                 poll_interval=1.0):
+        self.model_fn = model_fn
+        # one core is left for the inference process
+        self.num_workers = num_workers or max(1, (os.cpu_count() or 2) - 1)
+        self.iterations = iterations
+        # leaves each worker's MCTS sends per request
+        self.batch_size = batch_size
+        self.max_batch = max_batch or self.num_workers * batch_size
+        self.timeout = timeout
+        self.poll_interval = poll_interval
+        self.stats = None
+
+    def run(self, num_games, seed=0):
+        """
+        Plays num_games games split across the workers. Returns (positions, policies, values) lists covering every
+        position of every game, as ReinfLearn.play_game does for a single game.
+        """
+        ctx = mp.get_context()
+        buffers = SharedBuffers(self.num_workers, self.batch_size)
+        request_queue = ctx.Queue()
+        response_queues = [ctx.Queue() for _ in range(self.num_workers)]
+        result_queue = ctx.Queue()
+        stats_queue = ctx.Queue()
+        learner_kwargs = {'iterations': self.iterations, 'batch_size': self.batch_size}
+
+        server = ctx.Process(target=inference_loop, args=(self.model_fn, buffers.names(), self.num_workers,
+                             self.batch_size, request_queue, response_queues, self.max_batch, self.timeout, stats_queue,
+                             self.poll_interval))
+        server.start()
+        workers = []
+        for worker_id in range(self.num_workers):
+            games = num_games // self.num_workers + (worker_id < num_games % self.num_workers)
+            worker = ctx.Process(target=worker_loop, args=(worker_id, games, buffers.names(), self.num_workers,
+                                 self.batch_size, request_queue, response_queues[worker_id], result_queue,
+                                 learner_kwargs, seed + worker_id, self.poll_interval))
+            worker.start()
+            workers.append(worker)
+
+        positions = []
+        policies = []
+        values = []
+        finished = 0
+
+        def check_processes(server_stopping=False):
+            # the server only exits cleanly once told to stop, after putting its stats
+            if server_stopping:
+                failed = server.exitcode not in (None, 0)
+            else:
+                failed = server.exitcode is not None
+            if failed:
+                raise RuntimeError(f'self-play inference process exited with code {server.exitcode}')
+            for worker_id, worker in enumerate(workers):
+                if worker.exitcode:
+                    raise RuntimeError(f'self-play worker {worker_id} exited with code {worker.exitcode}')
+        try:
+            # read results before joining so workers never block on a full queue
+            while finished < self.num_workers:
+                result = get_checked(result_queue, check_processes, self.poll_interval)
+                if result is None:
+                    finished += 1
+                    continue
+                positions += result[0]
+                policies += result[1]
+                values += result[2]
+            for worker in workers:
+                worker.join()
+            request_queue.put(None)
+            self.stats = get_checked(stats_queue, lambda: check_processes(server_stopping=True), self.poll_interval)
+            server.join()
+        finally:
+            for process in workers + [server]:
+                if process.is_alive():
+                    process.terminate()
+            buffers.close()
+            buffers.unlink()
+        return (positions, policies, values)
+
+def load_supervised_model():
+    from model import load_model
+    from inference import FunctionNetwork
+    return FunctionNetwork(load_model("../saved_models/supervised_model_tablut_muninn.keras"))
+
+if __name__ == '__main__':
+    self_play = SelfPlay(load_supervised_model)
+    start = time.perf_counter()
+    positions, policies, values = self_play.run(num_games=self_play.num_workers * 2)
+    elapsed = time.perf_counter() - start
+    print(f"{len(positions)} positions from {self_play.num_workers * 2} games in {elapsed:.1f}s with "
+          f"{self_play.num_workers} workers, {self_play.stats['predict_calls']} predict calls")
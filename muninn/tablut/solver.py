@@ -0,0 +1,191 @@
+"""
+Tactical solver for King escapes and King captures a few plies deep, working on the Board bitboards. It proves rather
+than evaluates: a result is only returned when the outcome is forced, so MCTS can back it up as an exact value.
+
+    King escape in N (N odd, White to move): White has a move after which every Black reply still leaves an escape,
+        down to an open line from the King to the edge.
+    Escape forced in N (N even, Black to move): every Black reply leaves White an escape in N - 1.
+    King capture in 1 (Black to move): Black has a move capturing the King.
+
+Only moves that can matter are searched. White's candidates must open or create a line for the King. Black replies are
+limited to moves landing on one of the open lines or next to the King, since any other reply leaves a line open and the
+King uncapturable. Every Black reply is tried when a repetition could end the game. Pruning White's candidates can miss
+wins but never produces a wrong one.
+"""
+from collections import OrderedDict
+
+from game import Board, RAYS, RAY_SQUARES, CROSSES, NEIGHBOURS, SQUARE_MASKS, dilate
+
+class Solver():
+    """
+    Proves short King escapes and captures, up to max_plies plies, with an LRU cache of results keyed by Zobrist hash
+    and repetition count. Positions where an earlier position has already occurred twice aren't cached, as their result
+    can depend on the rest of the game history.
+    """
+    def __init__(self, max_plies=3, max_size=100000):
+        self.max_plies = max_plies
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        # set per solve: whether every Black reply must be tried because a repetition could end the game
+        self.repetition_possible = False
+
+    def solve(self, board):
+        """
+        Returns (winner, move, plies) if the position is decided within max_plies: the winning side, the first move of
+        the win when the side to move wins (None otherwise) and the number of plies to the end. Returns None if
+        unproven. board must not be terminal.
+        """
+        # within 3 plies the search can't repeat a position by itself, so a third occurrence needs one already seen twice
+        repeated = repetition_possible(board)
+        self.repetition_possible = repeated or self.max_plies > 3
+        cacheable = not repeated
+        if cacheable:
+            key = (board.zobrist_hash, board.repetition_counter)
+            if key in self.entries:
+                self.hits += 1
+                self.entries.move_to_end(key)
+                return self.entries[key]
+            self.misses += 1
+        result = self.prove(board)
+        if cacheable:
+            self.entries[key] = result
+            if len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+        return result
+
+    def prove(self, board):
+        if board.turn == Board.WHITE:
+            for plies in range(1, self.max_plies + 1, 2):
+                move = self.king_escape(board, plies)
+                if move is not None:
+                    return Board.WHITE, move, plies
+            return None
+        move = king_capture(board)
+        if move is not None:
+            return Board.BLACK, move, 1
+        for plies in range(2, self.max_plies + 1, 2):
+            if self.escape_forced(board, plies):
+                return Board.WHITE, None, plies
+        return None
+
+    def king_escape(self, board, plies):
+        """
+        White to move. Returns a move forcing a King escape within plies (odd) plies, or None.
+        """
+        if not board.king:
+            return None
+        lines = open_lines(board)
+        if lines:
+            return board.king_square, RAY_SQUARES[board.king_square][lines[0]][-1]
+        if plies < 3:
+            return None
+        for move in escape_candidates(board):
+            board.apply_move(move)
+            forced = self.escape_forced(board, plies - 1)
+            board.undo_move()
+            if forced:
+                return move
+        return None
+
+    def escape_forced(self, board, plies):
+        """
+        Black to move. Checks whether every Black reply leaves White a King escape within plies - 1 plies.
+        """
+        if not board.king:
+            return False
+        lines = safe_lines(board)
+        if not lines:
+            return False
+        # a reply landing anywhere else leaves a line open and can't capture the King
+        relevant = NEIGHBOURS[board.king_square]
+        for direction in lines:
+            relevant |= RAYS[board.king_square][direction]
+        check_all = self.repetition_possible
+        for move in board.generate_moves():
+            if not check_all and not SQUARE_MASKS[move[1]] & relevant:
+                continue
+            board.apply_move(move)
+            if not board.king or board.repetition_counter >= 3:
+                escapes = False
+            elif open_lines(board):
+                # White escapes next move unless the only open lines cross the castle and the pieces are surrounded
+                escapes = bool(safe_lines(board)) or not board.is_surround()
+            else:
+                escapes = plies > 2 and not board.is_terminal()[0] and self.king_escape(board, plies - 1) is not None
+            board.undo_move()
+            if not escapes:
+                return False
+        return True
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {'size': len(self.entries), 'hits': self.hits, 'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.}
+
+    def clear(self):
+        self.entries.clear()
+
+def open_lines(board):
+    """
+    Returns directions in which the King has a clear line to the edge, ie. can escape next move.
+    """
+    occupied = board.white | board.black
+    rays = RAYS[board.king_square]
+    return [direction for direction in range(4) if rays[direction] and not rays[direction] & occupied]
+
+def safe_lines(board):
+    """
+    Returns the open lines that don't cross the castle. While one of them stays open the white pieces can't be
+    surrounded, since the flood fill from the edge runs along it up to the King (the vacated castle would block it).
+    """
+    castle = SQUARE_MASKS[Board.CASTLE]
+    return [direction for direction in open_lines(board) if not RAYS[board.king_square][direction] & castle]
+
+def escape_candidates(board):
+    """
+    White moves that leave the King a safe line, as escape_forced needs: King moves onto one, moves clearing one, and
+    moves that might capture a black piece blocking one (checked once applied).
+    """
+    king_square = board.king_square
+    occupied = board.white | board.black
+    castle = SQUARE_MASKS[Board.CASTLE]
+    capture_squares = dilate(board.black & CROSSES[king_square])
+    candidates = []
+    for move in board.generate_moves():
+        from_sq, to_sq = move
+        if SQUARE_MASKS[to_sq] & capture_squares:
+            candidates.append(move)
+            continue
+        if from_sq == king_square:
+            rays = RAYS[to_sq]
+            blockers = occupied | castle
+        else:
+            rays = RAYS[king_square]
+            blockers = (occupied ^ SQUARE_MASKS[from_sq] ^ SQUARE_MASKS[to_sq]) | castle
+        if any(ray and not ray & blockers for ray in rays):
+            candidates.append(move)
+    return candidates
+
+def king_capture(board):
+    """
+    Black to move. Returns a move capturing the King, or None.
+    """
+    if not board.king:
+        return None
+    neighbours = NEIGHBOURS[board.king_square]
+    for move in board.generate_moves():
+        if SQUARE_MASKS[move[1]] & neighbours:
+            board.apply_move(move)
+            captured = not board.king
+            board.undo_move()
+            if captured:
+                return move
+    return None
+
+def repetition_possible(board):
+    """
+    Checks whether some position has already occurred twice, so that a third occurrence could end the game.
+    """
+    return any(count >= 2 for count in board.position_counts.values())
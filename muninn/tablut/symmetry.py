@@ -0,0 +1,146 @@
+"""
+The 8 dihedral symmetries of the board. Tablut's board and rules are unchanged by rotating or reflecting the board, so
+any position, policy and result can be transformed into 7 more equally valid ones.
+
+Symmetry k is an optional transpose (k >= 4) followed by k % 4 quarter turns. Every table maps squares, policy indexes
+or Zobrist keys through that transform, so applying a symmetry is a single gather (or a view for board planes).
+"""
+import numpy as np
+
+from game import Board, LEN_ROW, NUM_SQUARES, iter_squares
+from mcts import EvaluationCache
+
+NUM_SYMMETRIES = 8
+
+def transform_board(array, k):
+    """
+    Returns symmetry k of array, either (..., 9, 9) boards or (..., 9, 9, C) channels last planes. Returns a view, no
+    data is copied.
+    """
+    array = np.asarray(array)
+    # board axes are the last two for (9, 9) and the two before the channels otherwise
+    axes = (-2, -1) if array.shape[-2:] == (LEN_ROW, LEN_ROW) else (-3, -2)
+    if k >= 4:
+        array = np.swapaxes(array, *axes)
+    return np.rot90(array, k % 4, axes=axes)
+
+def generate_square_maps():
+    """
+    Returns (SOURCE, DEST) (8, 81) arrays: square j of symmetry k's board holds square SOURCE[k][j] of the original, and
+    original square sq ends up on DEST[k][sq].
+    """
+    squares = np.arange(NUM_SQUARES).reshape(LEN_ROW, LEN_ROW)
+    source = np.array([transform_board(squares, k).reshape(-1) for k in range(NUM_SYMMETRIES)])
+    dest = np.empty_like(source)
+    for k in range(NUM_SYMMETRIES):
+        dest[k][source[k]] = np.arange(NUM_SQUARES)
+    return source, dest
+
+SQUARE_SOURCE, SQUARE_DEST = generate_square_maps()
+
+def generate_inverses():
+    """
+    Returns list where INVERSE[k] is the symmetry undoing symmetry k.
+    """
+    inverses = []
+    for k in range(NUM_SYMMETRIES):
+        for j in range(NUM_SYMMETRIES):
+            if (SQUARE_DEST[j][SQUARE_DEST[k]] == np.arange(NUM_SQUARES)).all():
+                inverses.append(j)
+                break
+    return inverses
+
+INVERSE = generate_inverses()
+
+def generate_policy_maps():
+    """
+    Returns (POLICY_SOURCE, POLICY_DEST) (8, 1296) arrays mapping policy indexes through each symmetry, built from the
+    build_policy_map move order: entry j of a transformed policy is entry POLICY_SOURCE[k][j] of the original.
+    """
+    source = np.empty((NUM_SYMMETRIES, Board.LEN_OUTPUT_INDEX), dtype=np.int64)
+    dest = np.empty_like(source)
+    for k in range(NUM_SYMMETRIES):
+        for index, (from_sq, to_sq) in Board.INDEX_TO_MOVE.items():
+            dest[k][index] = Board.MOVE_TO_INDEX[(int(SQUARE_DEST[k][from_sq]), int(SQUARE_DEST[k][to_sq]))]
+        source[k][dest[k]] = np.arange(Board.LEN_OUTPUT_INDEX)
+    return source, dest
+
+POLICY_SOURCE, POLICY_DEST = generate_policy_maps()
+
+def transform_policy(policy, k):
+    """
+    Returns symmetry k of a (..., 1296) policy vector (or legal move mask).
+    """
+    return np.take(policy, POLICY_SOURCE[k], axis=-1)
+
+def transform_move(move, k):
+    """
+    Returns symmetry k of a (from_sq, to_sq) move.
+    """
+    return (int(SQUARE_DEST[k][move[0]]), int(SQUARE_DEST[k][move[1]]))
+
+def augment(batches, seed=None):
+    """
+    Wraps a generator of (x, [policy, value]) training batches, applying a random symmetry to each batch. Inputs come
+    out as views of the original batch, policies through one gather.
+    """
+    rng = np.random.default_rng(seed)
+    for x, (policy, value) in batches:
+        k = int(rng.integers(NUM_SYMMETRIES))
+        yield transform_board(x, k), [transform_policy(policy, k), value]
+
+class CanonicalHashing():
+    """
+    Zobrist hash of a position's canonical form: the smallest of the hashes of its 8 symmetries, computed with one
+    vectorized XOR over per-symmetry key tables. Symmetric positions share a canonical hash.
+    """
+    def __init__(self, zobrist):
+        self.zobrist = zobrist
+        table = np.array([[0] * NUM_SQUARES if row is None else row for row in zobrist.zobrist_table], dtype=np.uint64)
+        # tables[k][piece][sq] is the key of piece on the square sq moves to under symmetry k
+        self.tables = table[:, SQUARE_DEST].transpose(1, 0, 2).copy()
+        self.black_to_move = np.uint64(zobrist.black_to_move)
+
+    def canonical_hash(self, board):
+        """
+        Returns (hash, k): the canonical hash and the symmetry taking board to its canonical form.
+        """
+        pieces = []
+        squares = []
+        for piece, bitboard in ((Board.WHITE, board.white), (Board.BLACK, board.black), (Board.KING, board.king)):
+            for sq in iter_squares(bitboard):
+                pieces.append(piece)
+                squares.append(sq)
+        if board.castle_empty:
+            pieces.append(Board.EMPTY_CASTLE)
+            squares.append(Board.CASTLE)
+        hashes = np.bitwise_xor.reduce(self.tables[:, pieces, squares], axis=1)
+        if board.turn == Board.BLACK:
+            hashes ^= self.black_to_move
+        k = int(np.argmin(hashes))
+        return int(hashes[k]), k
+
+class SymmetricEvaluationCache(EvaluationCache):
+    """
+    EvaluationCache keyed by canonical hash, so a position and its 7 symmetries share one evaluation. Entries are stored
+    with moves in the canonical orientation and mapped back to the querying position's orientation on a hit.
+    """
+    def __init__(self, zobrist, max_size=100000):
+        super().__init__(max_size)
+        self.hashing = CanonicalHashing(zobrist)
+
+    def key(self, board):
+        return self.hashing.canonical_hash(board)
+
+    def get(self, key):
+        canonical_hash, k = key
+        entry = super().get(canonical_hash)
+        if entry is None:
+            return None
+        moves, priors, value = entry
+        inverse = INVERSE[k]
+        return [transform_move(move, inverse) for move in moves], priors, value
+
+    def put(self, key, moves, priors, value):
+        canonical_hash, k = key
+        super().put(canonical_hash, [transform_move(move, k) for move in moves], priors, value)
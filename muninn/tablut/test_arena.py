@@ -0,0 +1,37 @@
+import math
+
+from arena import SPRT, elo_estimate, expected_score, score_stats
+
+def test_score_stats():
+    games, mean, variance = score_stats(3, 2, 1)
+    assert games == 6
+    assert math.isclose(mean, 4 / 6)
+    assert math.isclose(variance, (3 * (1 / 3) ** 2 + 2 * (1 / 6) ** 2 + (2 / 3) ** 2) / 6)
+
+def test_elo_estimate():
+    elo, margin = elo_estimate(60, 0, 40)
+    assert math.isclose(expected_score(elo), 0.6)
+    assert 0 < margin < math.inf
+    assert elo_estimate(5, 0, 0) == (math.inf, math.inf)
+    assert elo_estimate(0, 0, 5)[0] == -math.inf
+    assert elo_estimate(0, 0, 0) == (0, math.inf)
+
+def test_sprt_bounds():
+    sprt = SPRT(0, 30, 0.05, 0.05)
+    assert math.isclose(sprt.upper, math.log(19))
+    assert math.isclose(sprt.lower, -math.log(19))
+    assert sprt.llr(0, 0, 0) == 0
+    assert sprt.status(10, 10, 10) is None
+
+def test_sprt_decides_one_sided_runs():
+    sprt = SPRT()
+    assert next(n for n in range(1, 100) if sprt.status(n, 0, 0)) < 20
+    assert sprt.status(50, 0, 0) == 'accepted'
+    assert sprt.status(0, 0, 50) == 'rejected'
+    assert sprt.status(0, 100, 0) == 'rejected'
+
+def test_sprt_follows_the_score():
+    sprt = SPRT()
+    assert sprt.status(300, 0, 200) == 'accepted'
+    assert sprt.status(200, 0, 300) == 'rejected'
+    assert sprt.llr(60, 0, 40) > sprt.llr(55, 0, 45)
@@ -0,0 +1,63 @@
+import numpy as np
+
+from game import Board
+from batch_board import EMPTY, BatchBoard, validate
+from testing import random_boards
+
+def test_matches_board():
+    for seed in range(3):
+        assert validate(32, seed, max_plies=200) > 0
+    # every game reaches max_plies and is finished there without a winner
+    assert validate(16, 0, max_plies=5) == 16 * 6
+
+def chosen_move(mask, position_hash):
+    """
+    Picks a legal move from a position's hash, so batch and scalar games follow the same line.
+    """
+    legal = np.flatnonzero(mask)
+    return int(legal[int(position_hash) % len(legal)])
+
+def test_play_matches_board():
+    # games from different positions end at different plies, so play moves the running ones into smaller batches
+    starts = [(b.to_array(), b.turn) for b in random_boards(16, max_plies=20)]
+    batch = BatchBoard(len(starts), max_plies=150)
+    batch.set_positions(np.stack([array for array, _ in starts]), np.array([turn for _, turn in starts]))
+
+    def policy_fn(games):
+        mask = games.legal_mask()
+        logits = np.full(mask.shape, -1e9)
+        for i in np.flatnonzero(mask.any(axis=1)):
+            logits[i, chosen_move(mask[i], games.hashes[i])] = 0
+        return logits
+    winners, plies = batch.play(np.random.default_rng(0), policy_fn)
+    assert len(set(plies)) > 1
+
+    for i, (array, turn) in enumerate(starts):
+        b = Board(batch.zobrist)
+        b.set_position(array, turn)
+        while not b.is_terminal()[0] and len(b.undo_stack) < 150:
+            b.apply_move(Board.INDEX_TO_MOVE[chosen_move(b.generate_moves('mask'), b.zobrist_hash)])
+        terminal, winner = b.is_terminal()
+        assert plies[i] == len(b.undo_stack)
+        assert (batch.boards()[i] == b.to_array()).all() and batch.hashes[i] == b.zobrist_hash
+        assert winners[i] == (winner if terminal else EMPTY)
+
+def test_moves_past_max_plies_are_ignored():
+    batch = BatchBoard(4, max_plies=6)
+    batch.set_starting_position()
+    winners, plies = batch.play(np.random.default_rng(0))
+    assert (plies <= 6).all() and batch.is_terminal()[0].all()
+    boards = batch.board.copy()
+    batch.apply_moves(batch.sample_moves(np.random.default_rng(0)))
+    assert (batch.board == boards).all() and (batch.plies == plies).all()
+
+def test_repetition():
+    batch = BatchBoard(1)
+    batch.set_starting_position()
+    shuffle = [(22, 21), (3, 2), (21, 22), (2, 3)]
+    for move in shuffle * 2:
+        batch.apply_moves([Board.MOVE_TO_INDEX[move]])
+    # back at the start a third time, which loses for White
+    assert batch.repetition[0] == 3
+    terminal, winners = batch.is_terminal()
+    assert terminal[0] and winners[0] == Board.BLACK
@@ -0,0 +1,94 @@
+import csv
+import os
+
+import numpy as np
+
+import dataset
+from game import Board
+from encoder import Encoder
+from testing import csv_games, move_name, write_games_csv
+from dataset import build_dataset, decode_planes, load_shards, policy_targets, read_games, replay_games, translate_move
+
+def test_translate_move_edge_squares():
+    assert translate_move('a1-a9') == (0, 72)
+    assert translate_move('a1-i1') == (0, 8)
+    assert translate_move('i9-i1') == (80, 8)
+    assert translate_move('i9-a9') == (80, 72)
+    assert translate_move('e5-e9') == (Board.CASTLE, 76)
+    for move in ((0, 72), (8, 80), (72, 0), (80, 8)):
+        assert translate_move(move_name(move)) == move
+
+def test_read_games_groups_rows_by_game(tmp_path):
+    path = tmp_path / 'games.csv'
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['Game_ID', 'Winner', 'Move'])
+        # rows of the two games interleaved
+        writer.writerows([['b', 'Black', 'd1-d2'], ['a', 'White', 'e3-f3'], ['b', 'Black', 'e3-h3'],
+                          ['a', 'White', 'd2-d1'], ['b', 'Black', 'a4-a3']])
+    games = read_games(path)
+    assert games == [('b', 'Black', [(3, 12), (22, 25), (27, 18)]), ('a', 'White', [(22, 23), (12, 3)])]
+
+def test_replay_games_matches_board_and_encoder():
+    games = csv_games(3)
+    numbered = [(number, winner, moves) for number, (_, winner, moves) in enumerate(games)]
+    arrays, rejected = replay_games(numbered)
+    assert rejected == 0
+    encoder = Encoder()
+    row = 0
+    for number, winner, moves in numbered:
+        b = Board()
+        b.set_starting_position()
+        for move in moves:
+            assert np.array_equal(decode_planes(arrays['planes'][row:row + 1]), encoder.encode([b]))
+            assert np.array_equal(np.unpackbits(arrays['legal'][row]).astype(bool), b.generate_moves('mask'))
+            assert arrays['moves'][row] == Board.MOVE_TO_INDEX[move]
+            assert arrays['values'][row] == (1. if winner == 'White' else -1.)
+            assert arrays['games'][row] == number
+            b.apply_move(move)
+            row += 1
+    assert row == len(arrays['moves'])
+    targets = policy_targets(arrays['legal'], arrays['moves'])
+    assert np.all(targets[np.arange(row), arrays['moves']] == 1.)
+    assert np.all((targets == 1.).sum(axis=1) == 1)
+
+def test_replay_games_stops_at_illegal_move():
+    _, winner, moves = csv_games(1)[0]
+    # a piece can't stay where it is
+    arrays, rejected = replay_games([(0, winner, moves[:3] + [(Board.CASTLE, Board.CASTLE)] + moves[3:])])
+    assert rejected == 1
+    assert len(arrays['moves']) == 3
+
+def build(csv_path, cache_dir):
+    return build_dataset(str(csv_path), str(cache_dir), games_per_shard=2, processes=1)
+
+def test_build_dataset_reuses_cached_shards(tmp_path, monkeypatch):
+    games = csv_games(5)
+    csv_path = tmp_path / 'games.csv'
+    write_games_csv(csv_path, games)
+    directory = build(csv_path, tmp_path / 'shards')
+    arrays = load_shards(directory)
+    expected, _ = replay_games([(number, winner, moves) for number, (_, winner, moves) in enumerate(games)])
+    for name, array in expected.items():
+        assert np.array_equal(arrays[name], array)
+    manifest_time = os.path.getmtime(os.path.join(directory, dataset.MANIFEST_FILE))
+
+    def no_replay(csv_path):
+        raise AssertionError('unchanged CSV was read again')
+    monkeypatch.setattr(dataset, 'read_games', no_replay)
+    assert build(csv_path, tmp_path / 'shards') == directory
+    assert os.path.getmtime(os.path.join(directory, dataset.MANIFEST_FILE)) == manifest_time
+
+def test_build_dataset_rebuilds_on_change(tmp_path, monkeypatch):
+    csv_path = tmp_path / 'games.csv'
+    write_games_csv(csv_path, csv_games(4))
+    directory = build(csv_path, tmp_path / 'shards')
+    write_games_csv(csv_path, csv_games(4, seed=1))
+    changed = build(csv_path, tmp_path / 'shards')
+    assert changed != directory
+    assert load_shards(changed)['moves'].tolist() != load_shards(directory)['moves'].tolist()
+    monkeypatch.setattr(dataset, 'ENCODING_VERSION', dataset.ENCODING_VERSION + 1)
+    reencoded = build(csv_path, tmp_path / 'shards')
+    assert reencoded not in (directory, changed)
+    assert os.path.exists(os.path.join(reencoded, dataset.MANIFEST_FILE))
+    assert not os.path.exists(reencoded + '.tmp')
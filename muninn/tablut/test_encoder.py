@@ -0,0 +1,66 @@
+import numpy as np
+import pytest
+
+from game import Board
+from encoder import Encoder, encode_histories, history_planes
+from testing import random_boards, start_board
+
+def naive_input(b, history_length=8):
+    """
+    The network input built square by square from board arrays, undoing moves to reach earlier positions.
+    """
+    x = np.zeros((9, 9, 6 * history_length + 1))
+    undone = []
+    for h in range(history_length):
+        squares = b.to_array()
+        for plane, piece in enumerate((Board.WHITE, Board.BLACK, Board.KING, Board.EMPTY_CASTLE)):
+            x[:, :, 6 * h + plane] = squares == piece
+        x[:, :, 6 * h + 4] = b.repetition_counter > 1
+        x[:, :, 6 * h + 5] = b.turn == Board.WHITE
+        if not b.undo_stack:
+            break
+        undone.append(b.undo_move())
+    for move in reversed(undone):
+        b.apply_move(move)
+    x[:, :, -1] = 1
+    return x
+
+@pytest.mark.parametrize('dtype', [np.float32, np.uint8])
+def test_encoder_matches_naive_input(dtype):
+    boards = random_boards(64)
+    expected = np.stack([naive_input(b) for b in boards])
+    encoder = Encoder(4, dtype=dtype)
+    assert np.array_equal(encoder.encode(boards), expected)
+    assert encoder.encode(boards).dtype == dtype
+    # the buffer grew and is reused for smaller batches
+    assert len(encoder.buffer) == 64
+    assert np.array_equal(encoder.encode(boards[:3]), expected[:3])
+    assert np.array_equal(encoder.encode(boards[5:6]), expected[5:6])
+
+def test_starting_position_planes():
+    x = Encoder().encode([start_board()])[0]
+    assert x[:, :, 2].sum() == 1 and x[4, 4, 2] == 1
+    assert x[:, :, 0].sum() == 8 and x[:, :, 1].sum() == 16
+    # White to move and no earlier positions
+    assert np.all(x[:, :, 5] == 1) and not x[:, :, 6:-1].any()
+    assert np.all(x[:, :, -1] == 1)
+
+def test_histories_encode_later():
+    boards = random_boards(8, seed=1)
+    histories = [b.history(8) for b in boards]
+    turns = [b.turn for b in boards]
+    expected = np.stack([naive_input(b) for b in boards])
+    # the boards move on before the batch is encoded
+    for b in boards:
+        if not b.is_terminal()[0]:
+            b.apply_move(b.generate_moves()[0])
+    assert np.array_equal(Encoder(2).encode_histories(histories, turns), expected)
+
+def test_writes_land_in_out():
+    boards = random_boards(3, seed=2)
+    out = np.zeros((3, 9, 9, 49), dtype=np.float32)
+    assert encode_histories([b.history(8) for b in boards], [b.turn for b in boards], out) is out
+    assert np.array_equal(out, np.stack([naive_input(b) for b in boards]))
+    assert np.shares_memory(history_planes(out), out)
+    with pytest.raises(ValueError):
+        history_planes(np.zeros((49, 9, 9, 3)).T)
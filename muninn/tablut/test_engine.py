@@ -0,0 +1,101 @@
+import pytest
+
+from game import Board
+from testing import UniformNetwork, start_board
+from engine import Engine, format_move, parse_board, parse_go, parse_move
+
+@pytest.fixture
+def engine():
+    lines = []
+    engine = Engine(UniformNetwork(), nodes=32, output=lines.append)
+    engine.lines = lines
+    yield engine
+    engine.handle('quit')
+
+def replies(engine, *commands):
+    """
+    Runs commands and returns the lines they printed, waiting for any search they started.
+    """
+    del engine.lines[:]
+    for command in commands:
+        engine.handle(command)
+    if engine.thread is not None and engine.thread.name == 'search':
+        engine.thread.join()
+    return list(engine.lines)
+
+def test_move_notation():
+    assert parse_move('e3-e5') == (22, 40)
+    assert format_move((22, 40)) == 'e3-e5'
+    for text in ('e3e5', 'j3-e5', 'e0-e5', 'e3-e10'):
+        with pytest.raises(ValueError):
+            parse_move(text)
+    assert parse_go(['nodes', '10', 'infinite']) == {'nodes': 10, 'infinite': True}
+    with pytest.raises(ValueError):
+        parse_go(['nodes'])
+
+def test_commands(engine):
+    assert replies(engine, 'isready') == ['readyok']
+    start = start_board()
+    assert replies(engine, 'legal') == [' '.join(format_move(move) for move in start.generate_moves())]
+    shown = replies(engine, 'show')
+    assert len(shown) == 10 and shown[-1] == 'turn white'
+    # show's rows are a position command's board
+    assert parse_board('/'.join(row.replace(' ', '') for row in shown[:-1]), 'w').to_array().tolist() == \
+        start.to_array().tolist()
+    assert replies(engine, 'move e3-d3', 'show')[-1] == 'turn black'
+    assert replies(engine, 'position startpos moves e3-d3 d1-c1', 'show')[-1] == 'turn white'
+    assert engine.board.undo_stack[-1][0] == (3, 2)
+    assert replies(engine, '', 'newgame', 'show')[-1] == 'turn white'
+
+def test_errors_leave_position(engine):
+    engine.handle('move e3-d3')
+    for command in ('move e3-d3', 'move e3', 'position startpos moves e3-e3', 'position board x w', 'frobnicate'):
+        lines = replies(engine, command)
+        assert len(lines) == 1 and lines[0].startswith('error ')
+    assert len(engine.board.undo_stack) == 1 and engine.board.turn == Board.BLACK
+
+def test_go_reports_bestmove(engine):
+    lines = replies(engine, 'go nodes 16')
+    assert lines[0].startswith('info nodes ') and ' pv ' in lines[0]
+    assert lines[-1].startswith('bestmove ')
+    assert parse_move(lines[-1].split()[1]) in engine.board.generate_moves()
+    # stop ends an infinite search, which still reports
+    lines = replies(engine, 'go infinite', 'stop')
+    assert lines[-1].startswith('bestmove ')
+
+def test_pondering(engine):
+    engine.handle('ponder on')
+    assert engine.thread is not None and engine.thread.name == 'ponder'
+    engine.handle('move e3-d3')
+    assert engine.thread.name == 'ponder'
+    engine.handle('ponder off')
+    assert engine.thread is None
+    # pondering never prints
+    assert not replies(engine, 'ponder on', 'ponder off')
+
+def test_errors_keep_pondering(engine):
+    engine.handle('ponder on')
+    for command in ('move e3-e3', 'position startpos moves e3-e3', 'position startpos moves e3'):
+        assert replies(engine, command)[0].startswith('error ')
+        assert engine.thread is not None and engine.thread.name == 'ponder' and engine.thread.is_alive()
+    assert not engine.board.undo_stack
+
+def test_pondering_stops_at_node_cap():
+    lines = []
+    engine = Engine(UniformNetwork(), nodes=32, ponder=True, ponder_nodes=64, output=lines.append)
+    try:
+        engine.thread.join(timeout=60)
+        assert not engine.thread.is_alive()
+        assert engine.root.parent_edge.N == 64 and engine.searcher.stop_reason == 'iterations'
+        # the root is already at the cap, so pondering again starts nothing
+        engine.handle('ponder off')
+        engine.handle('ponder on')
+        assert engine.thread is None and engine.root.parent_edge.N == 64
+        # a move leaves the kept subtree below the cap, and pondering resumes
+        engine.handle('move e3-d3')
+        assert engine.thread is not None and engine.thread.name == 'ponder'
+        engine.thread.join(timeout=60)
+        assert engine.root.parent_edge.N == 64
+        assert not lines
+    finally:
+        engine.handle('quit')
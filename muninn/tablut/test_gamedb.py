@@ -0,0 +1,88 @@
+import collections
+import os
+import random
+
+from game import Board
+from gamedb import GameDatabase, OpeningBook
+from testing import random_games
+
+# shared first moves, so positions recur across games
+OPENINGS = ([], [(22, 21)], [(22, 21), (3, 2)])
+
+def book_games(count, seed=0):
+    """
+    Returns count (winner, moves) games of random moves sharing their first moves.
+    """
+    rng = random.Random(seed)
+    return [(rng.choice((Board.WHITE, Board.BLACK, None)), moves)
+            for moves in random_games(count, seed=seed, openings=OPENINGS)]
+
+def build(tmp_path, games):
+    return GameDatabase.build(games, os.path.join(tmp_path, 'db'), {'source': 'test'})
+
+def test_games_round_trip(tmp_path):
+    games = book_games(12)
+    # an illegal move ends a game where it is
+    games.append((Board.WHITE, [(22, 21), (22, 21)]))
+    database = build(tmp_path, games)
+    assert len(database) == len(games)
+    assert database.manifest['rejected_games'] == 1 and database.manifest['source'] == 'test'
+    for i, (_, moves) in enumerate(games[:-1]):
+        assert database.game_moves(i) == moves
+    assert database.game_moves(len(games) - 1) == [(22, 21)]
+    # reopening reads the same arrays
+    assert len(GameDatabase(database.directory).moves) == len(database.moves)
+
+def test_position_stats_match_replay(tmp_path):
+    games = book_games(12)
+    database = build(tmp_path, games)
+    # count every position's moves and results by replaying the games
+    counted = collections.defaultdict(lambda: {'moves': collections.Counter(), 'results': collections.Counter()})
+    b = Board()
+    for winner, moves in games:
+        b.set_starting_position()
+        for move in moves:
+            entry = counted[b.zobrist_hash]
+            entry['moves'][move] += 1
+            entry['results'][winner] += 1
+            b.apply_move(move)
+    for winner, moves in games:
+        b.set_starting_position()
+        for move in moves:
+            stats = database.position_stats(b)
+            entry = counted[b.zobrist_hash]
+            assert dict(stats['moves']) == dict(entry['moves'])
+            assert stats['occurrences'] == sum(entry['moves'].values())
+            assert stats['white_wins'] == entry['results'][Board.WHITE]
+            assert stats['black_wins'] == entry['results'][Board.BLACK]
+            assert stats['unfinished'] == entry['results'][None]
+            counts = [count for _, count in stats['moves']]
+            assert counts == sorted(counts, reverse=True)
+            b.apply_move(move)
+
+def test_opening_book(tmp_path):
+    games = book_games(12)
+    database = build(tmp_path, games)
+    b = Board()
+    b.set_starting_position()
+    book = OpeningBook(database, max_plies=2, min_games=3)
+    frequencies = book.lookup(b)
+    played = collections.Counter(moves[0] for _, moves in games)
+    assert frequencies == {move: count / len(games) for move, count in played.items()}
+    # 8 games open with (22, 21), 4 of them answering (3, 2)
+    assert frequencies[(22, 21)] >= 8 / 12
+    b.apply_move((22, 21))
+    assert book.lookup(b)[(3, 2)] >= 4 / 8
+    b.apply_move((3, 2))
+    # past max_plies
+    assert book.lookup(b) is None
+    # the same position set up without its moves is just as far into the games
+    setup = Board()
+    setup.set_position(b.to_array(), b.turn)
+    assert not setup.undo_stack and setup.zobrist_hash == b.zobrist_hash
+    assert book.lookup(setup) is None
+    assert OpeningBook(database, max_plies=3, min_games=3).lookup(setup) is not None
+    b.set_starting_position()
+    assert OpeningBook(database, min_games=len(games) + 1).lookup(b) is None
+    priors = OpeningBook(database, mode='bias', weight=0.25).bias([0.5, 0.5], [(22, 21), (22, 23)], {(22, 21): 1.})
+    assert list(priors) == [0.625, 0.375]
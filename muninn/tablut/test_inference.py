@@ -0,0 +1,90 @@
+import numpy as np
+import pytest
+
+from game import Board, build_mapping_indices
+from mcts import legal_priors
+from testing import start_board
+from inference import BACKENDS, NumpyNetwork, conv, fold_batch_norm, random_weights, sample_inputs
+
+def naive_conv(x, kernel, bias):
+    """
+    'same' padded convolution as a loop over output pixels.
+    """
+    size = kernel.shape[0]
+    pad = size // 2
+    batch, rows, cols, _ = x.shape
+    padded = np.pad(x, ((0, 0), (pad, pad), (pad, pad), (0, 0)))
+    out = np.empty((batch, rows, cols, kernel.shape[-1]), dtype=np.float64)
+    for row in range(rows):
+        for col in range(cols):
+            window = padded[:, row:row + size, col:col + size, :]
+            out[:, row, col] = np.einsum('bijc,ijcf->bf', window, kernel) + bias
+    return out
+
+@pytest.mark.parametrize('size', [1, 3])
+def test_conv_matches_naive_loop(size):
+    rng = np.random.default_rng(size)
+    x = rng.standard_normal((2, 9, 9, 5)).astype(np.float32)
+    kernel = rng.standard_normal((size, size, 5, 7)).astype(np.float32)
+    bias = rng.standard_normal(7).astype(np.float32)
+    assert np.allclose(conv(x, kernel, bias), naive_conv(x, kernel, bias), atol=1e-4)
+    assert np.allclose(conv(x, kernel), naive_conv(x, kernel, 0), atol=1e-4)
+
+def test_folded_batch_norm_matches_unfolded():
+    rng = np.random.default_rng(0)
+    x = rng.standard_normal((2, 9, 9, 4)).astype(np.float32)
+    kernel = rng.standard_normal((3, 3, 4, 6)).astype(np.float32)
+    bias = rng.standard_normal(6).astype(np.float32)
+    weights = {'bn/gamma': rng.uniform(0.5, 2, 6), 'bn/beta': rng.standard_normal(6), 'bn/mean': rng.standard_normal(6),
+               'bn/variance': rng.uniform(0.5, 2, 6), 'bn/epsilon': np.float32(1e-3)}
+    for conv_bias in (bias, None):
+        y = naive_conv(x, kernel, 0 if conv_bias is None else conv_bias)
+        unfolded = ((y - weights['bn/mean']) / np.sqrt(weights['bn/variance'] + weights['bn/epsilon']) * weights['bn/gamma']
+                    + weights['bn/beta'])
+        assert np.allclose(conv(x, *fold_batch_norm(weights, 'bn/', kernel, conv_bias)), unfolded, atol=1e-4)
+
+def test_mapping_indices_invert_policy_map():
+    mapping_indices = build_mapping_indices()
+    assert sorted(mapping_indices) == sorted(np.flatnonzero(np.asarray(Board.POLICY_MAP) != -1))
+    assert all(Board.POLICY_MAP[flat] == index for index, flat in enumerate(mapping_indices))
+
+def test_numpy_network_outputs():
+    network = NumpyNetwork(random_weights(filters=16, num_residual_blocks=2))
+    x = sample_inputs(5)
+    policy, value = network.predict(x)
+    assert policy.shape == (5, Board.LEN_OUTPUT_INDEX) and policy.dtype == np.float32
+    assert value.shape == (5, 1) and np.all(np.abs(value) <= 1)
+    b = start_board()
+    moves, priors = legal_priors(b.generate_moves('index'), policy[0])
+    assert len(priors) == len(moves) and np.all(priors > 0)
+    assert priors.sum() == pytest.approx(1.)
+    # a batch gives each position the output it gets alone
+    single_policy, single_value = network.predict(x[2:3])
+    assert np.allclose(single_policy, policy[2:3], atol=1e-5) and np.allclose(single_value, value[2:3], atol=1e-5)
+
+# float16 weights and int8 weights and activations only approximate the Keras outputs
+TOLERANCES = {'tflite_float16': 5e-3, 'tflite_int8': 0.2}
+
+def test_backends_match_keras():
+    pytest.importorskip('tensorflow')
+    keras = pytest.importorskip('keras')
+    from model import create_model
+    from inference import backend_network, export_weights
+    keras.utils.set_random_seed(0)
+    model = create_model(filters=16, num_residual_blocks=2)
+    # batch norm statistics away from their initial values, so folding is exercised
+    rng = np.random.default_rng(0)
+    for layer in model.layers:
+        if isinstance(layer, keras.layers.BatchNormalization):
+            gamma, beta, mean, variance = layer.get_weights()
+            layer.set_weights([rng.uniform(0.5, 1.5, gamma.shape), rng.normal(0, 0.1, beta.shape),
+                               rng.normal(0, 0.1, mean.shape), rng.uniform(0.5, 1.5, variance.shape)])
+    x = sample_inputs(16)
+    expected_policy, expected_value = model.predict(x, verbose=0)
+    assert np.allclose(NumpyNetwork(export_weights(model)).predict(x)[0], expected_policy, atol=1e-4)
+    for backend in BACKENDS:
+        policy, value = backend_network(backend, model, calibration_positions=64).predict(x, verbose=0)
+        tolerance = TOLERANCES.get(backend, 1e-4)
+        assert policy.shape == expected_policy.shape and value.shape == expected_value.shape, backend
+        assert np.abs(policy - expected_policy).max() < tolerance, backend
+        assert np.abs(value - expected_value).max() < tolerance, backend
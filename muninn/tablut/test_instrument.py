@@ -0,0 +1,112 @@
+import json
+
+import pytest
+
+from game import Board
+from testing import CountingNetwork, new_root, start_board
+from mcts import MCTS
+from instrument import BOARD_METHODS, JsonLinesWriter, SearchStats, board_timers, tree_memory
+
+def tree_nodes(root):
+    nodes = [root]
+    for node in nodes:
+        nodes.extend(edge.child_node for edge in node.child_edges if edge.child_node is not None)
+    return nodes
+
+def test_search_report_sections():
+    b = start_board()
+    reports = []
+    stats = SearchStats(sink=reports.append)
+    network = CountingNetwork()
+    searcher = MCTS(network, iterations=64, batch_size=8, stats=stats, early_stop=False)
+    root = new_root(b)
+    searcher.search(root, b)
+    assert reports == [stats.last_report]
+    report = reports[0]
+    assert report['simulations'] == 64 and report['stop_reason'] == 'iterations'
+    assert report['turn'] == 'white' and report['ply'] == 0
+    assert report['seconds'] > 0 and report['simulations_per_second'] > 0
+    for name in ('root', 'select', 'terminal', 'leaf', 'encode', 'network', 'expand'):
+        timer = report['timers'][name]
+        assert timer['seconds'] >= 0 and timer['calls'] > 0, name
+    assert report['counters']['network_calls'] == network.calls
+    # lazily, each simulation that didn't end at a terminal or pending leaf created one edge and its node
+    counters = report['counters']
+    assert counters['edges_created'] == counters['nodes_created'] == tree_memory(root)['nodes'] - 1
+    assert counters['nodes_expanded'] == sum(not node.is_leaf() for node in tree_nodes(root))
+    batch = report['observations']['batch_size']
+    assert 0 < batch['mean'] <= batch['max'] <= 8
+    assert report['observations']['depth']['count'] == 64
+    assert report['tree'] == tree_memory(root)
+    # the next search starts from zero
+    searcher.search(new_root(b), b)
+    assert reports[1]['search'] == 1
+    assert reports[1]['counters']['network_calls'] == network.calls - report['counters']['network_calls']
+
+def test_tree_memory_counts_nodes_and_edges():
+    b = start_board()
+    searcher = MCTS(CountingNetwork(), iterations=20, early_stop=False)
+    root = new_root(b)
+    searcher.search(root, b)
+    memory = tree_memory(root)
+    edges = nodes = 0
+    stack = [root]
+    while stack:
+        node = stack.pop()
+        nodes += 1
+        for edge in node.child_edges:
+            edges += 1
+            if edge.child_node is not None:
+                stack.append(edge.child_node)
+    assert (memory['nodes'], memory['edges']) == (nodes, edges) == (21, 20)
+    assert memory['max_depth'] >= 1
+    assert memory['bytes'] > 0 and memory['bytes_per_node'] == memory['bytes'] / nodes
+    single = tree_memory(new_root(b))
+    assert (single['nodes'], single['edges'], single['max_depth']) == (1, 0, 0)
+    assert single['bytes'] == single['bytes_per_node'] > 0
+
+def test_json_lines_parse(tmp_path):
+    path = str(tmp_path / 'stats.jsonl')
+    b = start_board()
+    for _ in range(2):
+        writer = JsonLinesWriter(path)
+        searcher = MCTS(CountingNetwork(), iterations=16, stats=SearchStats(sink=writer), early_stop=False)
+        searcher.search(new_root(b), b)
+        writer.close()
+        assert writer.file.closed
+    # a second writer appends
+    with open(path) as f:
+        reports = [json.loads(line) for line in f]
+    assert [report['simulations'] for report in reports] == [16, 16]
+    assert all('tree' in report and 'timers' in report for report in reports)
+
+def test_board_timers_restore_methods():
+    stats = SearchStats()
+    b = start_board()
+    other = start_board()
+    with board_timers(stats, b):
+        assert all(name in vars(b) for name in BOARD_METHODS)
+        b.generate_moves()
+        # only the instrumented board is timed
+        other.generate_moves()
+        assert not vars(other).keys() & set(BOARD_METHODS)
+    assert not vars(b).keys() & set(BOARD_METHODS)
+    assert b.generate_moves.__func__ is Board.generate_moves
+    assert stats.timers['board.generate_moves'][1] == 1
+    assert stats.timers['board.generate_moves'][0] >= 0
+
+    with pytest.raises(RuntimeError):
+        with board_timers(stats, b, methods=('apply_move',)):
+            assert 'apply_move' in vars(b)
+            raise RuntimeError
+    assert not vars(b).keys() & set(BOARD_METHODS)
+
+def test_board_timers_time_a_search():
+    b = start_board()
+    stats = SearchStats()
+    searcher = MCTS(CountingNetwork(), iterations=32, batch_size=8, stats=stats, early_stop=False)
+    with board_timers(stats, b):
+        searcher.search(new_root(b), b)
+    timers = stats.last_report['timers']
+    assert timers['board.apply_move']['calls'] == timers['board.undo_move']['calls'] > 0
+    assert timers['board.history']['calls'] > 0
@@ -0,0 +1,330 @@
+import random
+
+import numpy as np
+import pytest
+
+from game import Board
+from testing import CountingNetwork, FixedNetwork, UniformNetwork, new_root, start_board
+from mcts import MCTS, EvaluationCache, Edge, Node
+from solver import Solver
+
+def tree_edges(root):
+    """
+    Returns every edge reachable from root, its parent edge first.
+    """
+    edges = [root.parent_edge]
+    nodes = [root]
+    while nodes:
+        node = nodes.pop()
+        for edge in node.child_edges:
+            edges.append(edge)
+            if edge.child_node is not None:
+                nodes.append(edge.child_node)
+    return edges
+
+def expanded_root(searcher, b):
+    root = new_root(b)
+    moves, priors, _ = searcher.evaluate(b)
+    root.set_children(moves, priors)
+    return root
+
+@pytest.mark.parametrize('batch_size', [1, 8, 32])
+def test_batch_backup_leaves_no_virtual_loss(batch_size):
+    b = start_board()
+    searcher = MCTS(FixedNetwork(), iterations=200, batch_size=batch_size, virtual_loss=3, early_stop=False)
+    root = new_root(b)
+    searcher.search(root, b)
+    assert root.parent_edge.N == 201
+    # every simulation backed up the same value, so any virtual loss left behind would show in W
+    for edge in tree_edges(root)[1:]:
+        assert edge.N > 0
+        assert edge.W == 0.25 * edge.N
+        assert edge.Q == edge.W / edge.N
+    assert len(b.undo_stack) == 0
+
+def test_virtual_loss_restores_edges_exactly():
+    b = start_board()
+    searcher = MCTS(FixedNetwork(), iterations=100, early_stop=False)
+    root = new_root(b)
+    searcher.search(root, b)
+    path = searcher.select(root, b)[1]
+    while b.undo_stack:
+        b.undo_move()
+    edges = tree_edges(root)
+    before = [(edge.N, edge.W, edge.Q) for edge in edges]
+    searcher.add_virtual_loss(path, 3)
+    assert [edge.N for edge in path] == [before[edges.index(edge)][0] + 3 for edge in path]
+    searcher.add_virtual_loss(path, -3)
+    assert [(edge.N, edge.W, edge.Q) for edge in edges] == before
+
+def test_collision_ends_batch():
+    b = start_board()
+    network = FixedNetwork()
+    # without virtual loss nothing steers the second selection away from the pending leaf
+    searcher = MCTS(network, batch_size=8, virtual_loss=0)
+    root = expanded_root(searcher, b)
+    assert searcher.run_batch(root, b, 8) == 1
+    assert network.calls == 2
+    assert root.parent_edge.N == 2
+
+def test_leaf_batch_is_one_predict_call():
+    b = start_board()
+    network = FixedNetwork()
+    searcher = MCTS(network, batch_size=8)
+    root = expanded_root(searcher, b)
+    assert searcher.run_batch(root, b, 8) == 8
+    assert network.calls == 2
+    assert root.parent_edge.N == 9
+    assert len(b.undo_stack) == 0
+
+def test_batch_of_one_matches_unbatched_search():
+    b = start_board()
+    random.seed(0)
+    batched = MCTS(FixedNetwork(), iterations=150, batch_size=1, early_stop=False)
+    batched_root = new_root(b)
+    batched.search(batched_root, b)
+
+    random.seed(0)
+    unbatched = MCTS(FixedNetwork())
+    root = expanded_root(unbatched, b)
+    for _ in range(150):
+        leaf, path = unbatched.select(root, b)
+        unbatched.expand_and_evaluate(leaf, path, b)
+        while b.undo_stack:
+            b.undo_move()
+    visits = lambda node: {edge.move: edge.N for edge in node.child_edges}
+    assert visits(batched_root) == visits(root)
+    assert [edge.N for edge in tree_edges(batched_root)] == [edge.N for edge in tree_edges(root)]
+
+@pytest.mark.parametrize('batch_size', [1, 8])
+def test_iteration_budget_is_exact(batch_size):
+    b = start_board()
+    searcher = MCTS(UniformNetwork(), iterations=50, batch_size=batch_size, early_stop=False)
+    root = new_root(b)
+    move_probs = searcher.search(root, b)
+    assert searcher.simulations == 50
+    assert searcher.stop_reason == 'iterations'
+    assert root.parent_edge.N == 51
+    assert sum(visits for _, _, visits, _ in move_probs) == 50
+
+def test_search_needs_a_budget():
+    b = start_board()
+    with pytest.raises(ValueError):
+        MCTS(UniformNetwork(), iterations=None).search(new_root(b), b)
+
+def test_single_legal_move_is_not_searched():
+    board_array = np.zeros(81, dtype=int)
+    board_array[0] = Board.BLACK
+    board_array[[1, 18]] = Board.WHITE
+    board_array[Board.CASTLE] = Board.KING
+    b = Board()
+    b.set_position(board_array.reshape(9, 9), Board.BLACK)
+    network = CountingNetwork()
+    searcher = MCTS(network, iterations=100)
+    root = new_root(b)
+    assert searcher.search(root, b) == [((0, 9), 1.0, 0, 0)]
+    assert searcher.stop_reason == 'forced'
+    assert searcher.simulations == 0
+    assert network.calls == 0
+    assert root.is_leaf()
+
+def sparse_board(pieces, turn):
+    """
+    Returns a board with pieces, a {square: piece} dict, on it and the castle vacated.
+    """
+    board_array = np.zeros(81, dtype=int)
+    board_array[Board.CASTLE] = Board.EMPTY_CASTLE
+    for sq, piece in pieces.items():
+        board_array[sq] = piece
+    b = Board()
+    b.set_position(board_array.reshape(9, 9), turn)
+    return b
+
+def test_solver_backs_up_solved_leaves():
+    # the King has open lines to the top and left edges, and no Black move closes both
+    b = sparse_board({20: Board.KING, 51: Board.WHITE, 44: Board.BLACK, 69: Board.BLACK, 77: Board.BLACK}, Board.BLACK)
+    assert not b.is_terminal()[0]
+    network = CountingNetwork()
+    searcher = MCTS(network, iterations=64, batch_size=8, solver=Solver(), early_stop=False)
+    root = new_root(b)
+    searcher.search(root, b)
+    assert searcher.simulations == 64
+    # every leaf was a reply proven lost for Black, backed up as a White win without being expanded or evaluated
+    assert network.calls == 1
+    assert all(edge.Q == 1.0 and edge.W == edge.N for edge in root.child_edges)
+    assert all(edge.child_node.is_leaf() for edge in root.child_edges)
+    assert not b.undo_stack
+
+def test_forced_move_plays_proven_win():
+    # no line is open yet, but the King stepping to c3 opens two
+    b = sparse_board({29: Board.KING, 51: Board.WHITE, 2: Board.BLACK, 27: Board.BLACK, 35: Board.BLACK,
+                      74: Board.BLACK}, Board.WHITE)
+    assert b.is_winning_move() is None
+    assert MCTS(UniformNetwork(), iterations=100).forced_move(b) is None
+    network = CountingNetwork()
+    searcher = MCTS(network, iterations=100, solver=Solver())
+    assert searcher.forced_move(b) == ((29, 20), 1.0)
+    move_probs = searcher.search(new_root(b), b)
+    assert [move for move, prob, _, _ in move_probs if prob] == [(29, 20)]
+    assert searcher.stop_reason == 'forced' and searcher.simulations == 0
+    assert network.calls == 0
+
+def test_is_decided():
+    b = start_board()
+    searcher = MCTS(UniformNetwork())
+    root = expanded_root(searcher, b)
+    for visits in (10, 3, 1):
+        root.add_child().N = visits
+    assert searcher.is_decided(root, 6)
+    assert not searcher.is_decided(root, 7)
+
+def test_early_stop_when_lead_exceeds_budget():
+    b = start_board()
+    network = FixedNetwork(value=0.)
+    # one move takes almost all the prior, so its lead soon outgrows the simulations left
+    network.logits[:] = 0.
+    network.logits[Board.MOVE_TO_INDEX[b.generate_moves()[0]]] = 20.
+    searcher = MCTS(network, iterations=100)
+    root = new_root(b)
+    searcher.search(root, b)
+    assert searcher.stop_reason == 'decided'
+    assert searcher.simulations < 100
+    visits = sorted(edge.N for edge in root.child_edges)
+    assert visits[-1] - (visits[-2] if len(visits) > 1 else 0) > 100 - searcher.simulations
+    searcher = MCTS(network, iterations=100, early_stop=False)
+    searcher.search(new_root(b), b)
+    assert searcher.simulations == 100
+
+def subtree_nodes(root):
+    return {id(edge.child_node) for edge in tree_edges(root)[1:] if edge.child_node is not None}
+
+def test_advance_keeps_child_subtree():
+    b = start_board()
+    searcher = MCTS(FixedNetwork(), iterations=300, early_stop=False)
+    old_root = searcher.new_root(b)
+    searcher.search(old_root, b)
+    edge = max(old_root.child_edges, key=lambda edge: edge.N)
+    child = edge.child_node
+    siblings = [sibling.child_node for sibling in old_root.child_edges if sibling is not edge]
+    stats = (edge.N, edge.W, edge.Q)
+    child_edges = list(child.child_edges)
+    subtree = subtree_nodes(child)
+    move = Board.INDEX_TO_MOVE[edge.move]
+    b.apply_move(move)
+    root = searcher.advance(move, b)
+    assert root is child is searcher.root_node
+    assert (root.parent_edge.N, root.parent_edge.W, root.parent_edge.Q) == stats
+    assert root.parent_edge.parent_node is None
+    assert root.child_edges == child_edges
+    assert subtree_nodes(root) == subtree
+    # the old root no longer holds its edges, and nothing under the new root leads back to a sibling
+    assert old_root.child_edges == []
+    assert not subtree & {id(sibling) for sibling in siblings}
+    # searching on from the kept subtree adds to its visits
+    searcher.search(root, b)
+    assert root.parent_edge.N == stats[0] + 300
+
+def test_advance_falls_back_to_new_root():
+    b = start_board()
+    searcher = MCTS(FixedNetwork(), iterations=50, early_stop=False)
+    root = searcher.new_root(b)
+    searcher.search(root, b)
+    # a legal move the search never created an edge for
+    unknown = Board.INDEX_TO_MOVE[int(root.moves[-1])]
+    assert root.moves[-1] not in [edge.move for edge in root.child_edges]
+    b.apply_move(unknown)
+    fresh = searcher.advance(unknown, b)
+    assert fresh.is_leaf() and fresh.parent_edge.N == 1 and fresh.turn == b.turn
+    b.undo_move()
+
+    # an edge whose node was never expanded
+    root = searcher.new_root(b)
+    moves, priors, _ = searcher.evaluate(b)
+    root.set_children(moves, priors)
+    edge = root.add_child()
+    edge.child_node = searcher.new_node(edge, b)
+    edge.N = 1
+    move = Board.INDEX_TO_MOVE[edge.move]
+    b.apply_move(move)
+    fresh = searcher.advance(move, b)
+    assert fresh is not edge.child_node
+    assert fresh.is_leaf() and fresh.parent_edge.N == 1
+
+    # nothing searched yet
+    searcher.root_node = None
+    assert searcher.advance(move, b).parent_edge.N == 1
+
+def test_cache_counts_hits_and_misses():
+    cache = EvaluationCache()
+    assert cache.get(1) is None
+    cache.put(1, [(0, 1)], np.ones(1), 0.5)
+    assert cache.get(1) == ([(0, 1)], np.ones(1), 0.5)
+    assert cache.stats() == {'size': 1, 'hits': 1, 'misses': 1, 'evictions': 0, 'hit_rate': 0.5}
+
+def test_cache_evicts_least_recently_used():
+    cache = EvaluationCache(max_size=2)
+    cache.put(1, [], [], 1.)
+    cache.put(2, [], [], 2.)
+    # reading 1 makes 2 the least recently used
+    cache.get(1)
+    cache.put(3, [], [], 3.)
+    assert list(cache.entries) == [1, 3]
+    assert cache.evictions == 1
+    assert cache.get(2) is None
+
+def test_search_checks_cache_before_network():
+    b = start_board()
+    network = FixedNetwork()
+    cache = EvaluationCache()
+    searcher = MCTS(network, iterations=100, cache=cache, early_stop=False)
+    searcher.search(new_root(b), b)
+    # every network evaluation followed a miss
+    assert network.calls == cache.misses == len(cache.entries)
+    calls = network.calls
+    searcher.search(new_root(b), b)
+    # the second search revisits the same positions first, so it starts off the cache
+    assert cache.hits > 0
+    assert network.calls - calls < calls
+
+def test_transposed_move_orders_share_a_node():
+    b = start_board()
+    searcher = MCTS(FixedNetwork(), transpositions=True)
+    # White's last move is made from a node with White to move
+    parent = Node(None, Board.WHITE)
+    nodes = []
+    for moves in ([(22, 21), (3, 2), (58, 59), (77, 78), (31, 30)], [(58, 59), (3, 2), (22, 21), (77, 78), (31, 30)]):
+        for move in moves:
+            b.apply_move(move)
+        nodes.append(searcher.new_node(Edge(moves[-1], parent), b))
+        hash_ = b.zobrist_hash
+        while b.undo_stack:
+            b.undo_move()
+    assert nodes[0] is nodes[1]
+    assert nodes[0].turn == Board.BLACK
+    assert searcher.transposition_hits == 1
+    assert list(searcher.transpositions) == [(hash_, 1)]
+
+def test_lazy_expansion_creates_nodes_on_first_selection():
+    b = start_board()
+    searcher = MCTS(FixedNetwork(), iterations=60, lazy_expansion=True, early_stop=False)
+    root = new_root(b)
+    searcher.search(root, b)
+    nodes = [root] + [edge.child_node for edge in tree_edges(root)[1:]]
+    expanded = [node for node in nodes if not node.is_leaf()]
+    # each edge was created by the selection that first picked it, so its node exists and was visited
+    for node in expanded:
+        assert node.next_child == len(node.child_edges)
+        for edge in node.child_edges:
+            assert edge.child_node is not None and edge.N > 0
+        assert [edge.move for edge in node.child_edges] == list(node.moves[:node.next_child])
+    # 60 simulations can't have visited every move, the rest have neither edge nor node
+    assert root.next_child < len(root.moves)
+    assert sum(len(node.moves) - node.next_child for node in expanded) > 0
+    # at most one node per simulation
+    assert len(nodes) <= 61
+
+    eager = MCTS(FixedNetwork(), iterations=60, lazy_expansion=False, early_stop=False)
+    root = new_root(b)
+    eager.search(root, b)
+    assert root.next_child == len(root.moves) == len(root.child_edges)
+    assert all(edge.child_node is not None for edge in root.child_edges)
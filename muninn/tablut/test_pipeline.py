@@ -0,0 +1,67 @@
+import queue
+import threading
+
+import numpy as np
+
+from inference import random_weights
+from pipeline import CheckpointStore, Trainer, worker_loop
+from replay import ReplayBuffer
+from testing import make_game
+
+class StubModel():
+    """
+    Stands in for the Keras model in Trainer, drawing the batches fit would train on.
+    """
+    def __init__(self):
+        self.steps = 0
+
+    def fit(self, batches, steps_per_epoch, epochs=1, verbose=0):
+        for _ in range(steps_per_epoch * epochs):
+            x, (policy, value) = next(batches)
+            assert len(x) == len(policy) == len(value)
+        self.steps += steps_per_epoch * epochs
+
+def test_trainer_respects_sample_reuse(tmp_path):
+    rng = np.random.default_rng(0)
+    model = StubModel()
+    trainer = Trainer(model, ReplayBuffer(str(tmp_path), shard_size=16), batch_size=8, steps_per_round=3,
+                      min_positions=20, max_sample_reuse=2.)
+    trainer.add_game(make_game(rng, 12, 0))
+    # below min_positions nothing trains
+    assert trainer.available_steps() == 0
+    trainer.add_game(make_game(rng, 12, 100))
+    assert trainer.available_steps() == 3
+    while steps := trainer.available_steps():
+        trainer.train(steps)
+    # 24 positions sampled at most twice each on average, in batches of 8
+    assert trainer.steps == model.steps == 6
+    trainer.add_game(make_game(rng, 4, 200))
+    assert trainer.available_steps() == 1
+
+def publish_weights(checkpoints, seed):
+    number = 0 if checkpoints.latest() is None else checkpoints.latest() + 1
+    np.savez(checkpoints.path(number, '.npz'), **random_weights(filters=8, num_residual_blocks=1, seed=seed))
+    checkpoints.set_latest(number)
+    return number
+
+def test_worker_loads_newer_checkpoint_between_games(tmp_path):
+    checkpoints = CheckpointStore(str(tmp_path))
+    publish_weights(checkpoints, 0)
+    game_queue = queue.Queue(maxsize=2)
+    stop_event = threading.Event()
+    worker = threading.Thread(target=worker_loop, args=(3, str(tmp_path), game_queue, stop_event, 'numpy',
+                                                        {'iterations': 4}, 0, 0.05))
+    worker.start()
+    try:
+        worker_id, checkpoint, game = game_queue.get(timeout=60)
+        assert (worker_id, checkpoint) == (3, 0)
+        assert len(game[0]) == len(game[1]) == len(game[2]) > 0
+        publish_weights(checkpoints, 1)
+        # the game under way when checkpoint 1 appeared still comes from checkpoint 0, later ones don't
+        seen = [game_queue.get(timeout=60)[1] for _ in range(3)]
+        assert seen[-1] == 1
+        assert seen == sorted(seen)
+    finally:
+        stop_event.set()
+        worker.join(timeout=60)
+    assert not worker.is_alive()
@@ -0,0 +1,58 @@
+import numpy as np
+import pytest
+
+from replay import ReplayBuffer
+from testing import make_game
+
+def test_decode_round_trip(tmp_path):
+    rng = np.random.default_rng(0)
+    buffer = ReplayBuffer(str(tmp_path), shard_size=4, window_games=10)
+    games = [make_game(rng, 3, 10 * i) for i in range(3)]
+    for game in games:
+        buffer.add_game(*game)
+    buffer.flush()
+    shard_ids, positions = buffer.window()
+    x, (policy, value) = buffer.decode(shard_ids, positions)
+    expected_x = np.concatenate([game[0] for game in games])
+    expected_policy = np.concatenate([game[1] for game in games])
+    expected_value = np.concatenate([game[2] for game in games])
+    order = np.argsort(value)
+    assert np.array_equal(value[order], expected_value)
+    assert np.array_equal(x[order], expected_x)
+    assert np.allclose(policy[order], expected_policy)
+
+def test_window_drops_old_games(tmp_path):
+    rng = np.random.default_rng(1)
+    buffer = ReplayBuffer(str(tmp_path), shard_size=4, window_games=2)
+    for i in range(5):
+        buffer.add_game(*make_game(rng, 4, 10 * i))
+    buffer.flush()
+    _, (_, value) = buffer.decode(*buffer.window())
+    assert sorted(value) == [30, 31, 32, 33, 40, 41, 42, 43]
+    assert len(buffer.shards) == 2
+    reopened = ReplayBuffer(str(tmp_path), shard_size=4, window_games=2)
+    assert len(reopened) == 8
+
+def test_batches_survive_eviction(tmp_path):
+    rng = np.random.default_rng(2)
+    buffer = ReplayBuffer(str(tmp_path), shard_size=4, window_games=2)
+    buffer.add_game(*make_game(rng, 4, 0))
+    buffer.add_game(*make_game(rng, 4, 10))
+    batches = buffer.batches(batch_size=2, shuffle=False, repeat=True)
+    seen = list(next(batches)[1][1])
+    # these games push both shards of the pass in progress out of the window
+    for i in range(2, 5):
+        buffer.add_game(*make_game(rng, 4, 10 * i))
+    for _ in range(3):
+        seen.extend(next(batches)[1][1])
+    assert seen == [0, 1, 2, 3, 10, 11, 12, 13]
+    # the next pass reads the new window
+    assert sorted(np.concatenate([next(batches)[1][1] for _ in range(4)])) == [30, 31, 32, 33, 40, 41, 42, 43]
+
+def test_batches_need_a_full_batch(tmp_path):
+    rng = np.random.default_rng(3)
+    buffer = ReplayBuffer(str(tmp_path), shard_size=4, window_games=2)
+    buffer.add_game(*make_game(rng, 3, 0))
+    buffer.flush()
+    with pytest.raises(ValueError):
+        next(buffer.batches(batch_size=4, repeat=True))
@@ -0,0 +1,18 @@
+import pytest
+
+from testing import UniformNetwork
+from selfplay import SelfPlay
+
+def failing_model():
+    raise ValueError('model failed to load')
+
+def test_games_from_workers():
+    self_play = SelfPlay(UniformNetwork, num_workers=2, iterations=8, batch_size=4, poll_interval=0.2)
+    positions, policies, values = self_play.run(2)
+    assert len(positions) == len(policies) == len(values) > 0
+    assert self_play.stats['positions'] >= self_play.stats['predict_calls'] > 0
+
+def test_dead_inference_process_raises():
+    self_play = SelfPlay(failing_model, num_workers=2, iterations=8, batch_size=4, poll_interval=0.2)
+    with pytest.raises(RuntimeError, match='inference process exited'):
+        self_play.run(2)
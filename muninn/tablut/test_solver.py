@@ -0,0 +1,55 @@
+import random
+
+from game import Board
+from solver import Solver
+from testing import start_board
+
+def forces_win(b, side, plies):
+    """
+    Brute force: whether side wins from b, not terminal, within plies plies whatever the other side plays.
+    """
+    if plies <= 0:
+        return False
+    moves = b.generate_moves()
+    if b.turn != side and not moves:
+        return True
+    results = []
+    for move in moves:
+        b.apply_move(move)
+        terminal, winner = b.is_terminal()
+        results.append((terminal and winner == side) or (not terminal and forces_win(b, side, plies - 1)))
+        b.undo_move()
+        if results[-1] == (b.turn == side):
+            break
+    return any(results) if b.turn == side else all(results)
+
+def test_solved_positions_are_forced():
+    solver = Solver(max_plies=3)
+    proven = 0
+    for seed in range(12):
+        rng = random.Random(seed)
+        b = Board()
+        b.set_starting_position()
+        while not b.is_terminal()[0]:
+            result = solver.solve(b)
+            if result is not None:
+                proven += 1
+                winner, move, plies = result
+                assert forces_win(b, winner, plies)
+                if move is not None:
+                    assert winner == b.turn
+                    b.apply_move(move)
+                    terminal, move_winner = b.is_terminal()
+                    assert (terminal and move_winner == winner) or forces_win(b, winner, plies - 1)
+                    b.undo_move()
+            b.apply_move(rng.choice(sorted(b.generate_moves())))
+    assert proven > 0
+
+def test_cache_repeats_results():
+    solver = Solver()
+    b = start_board()
+    assert solver.solve(b) is None
+    assert solver.solve(b) is None
+    assert (solver.hits, solver.misses) == (1, 1)
+    solver.clear()
+    assert not solver.entries
@@ -0,0 +1,43 @@
+import numpy as np
+
+from game import Board, LEN_ROW, NUM_SQUARES
+from testing import random_board
+from symmetry import (INVERSE, NUM_SYMMETRIES, SQUARE_SOURCE, CanonicalHashing, transform_board, transform_move,
+                      transform_policy)
+
+def transformed_board(b, k):
+    t = Board(b.zobrist)
+    t.set_position(transform_board(b.to_array(), k), b.turn)
+    return t
+
+def test_inverse_round_trip():
+    array = np.arange(NUM_SQUARES).reshape(LEN_ROW, LEN_ROW)
+    planes = np.arange(NUM_SQUARES * 3).reshape(LEN_ROW, LEN_ROW, 3)
+    policy = np.arange(Board.LEN_OUTPUT_INDEX)
+    for k in range(NUM_SYMMETRIES):
+        assert (transform_board(transform_board(array, k), INVERSE[k]) == array).all()
+        assert (transform_board(transform_board(planes, k), INVERSE[k]) == planes).all()
+        assert (transform_policy(transform_policy(policy, k), INVERSE[k]) == policy).all()
+        assert (transform_board(array, k).reshape(-1) == SQUARE_SOURCE[k]).all()
+    # the 8 symmetries are distinct
+    assert len({tuple(SQUARE_SOURCE[k]) for k in range(NUM_SYMMETRIES)}) == NUM_SYMMETRIES
+
+def test_moves_and_policy_follow_the_board():
+    for seed in range(5):
+        b = random_board(seed)
+        mask = b.generate_moves('mask')
+        for k in range(NUM_SYMMETRIES):
+            t = transformed_board(b, k)
+            assert set(t.generate_moves()) == {transform_move(move, k) for move in b.generate_moves()}
+            assert (t.generate_moves('mask') == transform_policy(mask, k)).all()
+            assert t.is_terminal() == b.is_terminal()
+
+def test_canonical_hash_shared_by_symmetries():
+    hashing = CanonicalHashing(Board().zobrist)
+    for seed in range(5):
+        b = random_board(seed)
+        canonical, k = hashing.canonical_hash(b)
+        # symmetry k of the position has the canonical hash as its plain Zobrist hash
+        assert transformed_board(b, k).zobrist_hash == canonical
+        for j in range(NUM_SYMMETRIES):
+            assert hashing.canonical_hash(transformed_board(b, j))[0] == canonical
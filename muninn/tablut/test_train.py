@@ -0,0 +1,114 @@
+import numpy as np
+import pytest
+
+tf = pytest.importorskip('tensorflow')
+keras = pytest.importorskip('keras')
+
+import dataset
+from game import Board
+from encoder import HISTORY_LENGTH, num_planes
+from replay import ReplayBuffer
+from symmetry import NUM_SYMMETRIES, transform_board, transform_policy
+from train import (ReplayShards, SupervisedShards, Throughput, decode_batch, learning_rate_schedule,
+                   mixed_precision_copy, scaled_learning_rate, train)
+from model import create_model
+from testing import csv_games, write_games_csv
+
+def test_throughput_counts_steps_per_execution():
+    model = keras.Sequential([keras.Input((4,)), keras.layers.Dense(1)])
+    model.compile('sgd', 'mse', steps_per_execution=4)
+    throughput = Throughput(batch_size=8, verbose=False)
+    x = np.zeros((8 * 12, 4), dtype=np.float32)
+    model.fit(x, x[:, :1], batch_size=8, epochs=1, callbacks=[throughput], verbose=0)
+    # Keras calls back after steps 3, 7 and 11. Timing starts after the first call, leaving 8 steps
+    assert (throughput.first_batch, throughput.last_batch) == (3, 11)
+    assert throughput.samples() == 8 * 8
+    assert len(throughput.rates) == 1
+
+def replay_source(directory, length=24):
+    rng = np.random.default_rng(0)
+    buffer = ReplayBuffer(str(directory), shard_size=64)
+    positions = rng.integers(0, 2, (length, 9, 9, num_planes(HISTORY_LENGTH))).astype(np.float32)
+    positions[..., -1] = 1
+    policies = np.full((length, Board.LEN_OUTPUT_INDEX), -1.)
+    for i in range(length):
+        legal = rng.choice(Board.LEN_OUTPUT_INDEX, 4, replace=False)
+        # exact in float16, as the shuffle buffer holds policies
+        policies[i, legal] = [0.5, 0.25, 0.25, 0.]
+    buffer.add_game(positions, policies, np.linspace(-1, 1, length))
+    buffer.flush()
+    return buffer, ReplayShards(str(directory))
+
+def test_decode_batch_matches_replay_decode(tmp_path):
+    buffer, source = replay_source(tmp_path)
+    planes, policy, values = source.load(0)
+    expected_x, (expected_policy, expected_values) = buffer.decode(*buffer.window())
+    x, (decoded_policy, decoded_values) = decode_batch(planes, policy, values, augment=False)
+    assert np.array_equal(x.numpy(), expected_x)
+    assert np.array_equal(decoded_policy.numpy(), expected_policy)
+    assert np.array_equal(np.asarray(decoded_values), expected_values)
+
+def test_decode_batch_applies_each_positions_symmetry(tmp_path):
+    buffer, source = replay_source(tmp_path)
+    planes, policy, values = source.load(0)
+    expected_x, (expected_policy, _) = buffer.decode(*buffer.window())
+    symmetries = np.arange(len(values)) % NUM_SYMMETRIES
+    x, (decoded_policy, _) = decode_batch(planes, policy, values, symmetries=tf.constant(symmetries, dtype=tf.int32))
+    for i, k in enumerate(symmetries):
+        assert np.array_equal(x[i].numpy(), transform_board(expected_x[i], k))
+        assert np.array_equal(decoded_policy[i].numpy(), transform_policy(expected_policy[i], k))
+
+def test_decode_batch_matches_supervised_targets(tmp_path):
+    csv_path = tmp_path / 'games.csv'
+    write_games_csv(csv_path, csv_games(4))
+    source = SupervisedShards(dataset.build_dataset(str(csv_path), str(tmp_path / 'shards'), processes=1))
+    arrays = dataset.load_shards(source.directory)
+    planes, policy, values = source.load(0)
+    x, (decoded_policy, decoded_values) = decode_batch(planes, policy, values, augment=False)
+    count = len(values)
+    assert np.array_equal(x.numpy(), dataset.decode_planes(arrays['planes'][:count]))
+    expected_policy = dataset.policy_targets(arrays['legal'][:count], arrays['moves'][:count])
+    assert np.array_equal(decoded_policy.numpy(), expected_policy)
+    assert np.array_equal(np.asarray(decoded_values), arrays['values'][:count])
+
+def test_learning_rate_schedule_endpoints():
+    assert scaled_learning_rate(4096) == pytest.approx(0.2)
+    assert scaled_learning_rate(1024) == pytest.approx(0.05)
+    schedule = learning_rate_schedule(0.1, total_steps=100, warmup_steps=10)
+    rate = lambda step: float(schedule(step))
+    assert rate(0) == pytest.approx(0.)
+    assert rate(5) == pytest.approx(0.05)
+    assert rate(10) == pytest.approx(0.1)
+    assert rate(10) > rate(50) > rate(90)
+    assert rate(100) == pytest.approx(0., abs=1e-7)
+    schedule = learning_rate_schedule(0.1, total_steps=100, warmup_steps=0)
+    assert float(schedule(0)) == pytest.approx(0.1)
+    assert float(schedule(100)) == pytest.approx(0., abs=1e-7)
+
+def test_mixed_precision_copy():
+    model = create_model(filters=8, num_residual_blocks=1)
+    try:
+        mixed = mixed_precision_copy(model)
+        for weights, mixed_weights in zip(model.get_weights(), mixed.get_weights()):
+            assert mixed_weights.dtype == weights.dtype
+            assert np.array_equal(mixed_weights, weights)
+        compute_dtypes = {layer.name: layer.compute_dtype for layer in mixed.layers if layer.weights}
+        assert compute_dtypes.pop('value_head') == 'float32'
+        assert set(compute_dtypes.values()) == {'float16'}
+        assert all(variable.dtype == 'float32' for variable in mixed.trainable_variables)
+        x = np.random.default_rng(0).integers(0, 2, (2, 9, 9, 49)).astype(np.float32)
+        policy, value = mixed(x)
+        assert policy.dtype == value.dtype == 'float32'
+        expected_policy, expected_value = model(x)
+        assert np.allclose(policy, expected_policy, atol=0.05)
+        assert np.allclose(value, expected_value, atol=0.05)
+    finally:
+        keras.mixed_precision.set_global_policy('float32')
+
+def test_train_runs_from_replay_shards(tmp_path):
+    _, source = replay_source(tmp_path, 48)
+    model, history, throughput = train(create_model(filters=8, num_residual_blocks=1), source, batch_size=8, epochs=2,
+                                       steps_per_execution=2, shuffle_buffer=64, verbose=False)
+    assert len(history.history['loss']) == 2
+    assert all(np.isfinite(history.history['loss']))
+    assert len(throughput.rates) == 2 and history.history['samples_per_second'] == throughput.rates
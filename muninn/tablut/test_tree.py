@@ -0,0 +1,46 @@
+import numpy as np
+import pytest
+
+from testing import CountingNetwork, FixedNetwork, start_board
+from tree import ArrayMCTS
+
+@pytest.mark.parametrize('batch_size', [1, 8, 32])
+def test_visits_add_up_after_search(batch_size):
+    b = start_board()
+    searcher = ArrayMCTS(FixedNetwork(), iterations=300, batch_size=batch_size)
+    move_probs = searcher.search(b)
+    tree = searcher.tree
+    assert tree.N[0] == 301
+    assert sum(visits for _, _, visits, _ in move_probs) == 300
+    # no virtual loss left behind: every expanded node has one visit of its own plus its children's
+    for node in range(1, tree.size):
+        if not tree.is_leaf(node):
+            children = tree.children(node)
+            assert tree.N[node] == 1 + tree.N[children.start:children.stop].sum()
+    visited = tree.N[:tree.size] > 0
+    assert np.array_equal(tree.Q[:tree.size][visited], tree.W[:tree.size][visited] / tree.N[:tree.size][visited])
+    assert len(b.undo_stack) == 0
+
+def test_one_predict_per_batch():
+    network = CountingNetwork()
+    searcher = ArrayMCTS(network, iterations=64, batch_size=32)
+    searcher.search(start_board())
+    # the root expansion, then a call per batch, with at least one batch cut short by a collision
+    assert 3 <= network.calls < 64
+
+def test_backup_batch_matches_backpropagate():
+    b = start_board()
+    batched = ArrayMCTS(FixedNetwork(), iterations=200, batch_size=8)
+    batched.search(b)
+    tree = batched.tree
+    paths = [[0, 1, tree.first_child[1]] if not tree.is_leaf(1) else [0, 1], [0, 2], [0, 1]]
+    expected = [array[:tree.size].copy() for array in (tree.N, tree.W)]
+    for path, v in zip(paths, (0.5, -1., 0.25)):
+        for node in path:
+            expected[0][node] += 1
+            expected[1][node] += v
+    for path in paths:
+        batched.add_virtual_loss(path, 3)
+    batched.backup_batch(paths, [0.5, -1., 0.25], 3)
+    assert np.array_equal(tree.N[:tree.size], expected[0])
+    assert np.array_equal(tree.W[:tree.size], expected[1])
@@ -0,0 +1,235 @@
+"""
+Helpers shared by the tests and bench.py: stub networks with the model's predict layout, boards and games from random
+play, the perft positions with their known leaf counts, and the legacy Board for comparison. Imports nothing beyond
+the engine modules and NumPy, so tests don't pull in the benchmark suite or TensorFlow.
+"""
+import csv
+import importlib.util
+import os
+import random
+import time
+
+import numpy as np
+
+from game import Board, PIECE_SYMBOLS
+from encoder import HISTORY_LENGTH, num_planes
+from mcts import Edge, Node
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+LEGACY_GAME_PATH = os.path.join(HERE, '..', 'tablut_legacy', 'game.py')
+
+class UniformNetwork():
+    """
+    Stub network with the model's predict layout returning flat policy logits and a zero value, so search costs exclude
+    inference.
+    """
+    def predict(self, x, verbose=0):
+        return [np.zeros((len(x), Board.LEN_OUTPUT_INDEX), dtype=np.float32), np.zeros((len(x), 1), dtype=np.float32)]
+
+class LatencyNetwork(UniformNetwork):
+    """
+    Stub network that sleeps a fixed overhead per predict call plus a small cost per position, roughly modelling Keras
+    predict on CPU.
+    """
+    def __init__(self, call_overhead=0.02, per_position=0.0005):
+        self.call_overhead = call_overhead
+        self.per_position = per_position
+
+    def predict(self, x, verbose=0):
+        time.sleep(self.call_overhead + self.per_position * len(x))
+        return super().predict(x, verbose)
+
+class CountingNetwork(UniformNetwork):
+    """
+    Stub network counting predict calls.
+    """
+    def __init__(self):
+        self.calls = 0
+
+    def predict(self, x, verbose=0):
+        self.calls += 1
+        return super().predict(x, verbose)
+
+class FixedNetwork(CountingNetwork):
+    """
+    Stub network returning the same random policy logits and value for every position, so priors have no ties. The
+    default value is exactly representable so sums of it compare exactly.
+    """
+    def __init__(self, value=0.25, seed=0):
+        super().__init__()
+        self.logits = np.random.default_rng(seed).normal(size=Board.LEN_OUTPUT_INDEX).astype(np.float32)
+        self.value = value
+
+    def predict(self, x, verbose=0):
+        self.calls += 1
+        return [np.tile(self.logits, (len(x), 1)), np.full((len(x), 1), self.value, dtype=np.float32)]
+
+def new_root(board):
+    """
+    Returns a root node with the visited root edge MCTS expects.
+    """
+    root_edge = Edge(None, None)
+    root_edge.N = 1
+    return Node(root_edge, board.turn)
+
+def start_board():
+    b = Board()
+    b.set_starting_position()
+    return b
+
+def random_board(seed, plies=20):
+    """
+    Returns a board after up to plies random moves from the starting position, fewer if the game ends.
+    """
+    rng = random.Random(seed)
+    b = start_board()
+    for _ in range(plies):
+        if b.is_terminal()[0]:
+            break
+        b.apply_move(rng.choice(sorted(b.generate_moves())))
+    return b
+
+def random_boards(count, seed=0, max_plies=40):
+    """
+    Returns count boards, each after a random number of random moves below max_plies.
+    """
+    rng = random.Random(seed)
+    return [random_board(rng.random(), rng.randrange(max_plies)) for _ in range(count)]
+
+def random_games(count, max_plies=30, seed=0, openings=((),)):
+    """
+    Returns count games of random moves as lists of moves. Game i starts with openings[i % len(openings)], so with
+    several openings positions recur across games.
+    """
+    rng = random.Random(seed)
+    games = []
+    b = Board()
+    for i in range(count):
+        b.set_starting_position()
+        moves = list(openings[i % len(openings)])
+        for move in moves:
+            b.apply_move(move)
+        while len(moves) < max_plies and not b.is_terminal()[0]:
+            moves.append(rng.choice(sorted(b.generate_moves())))
+            b.apply_move(moves[-1])
+        games.append(moves)
+    return games
+
+def square_name(sq):
+    return f"{chr(ord('a') + sq % 9)}{sq // 9 + 1}"
+
+def move_name(move):
+    return f'{square_name(move[0])}-{square_name(move[1])}'
+
+def csv_games(count, seed=0):
+    """
+    Returns count random games as (game id, winner, moves), as the scraped games CSV holds them.
+    """
+    return [(f'game{i}', ('White', 'Black')[i % 2], moves) for i, moves in enumerate(random_games(count, 40, seed))]
+
+def write_games_csv(path, games):
+    """
+    Writes (game id, winner, moves) games in the scraped CSV format, one row per move.
+    """
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['Game_ID', 'Winner', 'Move'])
+        for game_id, winner, moves in games:
+            for move in moves:
+                writer.writerow([game_id, winner, move_name(move)])
+
+def make_game(rng, length, first_value):
+    """
+    Returns a self-play game of length random network inputs, policies and values. Values count up from first_value,
+    so each decoded position can be told apart.
+    """
+    positions = rng.integers(0, 2, (length, 9, 9, num_planes(HISTORY_LENGTH))).astype(np.float32)
+    positions[..., -1] = 1
+    policies = np.full((length, Board.LEN_OUTPUT_INDEX), -1.)
+    for i in range(length):
+        legal = rng.choice(Board.LEN_OUTPUT_INDEX, 5, replace=False)
+        policies[i, legal] = rng.dirichlet(np.ones(5))
+    values = first_value + np.arange(length, dtype=np.float32)
+    return positions, policies, values
+
+# fixed midgame positions for perft, rows top to bottom: W white, B black, K king, x vacated castle, . empty
+PERFT_POSITIONS = {
+    'start': None,
+    'midgame_black_castle_empty': ([
+        '..B.BB.B.',
+        'B..B.....',
+        '.........',
+        '...WK.BWB',
+        '...WxW..B',
+        '...B.WB..',
+        '.B..W....',
+        '....B....',
+        '..WBBB...'], Board.BLACK),
+    'midgame_white_king_out': ([
+        '..W.BB...',
+        '.B......B',
+        '....K....',
+        'BW......B',
+        'B.WWx.W.B',
+        '.....W.WB',
+        'BB....W..',
+        'B..B.....',
+        '........B'], Board.WHITE),
+    'midgame_black_king_low': ([
+        '....BB...',
+        'B.BWB.B..',
+        '.........',
+        '.B.......',
+        'B...xW.WW',
+        'BW...K..B',
+        '..W..BB.B',
+        '...B..BB.',
+        '..W......'], Board.BLACK),
+}
+
+# leaf counts at depths 1, 2, 3, depths 1 and 2 cross-checked against the notebook Board
+PERFT_EXPECTED = {
+    'start': [56, 4408, 251856],
+    'midgame_black_castle_empty': [92, 3942, 361954],
+    'midgame_white_king_out': [83, 5868, 469655],
+    'midgame_black_king_low': [87, 4649, 406190],
+}
+
+def perft_board(name):
+    """
+    Returns a Board set to the named perft position.
+    """
+    b = Board()
+    if PERFT_POSITIONS[name] is None:
+        b.set_starting_position()
+    else:
+        rows, turn = PERFT_POSITIONS[name]
+        b.set_position(np.array([[PIECE_SYMBOLS[c] for c in row] for row in rows]), turn)
+    return b
+
+def perft(b, depth):
+    """
+    Counts leaf positions depth plies ahead with make / unmake. Terminal positions end their line and count as no leaves.
+    """
+    if depth == 0:
+        return 1
+    if b.is_terminal()[0]:
+        return 0
+    nodes = 0
+    for move in list(b.generate_moves()):
+        b.apply_move(move)
+        nodes += perft(b, depth - 1)
+        b.undo_move()
+    return nodes
+
+def load_legacy_board():
+    """
+    Imports the list based Board from tablut_legacy for comparison. Returns None if it can't be imported.
+    """
+    try:
+        spec = importlib.util.spec_from_file_location('legacy_game', LEGACY_GAME_PATH)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+    except ImportError:
+        return None
+    return module.Board
@@ -0,0 +1,242 @@
+"""
+tf.data training entry point. Streams positions from stored shards, either the supervised shards dataset.py builds or
+the replay.py self-play buffer, and trains with large batches. Run from this directory:
+
+    python train.py [--source supervised|replay] [--batch-size 1024] [--mixed-precision] [--xla]
+
+The input pipeline reads whole shards in parallel, keeping positions bit-packed through the shuffle buffer, then
+batches them and decodes each batch in parallel: unpacking the planes, adding the constant plane and applying a random
+board symmetry per position. Planes unpack straight into the channels last layout, so nothing is transposed.
+Prefetching overlaps all of this with training.
+
+The learning rate scales linearly with the batch size from base_learning_rate at base_batch_size, with a linear warm-up
+so large batches start stable, then a cosine decay. Samples per second are reported every epoch.
+"""
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+import tensorflow as tf
+import keras
+
+from game import Board, LEN_ROW, NUM_SQUARES
+from encoder import HISTORY_LENGTH, STORED_PLANES, num_planes
+from symmetry import NUM_SYMMETRIES, POLICY_SOURCE, SQUARE_SOURCE
+from replay import PACKED_BYTES, ReplayBuffer
+import dataset
+from model import compile_model, create_model, load_model
+
+# compile_model's learning rate of 0.2 is AlphaZero's, for batches of 4096
+BASE_LEARNING_RATE = 0.2
+BASE_BATCH_SIZE = 4096
+# np.unpackbits order: most significant bit first
+BIT_SHIFTS = np.arange(7, -1, -1, dtype=np.uint8)
+
+class SupervisedShards():
+    """
+    Training positions from a dataset.py shard directory.
+    """
+    def __init__(self, directory):
+        self.directory = directory
+        with open(os.path.join(directory, dataset.MANIFEST_FILE)) as f:
+            manifest = json.load(f)
+        self.shards = [shard['name'] for shard in manifest['shards']]
+        self.positions = manifest['positions']
+
+    def load(self, i):
+        """
+        Returns (packed planes (N, 486) uint8, policies (N, 1296) float16, values (N,) float32) for shard i.
+        """
+        path = os.path.join(self.directory, self.shards[i])
+        arrays = {name: np.load(os.path.join(path, name + '.npy')) for name in ('planes', 'legal', 'moves', 'values')}
+        # -1, 0 and 1 are exact in float16, which halves the shuffle buffer's policy memory
+        policy = dataset.policy_targets(arrays['legal'], arrays['moves']).astype(np.float16)
+        return arrays['planes'], policy, arrays['values']
+
+class ReplayShards():
+    """
+    Training positions from the shards of a replay.py buffer that fall inside its window.
+    """
+    def __init__(self, directory):
+        self.buffer = ReplayBuffer(directory)
+        first_game = self.buffer.first_game()
+        self.shards = [shard['name'] for shard in self.buffer.shards if shard['last_game'] >= first_game]
+        self.positions = len(self.buffer)
+
+    def load(self, i):
+        """
+        Returns (packed planes (N, 486) uint8, policies (N, 1296) float16, values (N,) float32) for shard i, dense
+        policies holding -1 for illegal moves.
+        """
+        shard = self.buffer.shard(self.shards[i])
+        offsets = np.asarray(shard['policy_offsets'])
+        count = len(offsets) - 1
+        policy = np.full((count, Board.LEN_OUTPUT_INDEX), -1., dtype=np.float16)
+        policy[np.repeat(np.arange(count), np.diff(offsets)), shard['policy_index']] = shard['policy_prob']
+        keep = np.asarray(shard['games']) >= self.buffer.first_game()
+        return np.asarray(shard['planes'])[keep], policy[keep], np.asarray(shard['values'])[keep]
+
+def decode_batch(planes, policy, values, augment=True, dtype=tf.float32, symmetries=None):
+    """
+    Decodes a batch of packed positions into (x, (policy, value)) training tensors, applying a symmetry to each
+    position when augment is set. symmetries gives each position's symmetry, drawn at random when None.
+    """
+    bits = tf.bitwise.bitwise_and(tf.bitwise.right_shift(planes[..., tf.newaxis], BIT_SHIFTS), 1)
+    x = tf.reshape(tf.cast(bits, dtype), (-1, NUM_SQUARES, STORED_PLANES))
+    x = tf.concat([x, tf.ones_like(x[..., :1])], axis=-1)
+    policy = tf.cast(policy, tf.float32)
+    if augment:
+        k = symmetries
+        if k is None:
+            k = tf.random.uniform(tf.shape(values), maxval=NUM_SYMMETRIES, dtype=tf.int32)
+        x = tf.gather(x, tf.gather(SQUARE_SOURCE, k), batch_dims=1)
+        policy = tf.gather(policy, tf.gather(POLICY_SOURCE, k), batch_dims=1)
+    x = tf.reshape(x, (-1, LEN_ROW, LEN_ROW, num_planes(HISTORY_LENGTH)))
+    return x, (policy, values)
+
+def make_dataset(source, batch_size, shuffle_buffer=16384, augment=True, dtype=tf.float32, shard_parallelism=4):
+    """
+    Returns an endless tf.data pipeline of decoded training batches from source, a SupervisedShards or ReplayShards.
+    Shards are read in a new random order each pass, shard_parallelism at a time.
+    """
+    def shard_positions(i):
+        planes, policy, values = tf.numpy_function(lambda i: source.load(int(i)), [i],
+                                                   (tf.uint8, tf.float16, tf.float32), stateful=False)
+        planes.set_shape((None, PACKED_BYTES))
+        policy.set_shape((None, Board.LEN_OUTPUT_INDEX))
+        values.set_shape((None,))
+        return tf.data.Dataset.from_tensor_slices((planes, policy, values))
+
+    data = tf.data.Dataset.range(len(source.shards)).shuffle(len(source.shards), reshuffle_each_iteration=True).repeat()
+    data = data.interleave(shard_positions, cycle_length=shard_parallelism, num_parallel_calls=tf.data.AUTOTUNE,
+                           deterministic=False)
+    data = data.shuffle(shuffle_buffer).batch(batch_size, drop_remainder=True)
+    data = data.map(lambda planes, policy, values: decode_batch(planes, policy, values, augment, dtype),
+                    num_parallel_calls=tf.data.AUTOTUNE, deterministic=False)
+    return data.prefetch(tf.data.AUTOTUNE)
+
+def scaled_learning_rate(batch_size, base_learning_rate=BASE_LEARNING_RATE, base_batch_size=BASE_BATCH_SIZE):
+    """
+    Returns the learning rate for batch_size under the linear scaling rule.
+    """
+    return base_learning_rate * batch_size / base_batch_size
+
+def learning_rate_schedule(peak, total_steps, warmup_steps):
+    """
+    Returns a schedule warming up linearly from 0 to peak over warmup_steps, then decaying to 0 by total_steps.
+    """
+    if not warmup_steps:
+        return keras.optimizers.schedules.CosineDecay(peak, total_steps)
+    return keras.optimizers.schedules.CosineDecay(0., max(1, total_steps - warmup_steps), warmup_target=peak,
+                                                  warmup_steps=warmup_steps)
+
+def mixed_precision_copy(model):
+    """
+    Returns a copy of model computing in float16 with float32 weights. The policy and value heads stay float32, so the
+    losses see full precision logits and values. Sets the global dtype policy, so call before building other models.
+    """
+    keras.mixed_precision.set_global_policy('mixed_float16')
+
+    def clone(layer):
+        config = layer.get_config()
+        config['dtype'] = 'float32' if layer.name in ('policy_head', 'value_head') else 'mixed_float16'
+        return layer.__class__.from_config(config)
+    mixed = keras.models.clone_model(model, clone_function=clone)
+    mixed.set_weights(model.get_weights())
+    return mixed
+
+class Throughput(keras.callbacks.Callback):
+    """
+    Reports training samples per second for each epoch, timed from the end of its first batch so tracing and XLA
+    compilation aren't counted. Rates are kept in rates and added to the epoch logs. Steps are counted from the batch
+    indexes Keras passes, since with steps_per_execution it only calls back once every that many steps.
+    """
+    def __init__(self, batch_size, verbose=True):
+        super().__init__()
+        self.batch_size = batch_size
+        self.verbose = verbose
+        self.rates = []
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self.start = None
+        self.first_batch = self.last_batch = None
+
+    def on_train_batch_end(self, batch, logs=None):
+        if self.start is None:
+            self.start = time.perf_counter()
+            self.first_batch = batch
+        self.last_batch = batch
+
+    def samples(self):
+        """
+        Returns number of samples trained on since the end of the epoch's first batch.
+        """
+        if self.start is None:
+            return 0
+        return (self.last_batch - self.first_batch) * self.batch_size
+
+    def on_epoch_end(self, epoch, logs=None):
+        samples = self.samples()
+        if not samples:
+            return
+        rate = samples / (time.perf_counter() - self.start)
+        self.rates.append(rate)
+        if logs is not None:
+            logs['samples_per_second'] = rate
+        if self.verbose:
+            print(f"epoch {epoch + 1}: {rate:,.0f} samples/s")
+
+def train(model, source, batch_size=1024, epochs=10, warmup_epochs=1, base_learning_rate=BASE_LEARNING_RATE,
+          base_batch_size=BASE_BATCH_SIZE, mixed_precision=False, jit_compile=False, steps_per_execution=1,
+          shuffle_buffer=16384, augment=True, verbose=True):
+    """
+    Trains model on source, a SupervisedShards or ReplayShards, one epoch being one pass over its positions. Returns
+    (trained model, fit history, Throughput callback). With mixed_precision the trained model is a float16 compute
+    copy of model.
+    """
+    if mixed_precision:
+        model = mixed_precision_copy(model)
+    steps_per_epoch = max(1, source.positions // batch_size)
+    peak = scaled_learning_rate(batch_size, base_learning_rate, base_batch_size)
+    schedule = learning_rate_schedule(peak, epochs * steps_per_epoch, warmup_epochs * steps_per_epoch)
+    # Keras wraps the optimizer in a LossScaleOptimizer under the mixed_float16 policy
+    compile_model(model, schedule, jit_compile=jit_compile, steps_per_execution=steps_per_execution)
+    data = make_dataset(source, batch_size, shuffle_buffer, augment, tf.float16 if mixed_precision else tf.float32)
+    throughput = Throughput(batch_size, verbose)
+    if verbose:
+        print(f"{source.positions:,} positions, batch {batch_size}, {steps_per_epoch} steps per epoch, peak learning "
+              f"rate {peak:.4g}")
+    history = model.fit(data, epochs=epochs, steps_per_epoch=steps_per_epoch, callbacks=[throughput],
+                        verbose=2 if verbose else 0)
+    return model, history, throughput
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Train the network from stored shards with tf.data')
+    parser.add_argument('--source', choices=('supervised', 'replay'), default='supervised')
+    parser.add_argument('--data', help='shard directory (default: build the supervised shards, or ../replay_buffer)')
+    parser.add_argument('--model', help='model to continue training (default: a new network)')
+    parser.add_argument('--output', default='../saved_models/trained_model.keras')
+    parser.add_argument('--batch-size', type=int, default=1024)
+    parser.add_argument('--epochs', type=int, default=10)
+    parser.add_argument('--warmup-epochs', type=int, default=1)
+    parser.add_argument('--base-learning-rate', type=float, default=BASE_LEARNING_RATE)
+    parser.add_argument('--base-batch-size', type=int, default=BASE_BATCH_SIZE)
+    parser.add_argument('--mixed-precision', action='store_true', help='float16 compute with float32 weights')
+    parser.add_argument('--xla', action='store_true', help='compile the training step with XLA')
+    parser.add_argument('--steps-per-execution', type=int, default=1)
+    parser.add_argument('--no-augment', action='store_true')
+    args = parser.parse_args()
+
+    if args.source == 'supervised':
+        source = SupervisedShards(args.data or dataset.build_dataset())
+    else:
+        source = ReplayShards(args.data or '../replay_buffer')
+    model = load_model(args.model) if args.model else create_model()
+    model, history, throughput = train(model, source, args.batch_size, args.epochs, args.warmup_epochs,
+                                       args.base_learning_rate, args.base_batch_size, args.mixed_precision, args.xla,
+                                       args.steps_per_execution, augment=not args.no_augment)
+    model.save(args.output)
+    if throughput.rates:
+        print(f"{np.mean(throughput.rates[1:] or throughput.rates):,.0f} samples/s on average, saved {args.output}")
@@ -0,0 +1,261 @@
+"""
+Experimental struct-of-arrays search tree. ArrayMCTS is not used by self-play, the pipeline, the arena or the engine,
+which all search with mcts.MCTS: it has no evaluation cache, tree reuse, time budget, early stop, solver or opening
+book. It is kept to measure array-backed selection and batched backup against the object tree (bench.py search
+section) and may change or go away.
+"""
+import math
+import numpy as np
+from game import Board
+from encoder import Encoder
+from mcts import terminal_value
+
+class SearchTree():
+    """
+    Struct-of-arrays search tree. Statistics for every node (N, W, Q of the edge leading into it and its prior P) live in
+    preallocated NumPy arrays indexed by node id. The children of a node are the contiguous ids
+    first_child[node] : first_child[node] + num_children[node], so a node's edges are array slices.
+    """
+    def __init__(self, capacity=1 << 16):
+        self.capacity = 0
+        self.size = 0
+        self.N = np.zeros(0, dtype=np.int32)
+        self.W = np.zeros(0, dtype=np.float64)
+        self.Q = np.zeros(0, dtype=np.float64)
+        self.P = np.zeros(0, dtype=np.float32)
+        # policy index of the move leading into the node
+        self.move = np.zeros(0, dtype=np.int16)
+        self.parent = np.zeros(0, dtype=np.int32)
+        # -1 until the node is expanded
+        self.first_child = np.zeros(0, dtype=np.int32)
+        self.num_children = np.zeros(0, dtype=np.int16)
+        # side to move at the node
+        self.turn = np.zeros(0, dtype=np.int8)
+        self.grow(capacity)
+
+    ARRAYS = ('N', 'W', 'Q', 'P', 'move', 'parent', 'first_child', 'num_children', 'turn')
+
+    def grow(self, capacity):
+        """
+        Reallocates every array to hold at least capacity nodes, keeping existing nodes.
+        """
+        for name in self.ARRAYS:
+            old = getattr(self, name)
+            new = np.zeros(capacity, dtype=old.dtype)
+            new[:self.size] = old[:self.size]
+            setattr(self, name, new)
+        self.capacity = capacity
+
+    def reset(self, turn):
+        """
+        Clears the tree down to a single unexpanded root (node 0). Root starts with one visit, like the root edge in MCTS.
+        """
+        self.size = 1
+        self.N[0] = 1
+        self.W[0] = 0.
+        self.Q[0] = 0.
+        self.P[0] = 1.
+        self.move[0] = -1
+        self.parent[0] = -1
+        self.first_child[0] = -1
+        self.num_children[0] = 0
+        self.turn[0] = turn
+
+    def add_children(self, node, move_indices, priors, child_turn):
+        """
+        Allocates a contiguous block of child nodes for node, one per move index, with the given priors.
+        """
+        count = len(move_indices)
+        first = self.size
+        end = first + count
+        if end > self.capacity:
+            self.grow(max(2 * self.capacity, end))
+        self.N[first:end] = 0
+        self.W[first:end] = 0.
+        self.Q[first:end] = 0.
+        self.P[first:end] = priors
+        self.move[first:end] = move_indices
+        self.parent[first:end] = node
+        self.first_child[first:end] = -1
+        self.num_children[first:end] = 0
+        self.turn[first:end] = child_turn
+        self.first_child[node] = first
+        self.num_children[node] = count
+        self.size = end
+
+    def is_leaf(self, node):
+        """
+        Checks to see whether node has been expanded.
+        """
+        return self.first_child[node] < 0
+
+    def children(self, node):
+        """
+        Returns range of child node ids.
+        """
+        first = self.first_child[node]
+        return range(first, first + self.num_children[node])
+
+class ArrayMCTS():
+    """
+    MCT Searcher over a SearchTree. Selection is a single vectorized PUCT argmax over each node's child slice. A batch of
+    leaves is evaluated with one network call and its paths are then backed up together: the virtual loss comes off and
+    the values go on with one scattered add over every node of every path, so there are no per-edge Python objects or
+    recursion. Experimental, see the module docstring: supports an iteration budget and leaf batching only.
+    """
+    def __init__(self, network, iterations=100, capacity=1 << 16, batch_size=1, virtual_loss=1):
+        self.network = network
+        self.tree = SearchTree(capacity)
+        self.iterations = iterations
+        # leaves selected under virtual loss and sent to the network together in one predict call
+        self.batch_size = batch_size
+        self.virtual_loss = virtual_loss
+        # preallocated network inputs for a batch of leaves
+        self.encoder = Encoder(batch_size)
+        # controls the balance between exploration and exploitation
+        self.tau = 1.0
+        self.c_puct = 1.0
+
+    def select(self, board):
+        """
+        Walks down from the root to a leaf by best PUCT score, applying each chosen move to board. Returns the path of
+        node ids from root to leaf.
+        """
+        tree = self.tree
+        node = 0
+        path = [0]
+        while tree.first_child[node] >= 0:
+            first = tree.first_child[node]
+            end = first + tree.num_children[node]
+            q = tree.Q[first:end]
+            if tree.turn[node] == Board.BLACK:
+                q = -q
+            u = (self.c_puct * math.sqrt(tree.N[node])) * tree.P[first:end] / (1 + tree.N[first:end])
+            node = first + int(np.argmax(q + u))
+            path.append(node)
+            board.apply_move_index(int(tree.move[node]))
+        return path
+
+    def add_children(self, node, move_indices, policy, turn):
+        """
+        Adds children for moves (as policy indexes) to node, with priors taken from a network policy output. turn is the
+        side to move at node.
+        """
+        # policy head outputs logits, so priors are the softmax over the legal moves
+        logits = np.asarray(policy, dtype=np.float32)[move_indices]
+        priors = np.exp(logits - logits.max()) if len(move_indices) else logits
+        priors /= priors.sum() if len(move_indices) else 1.
+        child_turn = Board.BLACK if turn == Board.WHITE else Board.WHITE
+        self.tree.add_children(node, move_indices, priors, child_turn)
+
+    def add_virtual_loss(self, path, loss):
+        """
+        Adds loss visits to every node on path that count as losses for the player choosing it, so that selections made
+        before the batch is evaluated spread out. backup_batch takes it off again.
+        """
+        tree = self.tree
+        tree.N[0] += loss
+        tree.Q[0] = tree.W[0] / tree.N[0]
+        for parent, node in zip(path, path[1:]):
+            # Q is from White's perspective, so a loss for the side choosing a node moves W against that side
+            tree.N[node] += loss
+            tree.W[node] += -loss if tree.turn[parent] == Board.WHITE else loss
+            tree.Q[node] = tree.W[node] / tree.N[node] if tree.N[node] else 0.
+
+    def backup_batch(self, paths, values, loss):
+        """
+        Takes virtual loss loss off every path and backpropagates values[i] along paths[i], for the whole batch at once.
+        Paths share nodes (the root at least), so the updates are unbuffered scattered adds.
+        """
+        if len(paths) == 1:
+            # not worth the array set up for a single path
+            if loss:
+                self.add_virtual_loss(paths[0], -loss)
+            self.backpropagate(float(values[0]), paths[0])
+            return
+        tree = self.tree
+        lengths = [len(path) for path in paths]
+        nodes = np.fromiter((node for path in paths for node in path), dtype=np.intp, count=sum(lengths))
+        # the loss each node took as W, by the side choosing it. The root has no chooser and took none
+        parents = tree.parent[nodes]
+        taken = np.where(tree.turn[np.maximum(parents, 0)] == Board.WHITE, -loss, loss) * (parents >= 0)
+        np.add.at(tree.N, nodes, 1 - loss)
+        np.subtract.at(tree.W, nodes, taken)
+        np.add.at(tree.W, nodes, np.repeat(np.asarray(values, dtype=np.float64), lengths))
+        touched = np.unique(nodes)
+        tree.Q[touched] = tree.W[touched] / tree.N[touched]
+
+    def backpropagate(self, v, path):
+        """
+        Adds a visit and reward v to every node on path, root included.
+        """
+        tree = self.tree
+        for node in path:
+            tree.N[node] += 1
+            tree.W[node] += v
+            tree.Q[node] = tree.W[node] / tree.N[node]
+
+    def run_batch(self, board, batch_size):
+        """
+        Selects up to batch_size leaves under virtual loss, evaluates them with one network call, then expands and
+        backpropagates them together. Terminal leaves are backpropagated straight away. Stops selecting early if a leaf
+        already waiting for evaluation is selected again. Returns number of simulations run.
+        """
+        root_depth = len(board.undo_stack)
+        # a single selection has no later selection to steer away
+        loss = self.virtual_loss if batch_size > 1 else 0
+        paths = []
+        pending_leaves = set()
+        pending = []
+        histories = []
+        simulations = 0
+        for i in range(0, batch_size):
+            path = self.select(board)
+            terminal, winner = board.is_terminal()
+            collision = False
+            if terminal:
+                self.backpropagate(terminal_value(winner), path)
+                simulations += 1
+            elif path[-1] in pending_leaves:
+                collision = True
+            else:
+                if loss:
+                    self.add_virtual_loss(path, loss)
+                paths.append(path)
+                pending_leaves.add(path[-1])
+                pending.append((board.generate_moves('index'), board.turn))
+                histories.append(board.history(self.encoder.history_length))
+            # walk the board back up to the root
+            while len(board.undo_stack) > root_depth:
+                board.undo_move()
+            if collision:
+                break
+        if paths:
+            x = self.encoder.encode_histories(histories, [turn for _, turn in pending])
+            q = self.network.predict(x, verbose=0)
+            for i, (move_indices, turn) in enumerate(pending):
+                self.add_children(paths[i][-1], move_indices, q[0][i], turn)
+            self.backup_batch(paths, q[1][:len(paths), 0], loss)
+            simulations += len(paths)
+        return simulations
+
+    def search(self, board):
+        """
+        Runs the search from board's current position, returning the board to it once search completes.
+        """
+        tree = self.tree
+        tree.reset(board.turn)
+        x = self.encoder.encode([board])
+        q = self.network.predict(x, verbose=0)
+        self.add_children(0, board.generate_moves('index'), q[0][0], board.turn)
+        simulations = 0
+        while simulations < self.iterations:
+            simulations += self.run_batch(board, min(self.batch_size, self.iterations - simulations))
+        children = tree.children(0)
+        visits = tree.N[children.start:children.stop]
+        N_sum = visits.sum()
+        move_probs = []
+        for child in children:
+            prob = (tree.N[child] ** (1 / self.tau)) / ((N_sum) ** (1/self.tau))
+            move_probs.append((Board.INDEX_TO_MOVE[int(tree.move[child])], float(prob), int(tree.N[child]), float(tree.Q[child])))
+        return move_probs
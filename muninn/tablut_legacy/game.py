@@ -1,4 +1,3 @@
-import matplotlib.pyplot as plt
 import numpy as np
 
 def generate_output_index():
@@ -343,6 +342,9 @@ def draw_board(board_state):
     """
     Draw the game board using matplotlib based on the given board state.
     """
+    # imported here so rule-only users don't pay matplotlib's start-up cost
+    import matplotlib.pyplot as plt
+
     # Reshape the 1x81 list to a 9x9 list
     board_state = np.reshape(board_state, (9, 9))
 